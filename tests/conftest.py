@@ -1,5 +1,7 @@
 import os
 
+import pytest
+
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 root_dir_content = os.listdir(BASE_DIR)
 PROJECT_DIR_NAME = 'yatube'
@@ -37,3 +39,16 @@ pytest_plugins = [
     'tests.fixtures.fixture_user',
     'tests.fixtures.fixture_data',
 ]
+
+
+@pytest.fixture(autouse=True)
+def query_guard(settings):
+    """Сторож SQL в строгом режиме: вьюхи не выходят за свои бюджеты."""
+    settings.QUERY_GUARD = True
+    settings.QUERY_GUARD_STRICT = True
+
+
+@pytest.fixture(autouse=True)
+def temp_media(mock_media):
+    """Картинки постов (mixer, загрузки) пишутся во временный MEDIA_ROOT."""
+    yield mock_media
@@ -0,0 +1,81 @@
+"""Компактные JSON-представления моделей для API.
+
+Сериализатор — это набор полей и функций, которые достают значение
+поля из объекта. Клиент может запросить только нужные ему поля
+(?fields=id,text), тогда остальные не попадают в ответ.
+"""
+from django.core.files.storage import default_storage
+
+FIELDS_SEPARATOR = ','
+
+
+def _file_url(file):
+    return default_storage.url(file.name) if file else None
+
+
+class Serializer:
+    fields = {}
+
+    def __init__(self, names=None):
+        if not names:
+            self.names = tuple(self.fields)
+            return
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            raise ValueError(f'Неизвестные поля: {", ".join(unknown)}')
+        self.names = tuple(names)
+
+    @classmethod
+    def from_query(cls, value):
+        """Сериализатор с полями из параметра ?fields=."""
+        names = [
+            name.strip() for name in (value or '').split(FIELDS_SEPARATOR)
+            if name.strip()
+        ]
+        return cls(names)
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def __call__(self, obj):
+        return {name: self.fields[name](obj) for name in self.names}
+
+
+class PostSerializer(Serializer):
+    fields = {
+        'id': lambda post: post.pk,
+        'text': lambda post: post.text,
+        'pub_date': lambda post: post.pub_date,
+        'updated': lambda post: post.updated,
+        'author': lambda post: post.author.username,
+        'group': lambda post: post.group.slug if post.group_id else None,
+        'image': lambda post: _file_url(post.image),
+        'thumbnail': lambda post: _file_url(post.thumbnail),
+        'comments_count': lambda post: post.comments_count,
+    }
+
+
+class GroupSerializer(Serializer):
+    fields = {
+        'id': lambda group: group.pk,
+        'slug': lambda group: group.slug,
+        'title': lambda group: group.title,
+        'description': lambda group: group.description,
+    }
+
+
+class CommentSerializer(Serializer):
+    fields = {
+        'id': lambda comment: comment.pk,
+        'post': lambda comment: comment.post_id,
+        'author': lambda comment: comment.author.username,
+        'text': lambda comment: comment.text,
+        'created': lambda comment: comment.created,
+    }
+
+
+class FollowSerializer(Serializer):
+    fields = {
+        'id': lambda follow: follow.pk,
+        'author': lambda follow: follow.author.username,
+    }
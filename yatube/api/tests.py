@@ -0,0 +1,190 @@
+import json
+from http import HTTPStatus
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from posts.models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+TEST_POST_COUNT = 13
+
+
+class ApiTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='api-author')
+        cls.reader = User.objects.create_user(username='api-reader')
+        cls.group = Group.objects.create(
+            title='Группа API', slug='api-group', description='Описание'
+        )
+        cls.posts = [
+            Post.objects.create(
+                author=cls.author, group=cls.group, text=f'Пост {i}'
+            )
+            for i in range(TEST_POST_COUNT)
+        ]
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.guest = Client()
+        self.client = Client()
+        self.client.force_login(self.reader)
+        self.author_client = Client()
+        self.author_client.force_login(self.author)
+
+    def test_posts_cursor_pages(self):
+        """Лента листается курсором до конца без повторов."""
+        url = reverse('api:post_list')
+        seen = []
+        while url:
+            data = self.guest.get(url).json()
+            seen.extend(post['id'] for post in data['results'])
+            url = data['next']
+        self.assertEqual(
+            seen, [post.pk for post in reversed(self.posts)]
+        )
+
+    def test_sparse_fieldsets(self):
+        """?fields= оставляет в ответе только запрошенные поля."""
+        response = self.guest.get(
+            reverse('api:post_list'), {'fields': 'id,author', 'limit': 2}
+        )
+        self.assertEqual(response.json()['results'], [
+            {'id': post.pk, 'author': 'api-author'}
+            for post in reversed(self.posts[-2:])
+        ])
+        response = self.guest.get(
+            reverse('api:post_list'), {'fields': 'id,password'}
+        )
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+    def test_unchanged_feed_is_not_modified(self):
+        """Повторный запрос с ETag отдает 304 без запросов к базе."""
+        url = reverse('api:post_list')
+        response = self.guest.get(url)
+        etag = response['ETag']
+        self.assertFalse(etag.startswith('W/'))
+        self.assertTrue(response.has_header('Last-Modified'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.guest.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(len(queries), 0)
+        last_modified = self.guest.get(url)['Last-Modified']
+        response = self.guest.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        Post.objects.create(author=self.author, text='Новый пост')
+        response = self.guest.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_create_post_with_form_validation(self):
+        """Пост создается через PostForm, группа задается slug'ом."""
+        url = reverse('api:post_list')
+        payload = {'text': 'Из приложения', 'group': 'api-group'}
+        response = self.guest.post(
+            url, json.dumps(payload), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+        response = self.client.post(
+            url, json.dumps(payload), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        post = Post.objects.get(pk=response.json()['id'])
+        self.assertEqual(
+            (post.author, post.group, post.text),
+            (self.reader, self.group, 'Из приложения'),
+        )
+        response = self.client.post(
+            url, json.dumps({'text': ''}), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertIn('text', response.json()['errors'])
+
+    def test_edit_and_delete_post(self):
+        """Править и удалять пост может только автор, If-Match проверяется."""
+        post = self.posts[0]
+        url = reverse('api:post_detail', args=[post.pk])
+        response = self.client.patch(
+            url, json.dumps({'text': 'Чужая правка'}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, HTTPStatus.FORBIDDEN)
+        etag = self.author_client.get(url)['ETag']
+        response = self.author_client.patch(
+            url, json.dumps({'text': 'Правка'}),
+            content_type='application/json', HTTP_IF_MATCH=etag,
+        )
+        self.assertEqual(response.json()['text'], 'Правка')
+        self.assertEqual(response.json()['group'], 'api-group')
+        response = self.author_client.delete(url, HTTP_IF_MATCH=etag)
+        self.assertEqual(
+            response.status_code, HTTPStatus.PRECONDITION_FAILED
+        )
+        response = self.author_client.delete(url)
+        self.assertEqual(response.status_code, HTTPStatus.NO_CONTENT)
+        self.assertFalse(Post.objects.filter(pk=post.pk).exists())
+
+    def test_comments(self):
+        """Комментарии проверяются CommentForm и листаются по id."""
+        post = self.posts[0]
+        url = reverse('api:comment_list', args=[post.pk])
+        for i in range(3):
+            response = self.client.post(url, {'text': f'Комментарий {i}'})
+            self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        data = self.guest.get(url, {'limit': 2}).json()
+        self.assertEqual(
+            [comment['text'] for comment in data['results']],
+            ['Комментарий 0', 'Комментарий 1'],
+        )
+        data = self.guest.get(data['next']).json()
+        self.assertEqual(data['results'][0]['author'], 'api-reader')
+        self.assertIsNone(data['next'])
+        self.assertEqual(Comment.objects.filter(post=post).count(), 3)
+
+    def test_follows_and_feed(self):
+        """Подписки меняются через API, лента подписок видит их."""
+        other = User.objects.create_user(username='api-other')
+        Post.objects.create(author=other, text='Пост другого автора')
+        feed = reverse('api:follow_feed')
+        self.assertEqual(
+            self.guest.get(feed).status_code, HTTPStatus.UNAUTHORIZED
+        )
+        etag = self.client.get(feed)['ETag']
+        response = self.client.post(
+            reverse('api:follow_list'),
+            json.dumps({'author': 'api-other'}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        response = self.client.get(feed, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(
+            response.json()['results'][0]['text'], 'Пост другого автора'
+        )
+        follows = self.client.get(reverse('api:follow_list')).json()
+        self.assertEqual(
+            [follow['author'] for follow in follows['results']],
+            ['api-author', 'api-other'],
+        )
+        response = self.client.delete(
+            reverse('api:follow_delete', args=['api-other'])
+        )
+        self.assertEqual(response.status_code, HTTPStatus.NO_CONTENT)
+
+    def test_groups(self):
+        response = self.guest.get(
+            reverse('api:group_detail', args=['api-group'])
+        )
+        self.assertEqual(response.json()['title'], 'Группа API')
+        response = self.guest.get(
+            reverse('api:post_list'), {'group': 'missing'}
+        )
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        self.assertEqual(response.json(), {'detail': 'Не найдено'})
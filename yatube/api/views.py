@@ -0,0 +1,422 @@
+"""JSON API лент, постов, групп, комментариев и подписок.
+
+Ленты листаются тем же курсором по (pub_date, id), что и HTML-страницы.
+Ответы GET получают сильный ETag из поколений кеша (posts.caching),
+адреса и пользователя, поэтому If-None-Match проверяется до обращения
+к базе за данными: неизменившаяся лента отдает 304 без сериализации.
+Last-Modified последнего ответа с тем же ETag хранится в кеше, так что
+и If-Modified-Since отвечается без запросов к базе.
+
+Записи проверяются формами сайта (PostForm, CommentForm) и принимают
+JSON или multipart (картинка поста). Авторизация — сессия сайта.
+"""
+import hashlib
+import json
+from functools import wraps
+
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.db import transaction
+from django.http import Http404, HttpResponse, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import (
+    get_conditional_response, patch_cache_control, patch_vary_headers,
+)
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.vary import vary_on_cookie
+
+from core.queryguard import query_budget
+from posts import thumbnails
+from posts.caching import FOLLOWS, POSTS, cache_feed, generations
+from posts.feed import FeedPaginator
+from posts.forms import CommentForm, PostForm
+from posts.models import Follow, Group, Post, User
+from posts.utils import COUNT_POST_PAGE, CursorPaginator
+
+from .serializers import (
+    CommentSerializer, FollowSerializer, GroupSerializer, PostSerializer,
+)
+
+API_VERSION = 1
+
+MAX_PAGE_SIZE: int = 100
+
+LAST_MODIFIED_KEY = 'api_last_modified.{}'
+
+JSON_PARAMS = {'ensure_ascii': False, 'separators': (',', ':')}
+
+
+class ApiError(Exception):
+    def __init__(self, status, detail, **extra):
+        super().__init__(detail)
+        self.status = status
+        self.body = {'detail': detail, **extra}
+
+
+def json_response(data, status=200, last_modified=None):
+    response = JsonResponse(
+        data, status=status, safe=False, json_dumps_params=JSON_PARAMS
+    )
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
+
+
+def api_view(*methods):
+    """Пропускает только методы methods, ошибки отдает в JSON."""
+    allowed = set(methods) | ({'HEAD'} if 'GET' in methods else set())
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in allowed:
+                response = json_response(
+                    {'detail': 'Метод не поддерживается'}, status=405
+                )
+                response['Allow'] = ', '.join(sorted(allowed))
+                return response
+            try:
+                return view(request, *args, **kwargs)
+            except ApiError as error:
+                return json_response(error.body, status=error.status)
+            except Http404:
+                return json_response({'detail': 'Не найдено'}, status=404)
+            except PermissionDenied:
+                return json_response({'detail': 'Нет доступа'}, status=403)
+        return wrapper
+    return decorator
+
+
+def _etag(request, scopes):
+    versions = '.'.join(str(version) for version in generations(*scopes))
+    raw = (
+        f'{API_VERSION}|{request.get_full_path()}|'
+        f'{request.user.pk}|{versions}'
+    )
+    return '"{}"'.format(hashlib.sha1(raw.encode()).hexdigest())
+
+
+def conditional(*scopes):
+    """Условные запросы по ETag из поколений областей кеша scopes.
+
+    ETag меняется вместе с поколением, то есть при любой записи,
+    которая сбрасывает кеш страниц. If-Match для PATCH и DELETE
+    защищает от перезаписи чужих изменений: 412 Precondition Failed.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            etag = _etag(request, scopes)
+            key = LAST_MODIFIED_KEY.format(etag)
+            last_modified = None
+            if request.META.get('HTTP_IF_MODIFIED_SINCE'):
+                last_modified = cache.get(key)
+            response = get_conditional_response(
+                request,
+                etag=etag,
+                last_modified=last_modified and parse_http_date_safe(
+                    last_modified
+                ),
+            )
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if request.method not in ('GET', 'HEAD'):
+                    return response
+                if response.status_code != 200:
+                    return response
+                if response.has_header('Last-Modified'):
+                    cache.set(key, response['Last-Modified'], None)
+            elif last_modified:
+                response['Last-Modified'] = last_modified
+            response['ETag'] = etag
+            patch_cache_control(response, private=True, no_cache=True)
+            patch_vary_headers(response, ('Cookie',))
+            return response
+        return wrapper
+    return decorator
+
+
+def _require_login(request):
+    if not request.user.is_authenticated:
+        raise ApiError(401, 'Нужна авторизация')
+
+
+def _serializer(serializer_class, request):
+    try:
+        return serializer_class.from_query(request.GET.get('fields'))
+    except ValueError as error:
+        raise ApiError(400, str(error))
+
+
+def _limit(request):
+    try:
+        limit = int(request.GET.get('limit', COUNT_POST_PAGE))
+    except ValueError:
+        raise ApiError(400, 'limit должен быть числом')
+    return min(max(limit, 1), MAX_PAGE_SIZE)
+
+
+def _link(request, **params):
+    query = request.GET.copy()
+    for name in ('after', 'before'):
+        query.pop(name, None)
+    for name, value in params.items():
+        query[name] = value
+    return f'{request.path}?{query.urlencode()}'
+
+
+def _posts_page(request, posts):
+    """Страница постов по курсору (pub_date, id), новые первыми."""
+    serializer = _serializer(PostSerializer, request)
+    paginator = CursorPaginator(
+        posts.for_feed(with_text='text' in serializer), _limit(request)
+    )
+    return _cursor_response(request, serializer, paginator)
+
+
+def _cursor_response(request, serializer, paginator):
+    page = paginator.cursor_page(
+        after=request.GET.get('after'), before=request.GET.get('before')
+    )
+    data = {
+        'results': [serializer(post) for post in page],
+        'next': None,
+        'previous': None,
+    }
+    if paginator.has_next:
+        data['next'] = _link(request, after=paginator.next_cursor)
+    if paginator.has_previous:
+        data['previous'] = _link(request, before=paginator.previous_cursor)
+    last_modified = max((post.updated for post in page), default=None)
+    return json_response(data, last_modified=last_modified)
+
+
+def _pk_page(request, queryset, serializer_class, date_field=None):
+    """Страница объектов по возрастанию id после курсора ?after=<id>."""
+    serializer = _serializer(serializer_class, request)
+    limit = _limit(request)
+    after = request.GET.get('after')
+    if after:
+        try:
+            queryset = queryset.filter(pk__gt=int(after))
+        except ValueError:
+            raise ApiError(400, 'Некорректный курсор')
+    rows = list(queryset.order_by('pk')[:limit + 1])
+    data = {
+        'results': [serializer(row) for row in rows[:limit]],
+        'next': None,
+    }
+    if len(rows) > limit:
+        data['next'] = _link(request, after=rows[limit - 1].pk)
+    last_modified = None
+    if date_field:
+        last_modified = max(
+            (getattr(row, date_field) for row in rows[:limit]), default=None
+        )
+    return json_response(data, last_modified=last_modified)
+
+
+def _payload(request):
+    """Данные записи: JSON-объект или поля и файлы multipart-формы."""
+    if request.content_type != 'application/json':
+        return request.POST, request.FILES
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        raise ApiError(400, 'Тело запроса не является JSON')
+    if not isinstance(data, dict):
+        raise ApiError(400, 'Ожидается JSON-объект')
+    return data, None
+
+
+def _post_form(request, post=None):
+    """PostForm из данных запроса; группа передается slug'ом."""
+    data, files = _payload(request)
+    fields = {'text': post.text, 'group': post.group_id} if post else {}
+    fields.update(
+        (name, data.get(name)) for name in ('text', 'group') if name in data
+    )
+    if 'group' in data and data.get('group'):
+        group_id = Group.objects.filter(slug=data.get('group')).values_list(
+            'pk', flat=True
+        ).first()
+        # Незнакомый slug оставляем как есть, его отвергнет форма.
+        fields['group'] = group_id or data.get('group')
+    return PostForm(fields, files=files or None, instance=post)
+
+
+def _form_error(form):
+    return json_response(
+        {'detail': 'Ошибка в данных', 'errors': form.errors.get_json_data()},
+        status=400,
+    )
+
+
+def _created(serializer_class, obj):
+    return json_response(serializer_class()(obj), status=201)
+
+
+@query_budget(15)
+@api_view('GET', 'POST')
+@conditional(POSTS)
+@vary_on_cookie
+@cache_feed(POSTS)
+def post_list(request):
+    if request.method == 'POST':
+        return _create_post(request)
+    posts = Post.objects.all()
+    if request.GET.get('group'):
+        posts = posts.filter(
+            group=get_object_or_404(Group, slug=request.GET['group'])
+        )
+    if request.GET.get('author'):
+        posts = posts.filter(
+            author=get_object_or_404(User, username=request.GET['author'])
+        )
+    return _posts_page(request, posts)
+
+
+@transaction.atomic
+def _create_post(request):
+    _require_login(request)
+    form = _post_form(request)
+    if not form.is_valid():
+        return _form_error(form)
+    post = form.save(commit=False)
+    post.author = request.user
+    post.save()
+    if post.image:
+        thumbnails.schedule(post)
+    return _created(PostSerializer, post)
+
+
+@query_budget(12)
+@api_view('GET', 'PATCH', 'DELETE')
+@conditional(POSTS)
+def post_detail(request, post_id):
+    post = get_object_or_404(
+        Post.objects.select_related('author', 'group'), pk=post_id
+    )
+    if request.method == 'GET':
+        return json_response(
+            _serializer(PostSerializer, request)(post),
+            last_modified=post.updated,
+        )
+    _require_login(request)
+    if post.author_id != request.user.pk:
+        raise PermissionDenied
+    if request.method == 'DELETE':
+        post.delete()
+        return HttpResponse(status=204)
+    return _update_post(request, post)
+
+
+@transaction.atomic
+def _update_post(request, post):
+    form = _post_form(request, post)
+    if not form.is_valid():
+        return _form_error(form)
+    post = form.save(commit=False)
+    if 'image' in form.changed_data:
+        post.thumbnail = ''
+        post.renditions = ''
+    post.save()
+    if post.image and not post.thumbnail:
+        thumbnails.schedule(post)
+    return json_response(PostSerializer()(post))
+
+
+@query_budget(13)
+@api_view('GET', 'POST')
+@conditional(POSTS)
+def comment_list(request, post_id):
+    post = get_object_or_404(Post.objects.only('pk', 'group'), pk=post_id)
+    if request.method == 'GET':
+        return _pk_page(
+            request,
+            post.comments.select_related('author'),
+            CommentSerializer,
+            date_field='created',
+        )
+    return _create_comment(request, post)
+
+
+@transaction.atomic
+def _create_comment(request, post):
+    _require_login(request)
+    form = CommentForm(_payload(request)[0])
+    if not form.is_valid():
+        return _form_error(form)
+    comment = form.save(commit=False)
+    comment.author = request.user
+    comment.post = post
+    comment.save()
+    return _created(CommentSerializer, comment)
+
+
+@query_budget(3)
+@api_view('GET')
+@conditional(POSTS)
+def group_list(request):
+    return _pk_page(request, Group.objects.all(), GroupSerializer)
+
+
+@query_budget(3)
+@api_view('GET')
+@conditional(POSTS)
+def group_detail(request, slug):
+    return json_response(
+        _serializer(GroupSerializer, request)(
+            get_object_or_404(Group, slug=slug)
+        )
+    )
+
+
+@query_budget(4)
+@api_view('GET')
+@conditional(POSTS, FOLLOWS)
+@vary_on_cookie
+@cache_feed(POSTS, FOLLOWS)
+def follow_feed(request):
+    _require_login(request)
+    serializer = _serializer(PostSerializer, request)
+    paginator = FeedPaginator(
+        request.user, _limit(request), with_text='text' in serializer
+    )
+    return _cursor_response(request, serializer, paginator)
+
+
+@query_budget(16)
+@api_view('GET', 'POST')
+@conditional(FOLLOWS)
+def follow_list(request):
+    _require_login(request)
+    if request.method == 'GET':
+        return _pk_page(
+            request,
+            Follow.objects.filter(user=request.user).select_related('author'),
+            FollowSerializer,
+        )
+    username = _payload(request)[0].get('author')
+    author = get_object_or_404(User, username=username or '')
+    if author == request.user:
+        raise ApiError(400, 'Нельзя подписаться на себя')
+    follow, created = Follow.objects.get_or_create(
+        user=request.user, author=author
+    )
+    return json_response(
+        FollowSerializer()(follow), status=201 if created else 200
+    )
+
+
+@query_budget(11)
+@api_view('DELETE')
+def follow_delete(request, username):
+    _require_login(request)
+    author = get_object_or_404(User, username=username)
+    deleted, _ = Follow.objects.filter(
+        user=request.user, author=author
+    ).delete()
+    if not deleted:
+        raise Http404
+    return HttpResponse(status=204)
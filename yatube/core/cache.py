@@ -0,0 +1,252 @@
+"""Двухуровневый кеш: L1 в памяти процесса поверх общего L2.
+
+L1 — небольшой LRU с коротким сроком жизни, общий для всех потоков
+процесса; он снимает с общего кеша горячие ключи (карточки постов,
+страницы лент). L2 — любой бэкенд из CACHES, общий для всех
+воркеров (memcached, Redis, файловый кеш). Запись, удаление и incr
+идут в L2 и сразу обновляют L1 своего процесса; другие процессы
+увидят изменение не позже чем через L1_TIMEOUT секунд.
+
+Ключи с префиксами из L1_EXEMPT в L1 не попадают и всегда читаются
+из L2: так другие воркеры сразу видят новое поколение ленты, а
+не отдают устаревшие страницы до L1_TIMEOUT секунд.
+
+get_or_set защищен от лавины промахов: значение пересчитывает один
+поток процесса и один процесс на кластер (блокировка через add в L2),
+остальные ждут его результат.
+"""
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from .instrumentation import record_cache
+
+MISSING = object()
+
+LOCK_SUFFIX = ':lock'
+
+LOCK_POLL_INTERVAL = 0.01
+
+_tiers = {}
+_tiers_lock = threading.Lock()
+
+
+class _LocalTier:
+    """LRU-словарь процесса со сроком жизни записей."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.flights = {}
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return MISSING
+            expires, pickled = entry
+            if expires <= time.monotonic():
+                del self.entries[key]
+                return MISSING
+            self.entries.move_to_end(key)
+        return pickle.loads(pickled)
+
+    def set(self, key, value, timeout):
+        # Значения хранятся сериализованными: вызывающий код может
+        # менять полученный объект (ответы, списки), не портя кеш.
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.entries[key] = (time.monotonic() + timeout, pickled)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def flight_lock(self, key):
+        with self.lock:
+            return self.flights.setdefault(key, threading.Lock())
+
+    def land(self, key):
+        with self.lock:
+            self.flights.pop(key, None)
+
+
+def _local_tier(name, max_entries):
+    with _tiers_lock:
+        if name not in _tiers:
+            _tiers[name] = _LocalTier(max_entries)
+        return _tiers[name]
+
+
+class TwoTierCache(BaseCache):
+    """Бэкенд кеша: LOCATION — алиас общего кеша L2 в CACHES.
+
+    OPTIONS:
+        L1_TIMEOUT — сколько секунд значение живет в L1 (2);
+        L1_MAX_ENTRIES — размер L1 (1000);
+        LOCK_TIMEOUT — сколько ждать чужого пересчета в get_or_set (10);
+        L1_EXEMPT — префиксы ключей, которые читаются только из L2 (()).
+    """
+
+    def __init__(self, location, params):
+        options = params.get('OPTIONS', {})
+        super().__init__(params)
+        self._shared_alias = location
+        self.l1_timeout = options.get('L1_TIMEOUT', 2)
+        self.lock_timeout = options.get('LOCK_TIMEOUT', 10)
+        self.l1_exempt = tuple(options.get('L1_EXEMPT', ()))
+        self._local = _local_tier(
+            location, options.get('L1_MAX_ENTRIES', 1000)
+        )
+
+    @property
+    def shared(self):
+        return caches[self._shared_alias]
+
+    def _l1_key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _l1_get(self, key, version):
+        if key.startswith(self.l1_exempt):
+            return MISSING
+        return self._local.get(self._l1_key(key, version))
+
+    def _l1_set(self, key, version, value, timeout):
+        if not key.startswith(self.l1_exempt):
+            self._local.set(self._l1_key(key, version), value, timeout)
+
+    def _l1_timeout(self, timeout):
+        timeout = self.get_backend_timeout(timeout)
+        if timeout is None:
+            return self.l1_timeout
+        return min(self.l1_timeout, max(timeout - time.time(), 0))
+
+    def get(self, key, default=None, version=None):
+        value = self._l1_get(key, version)
+        if value is not MISSING:
+            record_cache(1, 0)
+            return value
+        value = self.shared.get(key, MISSING, version=version)
+        if value is MISSING:
+            record_cache(0, 1)
+            return default
+        record_cache(1, 0)
+        self._l1_set(key, version, value, self.l1_timeout)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        self.shared.set(key, value, timeout, version=version)
+        self._l1_set(key, version, value, self._l1_timeout(timeout))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        added = self.shared.add(key, value, timeout, version=version)
+        if added:
+            self._l1_set(key, version, value, self._l1_timeout(timeout))
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        return self.shared.touch(key, timeout, version=version)
+
+    def delete(self, key, version=None):
+        self.shared.delete(key, version=version)
+        self._local.delete(self._l1_key(key, version))
+
+    def incr(self, key, delta=1, version=None):
+        value = self.shared.incr(key, delta, version=version)
+        self._l1_set(key, version, value, self.l1_timeout)
+        return value
+
+    def get_many(self, keys, version=None):
+        found = {}
+        missed = []
+        for key in keys:
+            value = self._l1_get(key, version)
+            if value is MISSING:
+                missed.append(key)
+            else:
+                found[key] = value
+        if missed:
+            shared = self.shared.get_many(missed, version=version)
+            for key, value in shared.items():
+                self._l1_set(key, version, value, self.l1_timeout)
+            found.update(shared)
+        record_cache(len(found), len(keys) - len(found))
+        return found
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        failed = self.shared.set_many(data, timeout, version=version) or []
+        for key, value in data.items():
+            if key not in failed:
+                self._l1_set(key, version, value, self._l1_timeout(timeout))
+        return failed
+
+    def delete_many(self, keys, version=None):
+        self.shared.delete_many(keys, version=version)
+        for key in keys:
+            self._local.delete(self._l1_key(key, version))
+
+    def has_key(self, key, version=None):
+        return self.get(key, MISSING, version=version) is not MISSING
+
+    def clear(self):
+        self.shared.clear()
+        self._local.clear()
+
+    def get_or_set(self, key, default, timeout=DEFAULT_TIMEOUT, version=None):
+        value = self.get(key, MISSING, version=version)
+        if value is not MISSING:
+            return value
+        if not callable(default):
+            self.add(key, default, timeout, version=version)
+            return self.get(key, default, version=version)
+        l1_key = self._l1_key(key, version)
+        with self._local.flight_lock(l1_key):
+            try:
+                value = self.get(key, MISSING, version=version)
+                if value is MISSING:
+                    value = self._compute_once(key, default, timeout, version)
+            finally:
+                self._local.land(l1_key)
+        return value
+
+    def _compute_once(self, key, default, timeout, version):
+        lock_key = key + LOCK_SUFFIX
+        if self.shared.add(lock_key, 1, self.lock_timeout, version=version):
+            try:
+                value = default()
+                self.set(key, value, timeout, version=version)
+            finally:
+                self.shared.delete(lock_key, version=version)
+            return value
+        deadline = time.monotonic() + self.lock_timeout
+        while time.monotonic() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL)
+            value = self.shared.get(key, MISSING, version=version)
+            if value is not MISSING:
+                self._l1_set(key, version, value, self.l1_timeout)
+                return value
+        value = default()
+        self.set(key, value, timeout, version=version)
+        return value
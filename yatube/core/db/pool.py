@@ -0,0 +1,230 @@
+"""Пул соединений с базой для бэкендов core.db.
+
+Django 2.2 держит соединение в потоке: при CONN_MAX_AGE = 0 каждый
+запрос заново подключается к базе, а при CONN_MAX_AGE > 0 каждый поток
+(пул core.parallel, потоки WSGI- и ASGI-сервера) держит свое
+соединение, и их число ничем не ограничено.
+
+С пулом (ключ POOL в DATABASES) поток отдает соединение в пул в конце
+каждого запроса, а физические соединения живут CONN_MAX_AGE секунд
+(None — бессрочно) и переиспользуются любыми потоками. Открыто не
+больше MAX_SIZE соединений: лишний запрос ждет свободное до TIMEOUT
+секунд. Соединение, простоявшее в пуле дольше CHECK_INTERVAL секунд,
+перед выдачей проверяется запросом SELECT 1.
+
+Поток держит не больше одного соединения с каждой базой и отдает его
+перед тем, как ждать другие потоки (core.parallel.gather), поэтому
+MAX_SIZE не меньше числа потоков процесса, которые ходят в базу, —
+пул не кончается. ASGI-вход yatube/asgi.py проверяет это при запуске
+(check_capacity).
+"""
+import threading
+import time
+from collections import deque
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+
+_pools = {}
+
+_pools_lock = threading.Lock()
+
+
+class PoolTimeout(Exception):
+    """Все MAX_SIZE соединений заняты дольше TIMEOUT секунд."""
+
+
+class ConnectionPool:
+    """Свободные соединения одной базы и счетчик открытых."""
+
+    def __init__(self, max_size, timeout=10, max_age=None,
+                 check_interval=30):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_age = max_age
+        self.check_interval = check_interval
+        # (соединение, когда открыто, когда вернулось в пул)
+        self.idle = deque()
+        self.opened = {}
+        self.condition = threading.Condition()
+        self.connects = 0
+
+    @property
+    def size(self):
+        return len(self.opened)
+
+    def acquire(self, connect):
+        """Свободное соединение из пула или новое из connect()."""
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self.condition:
+                while not self.idle and self.size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(
+                            f'Все {self.max_size} соединений с базой заняты'
+                        )
+                    self.condition.wait(remaining)
+                if not self.idle:
+                    # Место под новое соединение занято до его открытия.
+                    placeholder = object()
+                    self.opened[id(placeholder)] = None
+                    break
+                conn, released = self.idle.pop()
+            if self._usable(conn, released):
+                return conn
+            self._discard(conn)
+        try:
+            conn = connect()
+        except BaseException:
+            self._forget(placeholder)
+            raise
+        with self.condition:
+            del self.opened[id(placeholder)]
+            self.opened[id(conn)] = time.monotonic()
+            self.connects += 1
+        return conn
+
+    def release(self, conn, discard=False):
+        """Возвращает соединение в пул; discard — закрыть его."""
+        if not discard:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+        if discard or self._expired(conn):
+            self._discard(conn)
+            return
+        with self.condition:
+            self.idle.append((conn, time.monotonic()))
+            self.condition.notify()
+
+    def close(self):
+        """Закрывает свободные соединения; занятые закроются при возврате."""
+        with self.condition:
+            idle, self.idle = list(self.idle), deque()
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def _expired(self, conn):
+        opened = self.opened.get(id(conn))
+        return (
+            self.max_age is not None and opened is not None
+            and time.monotonic() - opened >= self.max_age
+        )
+
+    def _usable(self, conn, released):
+        if self._expired(conn):
+            return False
+        if time.monotonic() - released < self.check_interval:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+        except Exception:
+            return False
+        return True
+
+    def _forget(self, conn):
+        with self.condition:
+            self.opened.pop(id(conn), None)
+            self.condition.notify()
+
+    def _discard(self, conn):
+        self._forget(conn)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def get_pool(key, options, max_age):
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(
+                options['MAX_SIZE'],
+                timeout=options.get('TIMEOUT', 10),
+                max_age=max_age,
+                check_interval=options.get('CHECK_INTERVAL', 30),
+            )
+        return _pools[key]
+
+
+def check_capacity(threads, handler=None):
+    """Поднимает ImproperlyConfigured, если пулу базы не хватит на threads.
+
+    handler — ConnectionHandler, по умолчанию django.db.connections.
+    """
+    for connection in (handler or connections).all():
+        if not getattr(connection, 'pooled', False):
+            continue
+        size = connection.settings_dict['POOL']['MAX_SIZE']
+        if size < threads:
+            raise ImproperlyConfigured(
+                f'POOL MAX_SIZE базы {connection.alias} ({size}) меньше '
+                f'числа потоков, которые держат соединения ({threads})'
+            )
+
+
+def close_pools():
+    """Закрывает свободные соединения всех пулов и забывает пулы."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+class PooledDatabaseMixin:
+    """Примесь к DatabaseWrapper: соединения берутся из пула."""
+
+    discard = False
+
+    @property
+    def pooled(self):
+        options = self.settings_dict.get('POOL') or {}
+        return bool(options.get('MAX_SIZE'))
+
+    @property
+    def pool(self):
+        return get_pool(
+            (self.alias, self.settings_dict['NAME']),
+            self.settings_dict['POOL'],
+            self.settings_dict['CONN_MAX_AGE'],
+        )
+
+    def open_connection(self, conn_params):
+        """Новое физическое соединение."""
+        return super().get_new_connection(conn_params)
+
+    def get_new_connection(self, conn_params):
+        if not self.pooled:
+            return self.open_connection(conn_params)
+        try:
+            return self.pool.acquire(
+                lambda: self.open_connection(conn_params)
+            )
+        except PoolTimeout as error:
+            raise self.Database.OperationalError(str(error)) from error
+
+    def close_if_unusable_or_obsolete(self):
+        if (
+            self.connection is None or not self.pooled
+            or self.in_atomic_block
+        ):
+            return super().close_if_unusable_or_obsolete()
+        # Вне транзакции соединение возвращается в пул после каждого
+        # запроса, а сломанное закрывается.
+        self.discard = (
+            self.get_autocommit() != self.settings_dict['AUTOCOMMIT']
+            or (self.errors_occurred and not self.is_usable())
+        )
+        self.close()
+
+    def _close(self):
+        if self.connection is None or not self.pooled:
+            return super()._close()
+        discard, self.discard = self.discard, False
+        with self.wrap_database_errors:
+            self.pool.release(self.connection, discard=discard)
@@ -0,0 +1,8 @@
+"""PostgreSQL с пулом соединений (нужен пакет psycopg2)."""
+from django.db.backends.postgresql import base
+
+from ..pool import PooledDatabaseMixin
+
+
+class DatabaseWrapper(PooledDatabaseMixin, base.DatabaseWrapper):
+    pass
@@ -0,0 +1,140 @@
+"""Чтение с реплик и запись в основную базу.
+
+ReplicaRouter отправляет чтения на одну из реплик DATABASE_REPLICAS, а
+запись и чтения внутри транзакции — в основную базу default. Реплика
+отстает от основной базы, поэтому после записи поток закрепляется за
+основной базой (pin): до конца запроса все его чтения идут туда же.
+
+ReplicaPinMiddleware продлевает закрепление на следующие запросы того
+же браузера: ответ на запрос с записью ставит куку на
+REPLICA_PIN_SECONDS секунд (это должно быть больше отставания реплик),
+и пока она жива, чтения этого пользователя тоже идут в основную базу.
+Так автор сразу видит свой пост, комментарий или подписку, а чтения
+остальных пользователей уходят на реплики.
+
+Локально реплики — копии файла SQLite, которые обновляет команда
+sync_replicas.
+"""
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PIN_COOKIE = 'primary_until'
+
+_local = threading.local()
+
+
+def replicas():
+    return settings.DATABASE_REPLICAS
+
+
+def is_pinned():
+    return getattr(_local, 'pinned', False)
+
+
+def pin():
+    """Закрепляет поток за основной базой после записи."""
+    _local.pinned = _local.wrote = True
+
+
+def unpin():
+    _local.pinned = _local.wrote = False
+
+
+@contextmanager
+def primary():
+    """Направляет чтения потока в основную базу внутри блока.
+
+    Нужен фоновым задачам, которые читают только что записанное
+    (миниатюры после коммита поста).
+    """
+    previous = is_pinned()
+    _local.pinned = True
+    try:
+        yield
+    finally:
+        _local.pinned = previous
+
+
+@contextmanager
+def pinning(pinned):
+    """Переносит закрепление вызывающего потока в поток пула."""
+    previous = is_pinned()
+    _local.pinned = pinned
+    try:
+        yield
+    finally:
+        _local.pinned = previous
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        aliases = replicas()
+        if (
+            not aliases
+            or is_pinned()
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return DEFAULT_DB_ALIAS
+        return random.choice(aliases)
+
+    def db_for_write(self, model, **hints):
+        pin()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схему реплики получают вместе с данными основной базы.
+        return db not in replicas()
+
+
+class ReplicaPinMiddleware:
+    """Закрепляет за основной базой запросы сразу после записи."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _local.pinned = self.pinned_by_cookie(request)
+        _local.wrote = False
+        try:
+            response = self.get_response(request)
+            if _local.wrote and replicas():
+                response.set_cookie(
+                    PIN_COOKIE,
+                    str(int(time.time() + settings.REPLICA_PIN_SECONDS)),
+                    max_age=settings.REPLICA_PIN_SECONDS,
+                    httponly=True,
+                    samesite='Lax',
+                )
+            return response
+        finally:
+            unpin()
+
+    @staticmethod
+    def pinned_by_cookie(request):
+        try:
+            return int(request.COOKIES[PIN_COOKIE]) > time.time()
+        except (KeyError, ValueError):
+            return False
+
+
+def copy_sqlite(source, target):
+    """Копирует файл SQLite source в target, не мешая читателям target."""
+    source_db = sqlite3.connect(source)
+    target_db = sqlite3.connect(target)
+    try:
+        source_db.backup(target_db)
+    finally:
+        target_db.close()
+        source_db.close()
@@ -0,0 +1,40 @@
+"""SQLite с пулом соединений и настройками PRAGMA.
+
+PRAGMAS из DATABASES выполняются на каждом новом соединении, например
+journal_mode = WAL (читатели не ждут писателя), synchronous = NORMAL,
+mmap_size и busy_timeout. При TRANSACTION_MODE = 'IMMEDIATE'
+транзакции начинаются с BEGIN IMMEDIATE: блокировка записи берется
+сразу, и две транзакции, прочитавшие данные, не упираются друг в
+друга при переходе к записи ("database is locked" без ожидания
+busy_timeout).
+
+База в памяти (тесты) пул не использует: ее соединения Django не
+закрывает.
+"""
+from django.db.backends.sqlite3 import base
+
+from ..pool import PooledDatabaseMixin
+
+# Записываются в файл базы. Смена journal_mode требует блокировки,
+# поэтому такие PRAGMA выполняются, только если значение другое.
+PERSISTENT_PRAGMAS = {'journal_mode'}
+
+
+class DatabaseWrapper(PooledDatabaseMixin, base.DatabaseWrapper):
+    @property
+    def pooled(self):
+        return super().pooled and not self.is_in_memory_db()
+
+    def open_connection(self, conn_params):
+        conn = super().open_connection(conn_params)
+        for name, value in (self.settings_dict.get('PRAGMAS') or {}).items():
+            if name in PERSISTENT_PRAGMAS:
+                current = conn.execute(f'PRAGMA {name}').fetchone()[0]
+                if str(current).lower() == str(value).lower():
+                    continue
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        mode = self.settings_dict.get('TRANSACTION_MODE')
+        self.cursor().execute(f'BEGIN {mode}' if mode else 'BEGIN')
@@ -0,0 +1,213 @@
+"""Замеры запросов: SQL, рендеринг шаблонов и обращения к кешу.
+
+InstrumentationMiddleware считает каждый запрос и его длительность по
+имени вьюхи. Подробно замеряется только доля запросов
+INSTRUMENTATION_SAMPLE_RATE: для них собираются число и время
+SQL-запросов, повторы одного и того же запроса, время рендеринга
+шаблонов, попадания и промахи кеша. Результат уходит в заголовок
+Server-Timing ответа и в метрики процесса (core.metrics), которые
+отдает вьюха core.views.metrics.
+
+Сборщик хранится в thread-local, поэтому вне выборки накладные
+расходы сводятся к одному getattr на обращение к кешу или шаблону.
+"""
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates
+from django.template.backends.django import Template as DjangoTemplate
+from django.template.backends.django import reraise
+
+from .metrics import REGISTRY
+
+UNRESOLVED = 'unresolved'
+
+_local = threading.local()
+
+REGISTRY.describe(
+    'yatube_requests_total', 'counter', 'Обработанные запросы.'
+)
+REGISTRY.describe(
+    'yatube_request_duration_seconds', 'histogram',
+    'Длительность обработки запроса.',
+)
+REGISTRY.describe(
+    'yatube_sampled_requests_total', 'counter',
+    'Запросы, попавшие в подробную выборку.',
+)
+REGISTRY.describe(
+    'yatube_db_queries_total', 'counter',
+    'SQL-запросы в запросах из выборки.',
+)
+REGISTRY.describe(
+    'yatube_db_duplicate_queries_total', 'counter',
+    'Повторы одного и того же SQL с теми же параметрами.',
+)
+REGISTRY.describe(
+    'yatube_db_seconds_total', 'counter',
+    'Время SQL-запросов в запросах из выборки.',
+)
+REGISTRY.describe(
+    'yatube_template_seconds_total', 'counter',
+    'Время рендеринга шаблонов в запросах из выборки.',
+)
+REGISTRY.describe(
+    'yatube_cache_requests_total', 'counter',
+    'Чтения кеша в запросах из выборки.',
+)
+
+
+class RequestStats:
+    """Замеры одного запроса."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements = Counter()
+        self.template_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    @property
+    def duplicates(self):
+        return sum(count - 1 for count in self.statements.values())
+
+    def execute(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+            self.statements[(sql, str(params))] += 1
+
+    def server_timing(self, duration):
+        """Значение заголовка Server-Timing, длительности в мс."""
+        return ', '.join((
+            f'db;dur={self.db_time * 1000:.1f};'
+            f'desc="{self.queries} queries, {self.duplicates} duplicate"',
+            f'tpl;dur={self.template_time * 1000:.1f}',
+            f'cache;desc="{self.cache_hits} hit, {self.cache_misses} miss"',
+            f'total;dur={duration * 1000:.1f}',
+        ))
+
+
+def current():
+    """Сборщик текущего запроса или None вне выборки."""
+    return getattr(_local, 'stats', None)
+
+
+def record_cache(hits, misses):
+    stats = current()
+    if stats is not None:
+        stats.cache_hits += hits
+        stats.cache_misses += misses
+
+
+@contextmanager
+def collect():
+    """Собирает замеры всего, что выполняется внутри блока."""
+    stats = RequestStats()
+    previous = current()
+    _local.stats = stats
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(stats.execute))
+            yield stats
+    finally:
+        _local.stats = previous
+
+
+@contextmanager
+def attach(stats):
+    """Направляет замеры кеша и шаблонов потока в сборщик stats.
+
+    Нужен потокам, которые выполняют часть чужого запроса
+    (core.parallel.gather); stats может быть None.
+    """
+    previous = current()
+    _local.stats = stats
+    try:
+        yield stats
+    finally:
+        _local.stats = previous
+
+
+class InstrumentationMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        stats = None
+        if random.random() < settings.INSTRUMENTATION_SAMPLE_RATE:
+            with collect() as stats:
+                response = self.get_response(request)
+        else:
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else UNRESOLVED
+        REGISTRY.inc('yatube_requests_total', view=view)
+        REGISTRY.observe('yatube_request_duration_seconds', duration,
+                         view=view)
+        if stats is not None:
+            self.record(view, stats)
+            response['Server-Timing'] = stats.server_timing(duration)
+        return response
+
+    @staticmethod
+    def record(view, stats):
+        REGISTRY.inc('yatube_sampled_requests_total', view=view)
+        REGISTRY.inc('yatube_db_queries_total', stats.queries, view=view)
+        REGISTRY.inc(
+            'yatube_db_duplicate_queries_total', stats.duplicates, view=view
+        )
+        REGISTRY.inc('yatube_db_seconds_total', stats.db_time, view=view)
+        REGISTRY.inc(
+            'yatube_template_seconds_total', stats.template_time, view=view
+        )
+        REGISTRY.inc(
+            'yatube_cache_requests_total', stats.cache_hits,
+            view=view, result='hit',
+        )
+        REGISTRY.inc(
+            'yatube_cache_requests_total', stats.cache_misses,
+            view=view, result='miss',
+        )
+
+
+class InstrumentedTemplate(DjangoTemplate):
+    def render(self, context=None, request=None):
+        stats = current()
+        if stats is None:
+            return super().render(context, request)
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.template_time += time.perf_counter() - started
+
+
+class InstrumentedTemplates(DjangoTemplates):
+    """Шаблонизатор Django, замеряющий рендеринг в запросах из выборки."""
+
+    def from_string(self, template_code):
+        return InstrumentedTemplate(
+            self.engine.from_string(template_code), self
+        )
+
+    def get_template(self, template_name):
+        try:
+            return InstrumentedTemplate(
+                self.engine.get_template(template_name), self
+            )
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
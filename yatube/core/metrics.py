@@ -0,0 +1,102 @@
+"""Метрики процесса в текстовом формате Prometheus.
+
+Счетчики и гистограммы живут в памяти процесса и собираются по
+имени вьюхи. Каждый воркер отдает свои метрики, суммирует их
+Prometheus.
+"""
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+# Границы корзин гистограммы длительности запроса, в секундах.
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace(
+        '\\', '\\\\'
+    ).replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(
+        f'{name}="{_escape(value)}"' for name, value in labels
+    )
+    return f'{{{pairs}}}'
+
+
+class Registry:
+    """Счетчики и гистограммы с метками, общие для потоков процесса."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.help = {}
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.counters = defaultdict(float)
+            self.histograms = {}
+
+    def describe(self, name, kind, text):
+        self.help[name] = (kind, text)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] += value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [
+                    [0] * (len(DURATION_BUCKETS) + 1), 0.0,
+                ]
+            histogram[0][bisect_left(DURATION_BUCKETS, value)] += 1
+            histogram[1] += value
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus 0.0.4."""
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(
+                (key, (list(buckets), total))
+                for key, (buckets, total) in self.histograms.items()
+            )
+        lines = []
+        described = set()
+
+        def header(name):
+            if name not in described and name in self.help:
+                kind, text = self.help[name]
+                lines.append(f'# HELP {name} {text}')
+                lines.append(f'# TYPE {name} {kind}')
+            described.add(name)
+
+        for (name, labels), value in counters:
+            header(name)
+            lines.append(f'{name}{_labels(labels)} {value:g}')
+        for (name, labels), (buckets, total) in histograms:
+            header(name)
+            cumulative = 0
+            bounds = [f'{bound:g}' for bound in DURATION_BUCKETS] + ['+Inf']
+            for bound, count in zip(bounds, buckets):
+                cumulative += count
+                lines.append(
+                    f'{name}_bucket{_labels(labels + (("le", bound),))} '
+                    f'{cumulative}'
+                )
+            lines.append(f'{name}_sum{_labels(labels)} {total:g}')
+            lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
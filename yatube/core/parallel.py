@@ -0,0 +1,89 @@
+"""Пул потоков для независимых запросов к базе одной страницы.
+
+Соединения Django привязаны к потоку, поэтому одновременные запросы
+выполняются в пуле из DB_POOL_THREADS потоков, у каждого свое
+соединение. В поток пула переносятся обертки execute_wrapper и
+сборщик core.instrumentation вызывающего запроса: бюджеты
+query_budget и Server-Timing учитывают и запросы из пула. Переносится
+и закрепление за основной базой (core.db.replicas), чтобы запрос после
+записи не читал из пула отстающую реплику.
+
+Пулом пользуется gather.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+from . import instrumentation
+from .db import replicas
+
+_executor = None
+
+_executor_lock = threading.Lock()
+
+
+def capture():
+    """Обертки курсоров, сборщик замеров и закрепление текущего потока."""
+    return (
+        [
+            (alias, list(connections[alias].execute_wrappers))
+            for alias in connections
+        ],
+        instrumentation.current(),
+        replicas.is_pinned(),
+    )
+
+
+def call_with(state, func, args, kwargs):
+    """Вызывает func в потоке пула с состоянием state из capture()."""
+    wrappers, stats, pinned = state or ((), None, False)
+    close_old_connections()
+    try:
+        with ExitStack() as stack:
+            for alias, installed in wrappers:
+                for wrapper in installed:
+                    stack.enter_context(
+                        connections[alias].execute_wrapper(wrapper)
+                    )
+            stack.enter_context(instrumentation.attach(stats))
+            stack.enter_context(replicas.pinning(pinned))
+            return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                settings.DB_POOL_THREADS, thread_name_prefix='db-pool'
+            )
+    return _executor
+
+
+def gather(*calls):
+    """Результаты вызовов calls по порядку.
+
+    При PARALLEL_QUERIES первый вызов выполняется в текущем потоке, а
+    остальные одновременно с ним в пуле; иначе все по очереди. Если
+    вызовы упали, поднимается ошибка первого из них.
+    """
+    if not settings.PARALLEL_QUERIES or len(calls) < 2:
+        return [call() for call in calls]
+    state = capture()
+    futures = [
+        executor().submit(call_with, state, call, (), {})
+        for call in calls[1:]
+    ]
+    try:
+        first = calls[0]()
+    finally:
+        # Соединения потока (вне транзакции) уходят в пул до ожидания:
+        # иначе вызовам в пуле может не хватить соединений.
+        close_old_connections()
+        wait(futures)
+    return [first, *(future.result() for future in futures)]
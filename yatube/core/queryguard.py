@@ -0,0 +1,157 @@
+"""Сторож SQL-запросов для разработки и тестов.
+
+QueryGuardMiddleware оборачивает курсоры всех баз и для каждого
+запроса к сайту отмечает:
+
+- превышение бюджета вьюхи, объявленного декоратором query_budget;
+- повторы одной и той же формы SQL (N+1), например ленивую загрузку
+  post.author в цикле шаблона;
+- запросы дольше QUERY_GUARD_SLOW_MS.
+
+Для каждого SQL в отчете указаны строка шаблона, при рендеринге
+которой он выполнен, и ближайшая строка кода проекта. Сторож включен
+при QUERY_GUARD; в строгом режиме (QUERY_GUARD_STRICT, его включают
+тесты) превышение бюджета и N+1 поднимают QueryBudgetExceeded, иначе
+отчет пишется в лог.
+"""
+import logging
+import os
+import sys
+import time
+from collections import Counter, namedtuple
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.template.base import Node
+
+logger = logging.getLogger(__name__)
+
+RENDER_CODE = Node.render_annotated.__code__
+
+Query = namedtuple('Query', 'sql duration template code')
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Вьюха выполнила больше запросов, чем разрешает ее бюджет."""
+
+
+def query_budget(queries):
+    """Объявляет, сколько SQL-запросов может выполнить вьюха."""
+    def decorator(view):
+        view.query_budget = queries
+        return view
+    return decorator
+
+
+def _origin(frame):
+    """Строка шаблона и строка кода проекта, откуда выполнен запрос."""
+    template = code = None
+    own_file = __file__
+    while frame is not None and (template is None or code is None):
+        if frame.f_code is RENDER_CODE:
+            node = frame.f_locals.get('self')
+            origin = getattr(node, 'origin', None)
+            token = getattr(node, 'token', None)
+            if template is None and origin is not None and token:
+                name = origin.template_name or origin.name
+                template = f'{name}:{token.lineno}'
+        elif code is None:
+            filename = frame.f_code.co_filename
+            if (
+                filename.startswith(settings.BASE_DIR)
+                and filename != own_file
+            ):
+                code = (
+                    f'{os.path.relpath(filename, settings.BASE_DIR)}:'
+                    f'{frame.f_lineno}'
+                )
+        frame = frame.f_back
+    return template, code
+
+
+class QueryLog:
+    """Запросы одного обращения к сайту с местом их вызова."""
+
+    def __init__(self):
+        self.queries = []
+
+    def execute(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.queries.append(
+                Query(sql, duration, *_origin(sys._getframe(1)))
+            )
+
+    def repeated(self, limit):
+        """Формы SQL, выполненные больше limit раз, с числом повторов."""
+        shapes = Counter(query.sql for query in self.queries)
+        return [
+            (sql, count) for sql, count in shapes.most_common()
+            if count > limit
+        ]
+
+    def slow(self, threshold_ms):
+        return [
+            query for query in self.queries
+            if query.duration * 1000 > threshold_ms
+        ]
+
+    def _place(self, sql):
+        for query in self.queries:
+            if query.sql == sql:
+                return query.template or query.code or '?'
+        return '?'
+
+    def report(self, view, budget, repeated, slow):
+        lines = [f'{view}: {len(self.queries)} SQL-запросов']
+        if budget is not None and len(self.queries) > budget:
+            lines[0] += f' при бюджете {budget}'
+        for sql, count in repeated:
+            lines.append(
+                f'  N+1: {count} раз из {self._place(sql)}: {sql[:200]}'
+            )
+        for query in slow:
+            lines.append(
+                f'  медленный ({query.duration * 1000:.0f} мс) из '
+                f'{query.template or query.code or "?"}: {query.sql[:200]}'
+            )
+        return '\n'.join(lines)
+
+
+@contextmanager
+def watch():
+    """Записывает в QueryLog все SQL, выполненные внутри блока."""
+    log = QueryLog()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(log.execute))
+        yield log
+
+
+class QueryGuardMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.QUERY_GUARD:
+            return self.get_response(request)
+        with watch() as log:
+            response = self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return response
+        budget = getattr(match.func, 'query_budget', None)
+        over_budget = budget is not None and len(log.queries) > budget
+        repeated = log.repeated(settings.QUERY_GUARD_REPEAT_LIMIT)
+        slow = log.slow(settings.QUERY_GUARD_SLOW_MS)
+        if not (over_budget or repeated or slow):
+            return response
+        report = log.report(match.view_name, budget, repeated, slow)
+        if settings.QUERY_GUARD_STRICT and (over_budget or repeated):
+            raise QueryBudgetExceeded(report)
+        logger.warning(report)
+        return response
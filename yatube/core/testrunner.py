@@ -0,0 +1,11 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class GuardedTestRunner(DiscoverRunner):
+    """Тестовый раннер со сторожем SQL в строгом режиме."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        settings.QUERY_GUARD = True
+        settings.QUERY_GUARD_STRICT = True
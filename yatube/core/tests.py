@@ -1,6 +1,50 @@
-from http.client import NOT_FOUND
+import asyncio
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from http.client import FOUND, NOT_FOUND, OK
+from unittest import mock
+from urllib.parse import unquote
 
-from django.test import Client, TestCase
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db.utils import ConnectionHandler, OperationalError
+from django.http import HttpResponse
+from django.template import engines
+from django.test import (
+    Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase,
+    override_settings,
+)
+from django.urls import ResolverMatch, reverse
+from posts.caching import GENERATION_KEY, POSTS, generations
+from posts.models import Comment, Follow, Group, Post
+
+from core import instrumentation, parallel
+from core.db import replicas
+from core.db.pool import (
+    ConnectionPool, PoolTimeout, check_capacity, close_pools,
+)
+from core.queryguard import (
+    QueryBudgetExceeded, QueryGuardMiddleware, query_budget,
+)
+from core.metrics import REGISTRY
+from yatube.asgi import application
+
+TIERED_CACHES = {
+    'default': {
+        'BACKEND': 'core.cache.TwoTierCache',
+        'LOCATION': 'l2',
+        'OPTIONS': {'L1_TIMEOUT': 60, 'LOCK_TIMEOUT': 5},
+    },
+    'l2': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'core-tests',
+    },
+}
 
 
 class ViewTestClass(TestCase):
@@ -12,3 +56,520 @@ class ViewTestClass(TestCase):
         response = self.client.get('/nonexist-page/')
         self.assertEqual(response.status_code, NOT_FOUND)
         self.assertTemplateUsed(response, 'core/404.html')
+
+
+@override_settings(CACHES=TIERED_CACHES)
+class TwoTierCacheTest(SimpleTestCase):
+    def setUp(self):
+        self.cache = caches['default']
+        self.shared = caches['l2']
+        self.cache.clear()
+
+    def test_reads_are_served_from_l1(self):
+        """Прочитанное значение держится в L1 процесса."""
+        self.shared.set('key', 'value')
+        self.assertEqual(self.cache.get('key'), 'value')
+        self.shared.delete('key')
+        self.assertEqual(self.cache.get('key'), 'value')
+
+    def test_writes_go_through_both_tiers(self):
+        """Запись, incr и удаление меняют оба уровня."""
+        self.cache.set('counter', 1)
+        self.assertEqual(self.shared.get('counter'), 1)
+        self.assertEqual(self.cache.incr('counter'), 2)
+        self.assertEqual(self.cache.get('counter'), 2)
+        self.cache.delete('counter')
+        self.assertIsNone(self.cache.get('counter'))
+        self.assertIsNone(self.shared.get('counter'))
+
+    def test_l1_returns_copies(self):
+        """Изменение полученного объекта не портит кеш."""
+        self.cache.set('list', [1])
+        self.cache.get('list').append(2)
+        self.assertEqual(self.cache.get('list'), [1])
+
+    def test_get_or_set_computes_once_under_concurrency(self):
+        """При одновременном промахе значение считается один раз."""
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.05)
+            return 'fresh'
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(
+                    caches['default'].get_or_set('hot', compute)
+                )
+            )
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['fresh'] * 8)
+
+    def test_file_backend_as_shared_tier(self):
+        """Файловый кеш подходит как L2 для одного сервера."""
+        with tempfile.TemporaryDirectory() as directory:
+            file_caches = dict(TIERED_CACHES, l2={
+                'BACKEND':
+                    'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': directory,
+            })
+            with self.settings(CACHES=file_caches):
+                caches['default'].set('key', 'value')
+                self.assertEqual(caches['l2'].get('key'), 'value')
+                caches['default'].clear()
+
+    def test_exempt_keys_are_fresh_in_other_processes(self):
+        """Поколение, поднятое в одном процессе, сразу видно в другом."""
+        with tempfile.TemporaryDirectory() as directory:
+            file_caches = dict(TIERED_CACHES, l2={
+                'BACKEND':
+                    'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': directory,
+            })
+            file_caches['default'] = dict(
+                TIERED_CACHES['default'],
+                OPTIONS=dict(
+                    TIERED_CACHES['default']['OPTIONS'],
+                    L1_EXEMPT=('generation.',),
+                ),
+            )
+            context = multiprocessing.get_context('fork')
+            parent, child = context.Pipe()
+            with self.settings(CACHES=file_caches):
+                worker = context.Process(
+                    target=_read_generations, args=(child,), daemon=True
+                )
+                worker.start()
+                try:
+                    self.assertTrue(parent.poll(5))
+                    before = parent.recv()
+                    caches['default'].incr(GENERATION_KEY.format(POSTS))
+                    parent.send('bumped')
+                    self.assertTrue(parent.poll(5))
+                    after = parent.recv()
+                finally:
+                    worker.join(5)
+                    worker.terminate()
+        self.assertNotEqual(after, before)
+
+
+def _read_generations(conn):
+    """Другой воркер: читает поколение до и после чужой записи."""
+    conn.send(generations(POSTS))
+    conn.recv()
+    conn.send(generations(POSTS))
+    conn.close()
+
+
+class InstrumentationTest(TestCase):
+    def setUp(self):
+        REGISTRY.clear()
+        cache.clear()
+
+    @override_settings(INSTRUMENTATION_SAMPLE_RATE=1)
+    def test_sampled_request_gets_server_timing_and_metrics(self):
+        """Запрос из выборки отдает Server-Timing и попадает в метрики."""
+        response = self.client.get('/')
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="\d+ queries')
+        self.assertRegex(timing, r'tpl;dur=[\d.]+')
+        self.assertIn('cache;desc=', timing)
+        metrics = self.client.get('/metrics/')
+        self.assertEqual(
+            metrics['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8'
+        )
+        content = metrics.content.decode()
+        self.assertIn('yatube_requests_total{view="posts:index"} 1', content)
+        self.assertIn(
+            'yatube_sampled_requests_total{view="posts:index"} 1', content
+        )
+        self.assertIn(
+            'yatube_cache_requests_total{result="miss",view="posts:index"}',
+            content,
+        )
+        self.assertIn(
+            'yatube_request_duration_seconds_bucket'
+            '{view="posts:index",le="+Inf"} 1',
+            content,
+        )
+
+    @override_settings(INSTRUMENTATION_SAMPLE_RATE=0)
+    def test_unsampled_request_is_only_counted(self):
+        """Вне выборки запрос только считается, без подробных замеров."""
+        response = self.client.get('/')
+        self.assertFalse(response.has_header('Server-Timing'))
+        content = REGISTRY.render()
+        self.assertIn('yatube_requests_total{view="posts:index"} 1', content)
+        self.assertNotIn('yatube_sampled_requests_total', content)
+
+    def test_duplicate_queries_are_detected(self):
+        """Одинаковые SQL с одинаковыми параметрами считаются повторами."""
+        users = get_user_model().objects
+        with instrumentation.collect() as stats:
+            users.filter(pk=1).exists()
+            users.filter(pk=1).exists()
+            users.filter(pk=2).exists()
+        self.assertEqual(stats.queries, 3)
+        self.assertEqual(stats.duplicates, 1)
+
+    def test_metrics_are_hidden_from_outside(self):
+        """Страница метрик недоступна не с INTERNAL_IPS."""
+        response = self.client.get('/metrics/', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, NOT_FOUND)
+
+
+class QueryGuardTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        users = get_user_model().objects
+        for number in range(5):
+            author = users.create_user(username=f'author{number}')
+            author.posts.create(text=f'Пост {number}')
+
+    def guarded(self, view):
+        request = RequestFactory().get('/')
+        request.resolver_match = ResolverMatch(view, (), {}, 'guarded')
+        return QueryGuardMiddleware(view)(request)
+
+    def test_n_plus_one_is_reported_with_template_line(self):
+        """Повторы одной формы SQL показывают строку шаблона."""
+        template = engines['django'].from_string(
+            '{% for post in posts %}\n{{ post.author.username }}{% endfor %}'
+        )
+
+        def view(request):
+            from posts.models import Post
+            return HttpResponse(template.render({
+                'posts': Post.objects.order_by('pk'),
+            }))
+
+        with self.assertRaisesRegex(
+            QueryBudgetExceeded, r'N\+1: 5 раз из <unknown source>:2'
+        ):
+            self.guarded(view)
+
+    def test_budget_is_enforced_only_in_strict_mode(self):
+        """Превышение бюджета роняет запрос в тестах и пишется в лог."""
+        @query_budget(1)
+        def view(request):
+            users = get_user_model().objects
+            return HttpResponse(f'{users.count()} {users.first()}')
+
+        with self.assertRaisesRegex(
+            QueryBudgetExceeded, 'guarded: 2 SQL-запросов при бюджете 1'
+        ):
+            self.guarded(view)
+        with override_settings(QUERY_GUARD_STRICT=False):
+            with self.assertLogs('core.queryguard', 'WARNING'):
+                self.assertEqual(self.guarded(view).status_code, 200)
+
+
+class ASGIApplicationTest(TransactionTestCase):
+    # Адаптер выполняет запросы в своих потоках со своими соединениями:
+    # данные теста должны быть закоммичены.
+
+    def setUp(self):
+        cache.clear()
+        users = get_user_model().objects
+        self.author = users.create_user(username='автор')
+        self.reader = users.create_user(username='reader')
+        self.group = Group.objects.create(title='Группа', slug='asgi')
+        self.post = Post.objects.create(
+            author=self.author, group=self.group, text='Пост для ASGI'
+        )
+        Comment.objects.create(
+            post=self.post, author=self.reader, text='Комментарий ASGI'
+        )
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.application = application
+
+    def get(self, path, cookie=None):
+        """Статус, заголовки и тело ответа на GET через ASGI."""
+        return asyncio.run(self.fetch(path, cookie))
+
+    async def fetch(self, path, cookie=None):
+        headers = [(b'host', b'testserver')]
+        if cookie is not None:
+            headers.append((b'cookie', cookie.encode()))
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            # В ASGI путь уже раскодирован из %XX.
+            'path': unquote(path),
+            'raw_path': path.encode(),
+            'root_path': '',
+            'query_string': b'',
+            'headers': headers,
+            'server': ('testserver', 80),
+            'client': ('127.0.0.1', 0),
+        }
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            messages.append(message)
+
+        await self.application(scope, receive, send)
+        start, *body = messages
+        return (
+            start['status'],
+            {
+                name.decode().lower(): value.decode()
+                for name, value in start['headers']
+            },
+            b''.join(message.get('body', b'') for message in body).decode(),
+        )
+
+    def test_feed_and_post_pages_are_served(self):
+        pages = (
+            (reverse('posts:index'), 'Пост для ASGI'),
+            (reverse('posts:group_list', args=['asgi']), 'Пост для ASGI'),
+            (reverse('posts:profile', args=['автор']), 'Пост для ASGI'),
+            (
+                reverse('posts:post_detail', args=[self.post.pk]),
+                'Комментарий ASGI',
+            ),
+        )
+        for path, text in pages:
+            with self.subTest(path=path):
+                status, headers, body = self.get(path)
+                self.assertEqual(status, OK)
+                self.assertIn(text, body)
+                self.assertIn('etag', headers)
+
+    def test_follow_feed_uses_session(self):
+        """Лента подписок видит пользователя по сессионной куке."""
+        client = Client()
+        client.force_login(self.reader)
+        session = client.cookies['sessionid'].value
+        status, _, body = self.get(
+            reverse('posts:follow_index'), f'sessionid={session}'
+        )
+        self.assertEqual(status, OK)
+        self.assertIn('Пост для ASGI', body)
+        status, headers, _ = self.get(reverse('posts:follow_index'))
+        self.assertEqual(status, FOUND)
+        self.assertEqual(headers['location'], '/auth/login')
+
+    def test_missing_post_is_not_found(self):
+        status, _, _ = self.get(
+            reverse('posts:post_detail', args=[self.post.pk + 1])
+        )
+        self.assertEqual(status, NOT_FOUND)
+
+
+class ConnectionPoolTest(SimpleTestCase):
+    def setUp(self):
+        self.opened = []
+
+    def connect(self):
+        conn = sqlite3.connect(':memory:', check_same_thread=False)
+        self.opened.append(conn)
+        return conn
+
+    def test_released_connection_is_reused(self):
+        pool = ConnectionPool(max_size=2)
+        conn = pool.acquire(self.connect)
+        pool.release(conn)
+        self.assertIs(pool.acquire(self.connect), conn)
+        self.assertEqual(pool.connects, 1)
+
+    def test_size_is_limited(self):
+        """Сверх MAX_SIZE соединение ждет возврата и не дольше TIMEOUT."""
+        pool = ConnectionPool(max_size=1, timeout=0.05)
+        conn = pool.acquire(self.connect)
+        with self.assertRaises(PoolTimeout):
+            pool.acquire(self.connect)
+        threading.Timer(0.01, pool.release, [conn]).start()
+        pool.timeout = 5
+        self.assertIs(pool.acquire(self.connect), conn)
+        self.assertEqual(pool.size, 1)
+
+    def test_broken_and_expired_connections_are_replaced(self):
+        pool = ConnectionPool(max_size=2, max_age=60, check_interval=0)
+        conn = pool.acquire(self.connect)
+        pool.release(conn)
+        conn.close()
+        fresh = pool.acquire(self.connect)
+        self.assertIsNot(fresh, conn)
+        pool.max_age = 0
+        pool.release(fresh)
+        self.assertEqual(pool.size, 0)
+        with self.assertRaises(sqlite3.ProgrammingError):
+            fresh.execute('SELECT 1')
+
+
+class PooledSqliteBackendTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(close_pools)
+        self.connections = ConnectionHandler({'default': {
+            'ENGINE': 'core.db.sqlite3',
+            'NAME': os.path.join(directory.name, 'pooled.sqlite3'),
+            'CONN_MAX_AGE': 600,
+            'POOL': {'MAX_SIZE': 1, 'TIMEOUT': 0.05},
+            'PRAGMAS': {'journal_mode': 'WAL', 'synchronous': 'NORMAL'},
+            'TRANSACTION_MODE': 'IMMEDIATE',
+        }})
+        self.addCleanup(self.connections.close_all)
+
+    def test_request_end_returns_connection_to_pool(self):
+        """После запроса соединение уходит в пул и достается следующему."""
+        db = self.connections['default']
+        db.ensure_connection()
+        raw = db.connection
+        with db.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+        db.close_if_unusable_or_obsolete()
+        self.assertIsNone(db.connection)
+        db.ensure_connection()
+        self.assertIs(db.connection, raw)
+        self.assertEqual(db.pool.connects, 1)
+
+    def test_exhausted_pool_raises_database_error(self):
+        db = self.connections['default']
+        db.ensure_connection()
+        other = []
+
+        def connect():
+            other.append(ConnectionHandler(self.connections.databases))
+            try:
+                other[0]['default'].ensure_connection()
+            except OperationalError as error:
+                other.append(error)
+
+        thread = threading.Thread(target=connect)
+        thread.start()
+        thread.join()
+        self.assertIn('заняты', str(other[1]))
+
+    def test_pool_smaller_than_threads_is_refused(self):
+        check_capacity(1, self.connections)
+        with self.assertRaises(ImproperlyConfigured):
+            check_capacity(2, self.connections)
+
+    @override_settings(PARALLEL_QUERIES=True)
+    def test_gather_releases_connection_before_waiting(self):
+        """Потоки, ждущие gather, не занимают соединения пула.
+
+        Два запроса держат оба соединения пула, и каждому нужно еще
+        одно для вызова в пуле core.parallel.
+        """
+        self.connections['default'].settings_dict['POOL']['MAX_SIZE'] = 2
+        self.connections['default'].settings_dict['POOL']['TIMEOUT'] = 2
+        both_connected = threading.Barrier(2, timeout=5)
+        results = []
+
+        def query():
+            with self.connections['default'].cursor() as cursor:
+                cursor.execute('SELECT 1')
+                return cursor.fetchone()[0]
+
+        def request():
+            try:
+                query()
+                both_connected.wait()
+                results.append(parallel.gather(query, query))
+            except Exception as error:
+                results.append(error)
+            finally:
+                self.connections.close_all()
+
+        with mock.patch('django.db.connections', self.connections), \
+                mock.patch('core.parallel.connections', self.connections):
+            threads = [threading.Thread(target=request) for _ in range(2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(results, [[1, 1], [1, 1]])
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'], REPLICA_PIN_SECONDS=5)
+class ReplicaRouterTest(SimpleTestCase):
+    def setUp(self):
+        self.router = replicas.ReplicaRouter()
+        self.addCleanup(replicas.unpin)
+
+    def test_reads_go_to_primary_after_write(self):
+        self.assertEqual(self.router.db_for_read(Post), 'replica1')
+        self.assertEqual(self.router.db_for_write(Post), 'default')
+        self.assertEqual(self.router.db_for_read(Post), 'default')
+        replicas.unpin()
+        with replicas.primary():
+            self.assertEqual(self.router.db_for_read(Post), 'default')
+        self.assertEqual(self.router.db_for_read(Post), 'replica1')
+        self.assertFalse(self.router.allow_migrate('replica1', 'posts'))
+
+    def test_cookie_pins_reads_of_next_requests(self):
+        """После записи браузер читает из основной базы, пока жива кука."""
+        pinned = []
+
+        def view(request):
+            pinned.append(replicas.is_pinned())
+            if request.method == 'POST':
+                self.router.db_for_write(Post)
+            return HttpResponse()
+
+        middleware = replicas.ReplicaPinMiddleware(view)
+        factory = RequestFactory()
+        self.assertNotIn(replicas.PIN_COOKIE, middleware(
+            factory.get('/')
+        ).cookies)
+        cookie = middleware(factory.post('/')).cookies[replicas.PIN_COOKIE]
+        self.assertEqual(cookie['max-age'], 5)
+        self.assertFalse(replicas.is_pinned())
+        request = factory.get('/')
+        request.COOKIES[replicas.PIN_COOKIE] = cookie.value
+        middleware(request)
+        request.COOKIES[replicas.PIN_COOKIE] = str(int(time.time()) - 1)
+        middleware(request)
+        self.assertEqual(pinned, [False, False, True, False])
+
+
+class SqliteReplicaTest(SimpleTestCase):
+    def test_replica_file_serves_copied_data_read_only(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = {
+            'ENGINE': 'core.db.sqlite3',
+            'NAME': os.path.join(directory.name, 'primary.sqlite3'),
+            'PRAGMAS': {'journal_mode': 'WAL'},
+        }
+        handler = ConnectionHandler({
+            'default': settings,
+            'replica1': {
+                **settings,
+                'NAME': os.path.join(directory.name, 'replica.sqlite3'),
+                'PRAGMAS': {'journal_mode': 'WAL', 'query_only': 1},
+            },
+        })
+        self.addCleanup(handler.close_all)
+        with handler['default'].cursor() as cursor:
+            cursor.execute('CREATE TABLE post (text TEXT)')
+            cursor.execute("INSERT INTO post VALUES ('первый')")
+        replicas.copy_sqlite(
+            settings['NAME'], handler['replica1'].settings_dict['NAME']
+        )
+        with handler['replica1'].cursor() as cursor:
+            cursor.execute('SELECT text FROM post')
+            self.assertEqual(cursor.fetchall(), [('первый',)])
+            with self.assertRaisesMessage(OperationalError, 'readonly'):
+                cursor.execute("INSERT INTO post VALUES ('второй')")
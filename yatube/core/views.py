@@ -1,5 +1,9 @@
+from django.conf import settings
+from django.http import Http404, HttpResponse
 from django.shortcuts import render
 
+from .metrics import CONTENT_TYPE, REGISTRY
+
 
 def page_not_found(request, exception):
     return render(request, 'core/404.html', {'path': request.path}, status=404)
@@ -11,3 +15,10 @@ def csrf_failure(request, reason=''):
 
 def internal_server_error(request, reason=''):
     return render(request, 'core/500.html')
+
+
+def metrics(request):
+    """Метрики процесса для Prometheus, только с INTERNAL_IPS."""
+    if request.META.get('REMOTE_ADDR') not in settings.INTERNAL_IPS:
+        raise Http404
+    return HttpResponse(REGISTRY.render(), content_type=CONTENT_TYPE)
@@ -1,7 +1,12 @@
 from django.contrib import admin
 
+from . import search
 from .models import Post, Group, Comment
 
+# Админка показывает не больше стольких лучших совпадений: весь список
+# id подошедших постов в IN (...) рос бы вместе с базой.
+ADMIN_SEARCH_LIMIT: int = 1000
+
 
 class PostAdmin(admin.ModelAdmin):
     list_display = ('pk', 'text', 'pub_date', 'author', 'group',)
@@ -10,6 +15,14 @@ class PostAdmin(admin.ModelAdmin):
     list_filter = ('pub_date',)
     empty_value_display = '-пусто-'
 
+    def get_search_results(self, request, queryset, search_term):
+        # Поиск по полнотекстовому индексу вместо LIKE '%...%'.
+        if not search_term:
+            return queryset, False
+        return queryset.filter(
+            pk__in=search.matching_ids(search_term, ADMIN_SEARCH_LIMIT)
+        ), False
+
 
 class GroupAdmin(admin.ModelAdmin):
     list_display = ('pk', 'title', 'slug', 'description',)
@@ -0,0 +1,217 @@
+"""Кеш страниц лент и отрендеренных карточек постов.
+
+Страницы лент кешируются вместе с номером поколения (generation).
+Сигналы на запись постов, групп, комментариев и подписок увеличивают
+поколение, и все старые страницы разом становятся недостижимы;
+вытеснит их сам кеш. Кроме того, страница живет не дольше CACHE_TTL
+секунд.
+
+Карточка posts/includes/post_list.html кешируется по ключу
+(id поста, post.updated), поэтому любое сохранение поста само выдает
+новую версию ключа. Изменения, которые не проходят через Post.save
+(группа, имя автора, комментарии), сдвигают post.updated сигналами.
+"""
+import hashlib
+import math
+import random
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.db import transaction
+from django.utils import timezone
+
+from core.db import replicas
+
+from .models import Post
+
+CARD_FRAGMENT = 'post_card'
+
+# Префиксы 'generation.' и 'lock.' исключены из L1 (L1_EXEMPT в настройках).
+GENERATION_KEY = 'generation.{}'
+
+PAGE_KEY = 'feed_page.{}'
+
+LOCK_KEY = 'lock.{}'
+
+LOCK_TIMEOUT = 10
+
+LOCK_POLL_INTERVAL = 0.01
+
+POSTS = 'posts'
+
+FOLLOWS = 'follows'
+
+
+def _new_generation():
+    # Начальное значение не должно совпасть с поколением, которое
+    # было до вытеснения ключа из кеша, поэтому берем время.
+    return time.time_ns()
+
+
+def generations(*scopes):
+    """Текущие поколения перечисленных областей одним запросом к кешу."""
+    keys = [GENERATION_KEY.format(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, _new_generation(), None)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def _bump(scope):
+    key = GENERATION_KEY.format(scope)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _new_generation(), None)
+
+
+def bump_generation(scope):
+    """Сбрасывает кеш страниц области scope.
+
+    Поколение сдвигается сразу и еще раз после коммита: страница,
+    отрендеренная конкурентным запросом до коммита, не переживет его.
+    """
+    _bump(scope)
+    transaction.on_commit(lambda: _bump(scope))
+
+
+def page_key(request):
+    session = request.COOKIES.get(settings.SESSION_COOKIE_NAME, '')
+    url = hashlib.md5(
+        f'{request.get_full_path()}:{session}'.encode()
+    ).hexdigest()
+    return PAGE_KEY.format(url)
+
+
+def _is_fresh(entry, version, beta):
+    """Проверяет версию и срок записи с вероятностным досрочным пересчетом.
+
+    Чем ближе срок и чем дольше считалась страница (delta), тем выше
+    шанс, что запрос решит пересчитать ее заранее (XFetch), и к моменту
+    истечения срока у кеша уже будет свежая копия.
+    """
+    if entry['version'] != version:
+        return False
+    if entry['expires'] is None:
+        return True
+    early = entry['delta'] * beta * math.log(1 - random.random())
+    return time.time() - early < entry['expires']
+
+
+def lock_key(key):
+    return LOCK_KEY.format(key)
+
+
+def _wait_for(key, version):
+    """Ждет страницу, которую рендерит запрос, взявший блокировку.
+
+    Возвращает None, как только блокировку отпустили, не положив
+    страницу в кеш (ответ не 200, с куками или исключение), или по
+    истечении LOCK_TIMEOUT: тогда страницу рендерит сам ожидающий.
+    """
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        # Блокировка проверяется до записи: страница кладется в кеш
+        # раньше, чем блокировку снимают.
+        locked = cache.get(lock_key(key)) is not None
+        entry = cache.get(key)
+        if entry is not None and entry['version'] == version:
+            return entry['response']
+        if not locked:
+            return None
+    return None
+
+
+def _lifetime(timeout):
+    """Срок записи страницы в секундах; None — до смены поколения.
+
+    Страница, прочитанная с реплики, могла не застать запись, которая
+    уже сдвинула поколение, поэтому живет не дольше отставания реплик.
+    """
+    if not replicas.replicas() or replicas.is_pinned():
+        return timeout
+    return min(timeout or math.inf, settings.REPLICA_PIN_SECONDS)
+
+
+def cache_feed(*scopes, timeout=None, beta=1.0):
+    """Кеширует GET-ответ ленты с защитой от лавины промахов.
+
+    Запись живет до смены поколения областей scopes, но не дольше
+    timeout секунд (по умолчанию settings.CACHE_TTL). Ключ зависит от
+    адреса и сессионной куки, поэтому повторный запрос той же страницы
+    отдается из кеша без обращений к базе.
+
+    Страницы, прочитанные с реплик, дополнительно живут не дольше
+    REPLICA_PIN_SECONDS.
+
+    Когда запись устарела, страницу пересчитывает только запрос,
+    взявший блокировку; остальные отдают предыдущую версию, а если
+    ее нет — ждут результат пересчета. Если ответ не попал в кеш
+    (не 200, с куками, исключение), ожидающие рендерят страницу сами,
+    как только блокировка снята.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            key = page_key(request)
+            version = '.'.join(
+                str(generation) for generation in generations(*scopes)
+            )
+            entry = cache.get(key)
+            if entry is not None and _is_fresh(entry, version, beta):
+                return entry['response']
+            locked = cache.add(lock_key(key), 1, LOCK_TIMEOUT)
+            if not locked:
+                if entry is not None:
+                    return entry['response']
+                response = _wait_for(key, version)
+                if response is not None:
+                    return response
+            try:
+                started = time.time()
+                response = view(request, *args, **kwargs)
+                if response.status_code == 200 and not response.cookies:
+                    finished = time.time()
+                    lifetime = _lifetime(
+                        settings.CACHE_TTL if timeout is None else timeout
+                    )
+                    cache.set(key, {
+                        'version': version,
+                        'response': response,
+                        'delta': finished - started,
+                        'expires': lifetime and finished + lifetime,
+                    }, None)
+            finally:
+                if locked:
+                    cache.delete(lock_key(key))
+            return response
+        return wrapper
+    return decorator
+
+
+def card_key(post):
+    return make_template_fragment_key(
+        CARD_FRAGMENT, [post.pk, post.updated.isoformat()]
+    )
+
+
+def invalidate_card(post):
+    cache.delete(card_key(post))
+
+
+def touch_group_posts(group):
+    """Сдвигает версию карточек всех постов группы."""
+    Post.objects.filter(group=group).update(updated=timezone.now())
+
+
+def touch_author_posts(author):
+    """Сдвигает версию карточек всех постов автора."""
+    Post.objects.filter(author=author).update(updated=timezone.now())
@@ -0,0 +1,55 @@
+"""Комментарии поста страницами по курсору (created, id).
+
+Страница поста выводит только первые COMMENTS_PAGE комментариев,
+остальные подгружает кнопка «Показать еще»: фрагмент HTML или JSON
+со следующей страницей. Новые первыми и старые первыми — это один и
+тот же диапазон индекса (post, created, id), прочитанный в разные
+стороны, поэтому любая страница стоит одинаково.
+"""
+from django.db.models import Q
+
+from .models import Comment
+from .utils import decode_cursor, encode_cursor
+
+COMMENTS_PAGE: int = 20
+
+NEWEST = 'newest'
+
+OLDEST = 'oldest'
+
+ORDERS = (NEWEST, OLDEST)
+
+
+def comments_page(post_id, after=None, order=NEWEST, limit=COMMENTS_PAGE):
+    """Возвращает (комментарии, курсор следующей страницы или None).
+
+    Незнакомый порядок считается NEWEST, битый курсор — началом.
+    """
+    comments = Comment.objects.filter(post_id=post_id).select_related(
+        'author'
+    ).only('post_id', 'text', 'created', 'author__username')
+    key = decode_cursor(after) if after else None
+    if order == OLDEST:
+        if key is not None:
+            created, pk = key
+            comments = comments.filter(
+                Q(created__gt=created) | Q(pk__gt=pk), created__gte=created
+            )
+        comments = comments.order_by('created', 'pk')
+    else:
+        if key is not None:
+            created, pk = key
+            comments = comments.filter(
+                Q(created__lt=created) | Q(pk__lt=pk), created__lte=created
+            )
+        comments = comments.order_by('-created', '-pk')
+    rows = list(comments[:limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+    return rows[:limit], encode_cursor(rows[limit - 1], 'created')
+
+
+def requested_order(request):
+    """Порядок из ?order=, по умолчанию NEWEST."""
+    order = request.GET.get('order')
+    return order if order in ORDERS else NEWEST
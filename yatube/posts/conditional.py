@@ -0,0 +1,121 @@
+"""Валидаторы условных GET-запросов для HTML-страниц.
+
+Страница ленты зависит только от постов своего окна: их id и
+post.updated (его сдвигают правки, комментарии и переименование
+группы) и от того, есть ли пост за окном. Поэтому ETag считается по
+тому же диапазону индекса (pub_date, id), что читает сама лента, но
+без текста и карточек: один маленький запрос вместо рендеринга.
+Страница поста зависит от самого поста, счетчика постов автора и
+последнего комментария.
+
+В ETag входят адрес и пользователь: шапка страницы у каждого своя.
+ETag слабый, так как CSRF-токен в формах меняется при каждом рендеринге.
+
+Декоратор ставится под cache_feed: закешированная страница хранится
+вместе со своими ETag и Last-Modified, и повторную проверку такой
+страницы ConditionalGetMiddleware отвечает 304 вовсе без запросов.
+"""
+import hashlib
+
+from django.db.models import Exists, F, OuterRef, Subquery
+from django.views.decorators.http import condition
+
+from .models import Comment, Follow, Post
+from .utils import paginator_page
+
+
+def _etag(request, *parts):
+    raw = '|'.join(
+        str(part)
+        for part in (request.get_full_path(), request.user.pk, *parts)
+    )
+    return 'W/"{}"'.format(hashlib.md5(raw.encode()).hexdigest())
+
+
+def _window(request, posts, extra):
+    """Ключи постов текущей страницы ленты и есть ли страницы рядом.
+
+    Для каждого поста берутся id, updated и аннотации extra. Возвращает
+    None, если страница пуста: тогда ее вид зависит от данных вне окна,
+    и страница отдается без валидаторов.
+    """
+    page = paginator_page(request, posts.only('pk', 'pub_date', 'updated'))
+    rows = [
+        (post.pk, post.updated, *(getattr(post, name) for name in extra))
+        for post in page
+    ]
+    if not rows:
+        return None
+    return rows, page.has_next(), page.has_previous()
+
+
+def _feed_validators(request, posts, **extra):
+    window = _window(request, posts.annotate(**extra), extra)
+    if window is None:
+        return None, None
+    rows = window[0]
+    return _etag(request, *window), max(row[1] for row in rows)
+
+
+def index_validators(request):
+    return _feed_validators(request, Post.objects.all())
+
+
+def group_validators(request, slug):
+    return _feed_validators(
+        request, Post.objects.filter(group__slug=slug)
+    )
+
+
+def profile_validators(request, username):
+    # Шапка профиля (имя и счетчики автора, подписка на него) берется
+    # тем же запросом через join к каждой строке окна.
+    return _feed_validators(
+        request,
+        Post.objects.filter(author__username=username),
+        author_first_name=F('author__first_name'),
+        author_last_name=F('author__last_name'),
+        author_posts=F('author__stats__posts_count'),
+        author_followers=F('author__stats__followers_count'),
+        author_following=F('author__stats__following_count'),
+        is_following=Exists(Follow.objects.filter(
+            author=OuterRef('author_id'), user=request.user.id
+        )),
+    )
+
+
+def post_validators(request, post_id):
+    last_comment = Comment.objects.filter(
+        post=OuterRef('pk')
+    ).order_by('-created', '-pk')
+    post = Post.objects.filter(pk=post_id).annotate(
+        last_comment=Subquery(last_comment.values('pk')[:1]),
+        last_commented=Subquery(last_comment.values('created')[:1]),
+    ).values_list(
+        'updated',
+        'comments_count',
+        'author__stats__posts_count',
+        'last_comment',
+        'last_commented',
+    ).first()
+    if post is None:
+        return None, None
+    updated, *_, last_commented = post
+    return _etag(request, *post), max(filter(None, (updated, last_commented)))
+
+
+def conditional_page(validators):
+    """condition() с ETag и Last-Modified из одного вызова validators.
+
+    validators(request, *args, **kwargs) возвращает (etag, last_modified)
+    и выполняется один раз на запрос.
+    """
+    def cached(request, *args, **kwargs):
+        if not hasattr(request, '_page_validators'):
+            request._page_validators = validators(request, *args, **kwargs)
+        return request._page_validators
+
+    return condition(
+        etag_func=lambda *args, **kwargs: cached(*args, **kwargs)[0],
+        last_modified_func=lambda *args, **kwargs: cached(*args, **kwargs)[1],
+    )
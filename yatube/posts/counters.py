@@ -0,0 +1,152 @@
+"""Денормализованные счетчики постов, комментариев и подписок.
+
+Счетчики меняются атомарными UPDATE ... SET n = n + 1 из сигналов,
+то есть в той же транзакции, что и сама запись. Строка AuthorStats
+создается по точным COUNT(*) при первой подписке на автора или лениво
+при первом чтении, а команда recount чинит накопившийся дрейф.
+"""
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import AuthorStats, Comment, Follow, Post, User
+
+BATCH_SIZE: int = 500
+
+AUTHOR_COUNTERS = {
+    'posts_count': (Post, 'author'),
+    'followers_count': (Follow, 'author'),
+    'following_count': (Follow, 'user'),
+}
+
+
+def _change(queryset, field, delta, **extra):
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    return queryset.update(**{field: F(field) + delta}, **extra)
+
+
+def change_author(user_id, field, delta):
+    _change(AuthorStats.objects.filter(user_id=user_id), field, delta)
+
+
+def change_comments(post_id, delta):
+    """Меняет счетчик комментариев и версию карточки поста."""
+    _change(
+        Post.objects.filter(pk=post_id), 'comments_count', delta,
+        updated=timezone.now(),
+    )
+
+
+def _count(model, field):
+    counted = model.objects.filter(
+        **{field: OuterRef('pk')}
+    ).order_by().values(field).annotate(total=Count('pk')).values('total')
+    return Coalesce(Subquery(counted), 0)
+
+
+def _author_counts(users):
+    return users.annotate(**{
+        f'real_{name}': _count(model, field)
+        for name, (model, field) in AUTHOR_COUNTERS.items()
+    })
+
+
+def author_stats(user):
+    """Счетчики пользователя; при отсутствии считаются с нуля.
+
+    Если пользователь загружен с select_related('stats'), отдельного
+    запроса за счетчиками не будет.
+    """
+    try:
+        return user.stats
+    except AuthorStats.DoesNotExist:
+        pass
+    counts = _author_counts(User.objects.filter(pk=user.pk)).values(
+        *(f'real_{name}' for name in AUTHOR_COUNTERS)
+    ).get()
+    stats, _ = AuthorStats.objects.get_or_create(user=user, defaults={
+        name: counts[f'real_{name}'] for name in AUTHOR_COUNTERS
+    })
+    return stats
+
+
+def ensure_stats(user_ids):
+    """Создает недостающие строки AuthorStats по точным COUNT(*).
+
+    Возвращает id пользователей, чьи строки созданы сейчас: их счетчики
+    уже учитывают записи текущей транзакции.
+    """
+    user_ids = set(user_ids)
+    missing = user_ids - set(AuthorStats.objects.filter(
+        user_id__in=user_ids
+    ).values_list('user_id', flat=True))
+    if not missing:
+        return missing
+    counts = _author_counts(User.objects.filter(pk__in=missing)).values(
+        'pk', *(f'real_{name}' for name in AUTHOR_COUNTERS)
+    )
+    AuthorStats.objects.bulk_create(
+        [
+            AuthorStats(user_id=row['pk'], **{
+                name: row[f'real_{name}'] for name in AUTHOR_COUNTERS
+            })
+            for row in counts
+        ],
+        ignore_conflicts=True,
+    )
+    return missing
+
+
+def _batches(queryset, batch_size):
+    last_pk = 0
+    while True:
+        batch = list(queryset.filter(pk__gt=last_pk).order_by('pk')[
+            :batch_size
+        ])
+        if not batch:
+            return
+        yield batch
+        last_pk = batch[-1].pk
+
+
+def recount_authors(batch_size=BATCH_SIZE):
+    """Сверяет AuthorStats с таблицами пачками, возвращает число починок."""
+    repaired = 0
+    for users in _batches(_author_counts(User.objects.all()), batch_size):
+        existing = AuthorStats.objects.in_bulk([user.pk for user in users])
+        missing, drifted = [], []
+        for user in users:
+            real = {
+                name: getattr(user, f'real_{name}')
+                for name in AUTHOR_COUNTERS
+            }
+            stats = existing.get(user.pk)
+            if stats is None:
+                missing.append(AuthorStats(user_id=user.pk, **real))
+            elif any(getattr(stats, name) != real[name] for name in real):
+                for name, value in real.items():
+                    setattr(stats, name, value)
+                drifted.append(stats)
+        AuthorStats.objects.bulk_create(missing, ignore_conflicts=True)
+        AuthorStats.objects.bulk_update(drifted, list(AUTHOR_COUNTERS))
+        repaired += len(missing) + len(drifted)
+    return repaired
+
+
+def recount_comments(batch_size=BATCH_SIZE):
+    """Сверяет Post.comments_count с комментариями пачками."""
+    repaired = 0
+    posts = Post.objects.only('pk', 'comments_count').annotate(
+        real_comments=_count(Comment, 'post')
+    )
+    for batch in _batches(posts, batch_size):
+        drifted = [
+            post for post in batch
+            if post.comments_count != post.real_comments
+        ]
+        for post in drifted:
+            post.comments_count = post.real_comments
+        Post.objects.bulk_update(drifted, ['comments_count'])
+        repaired += len(drifted)
+    return repaired
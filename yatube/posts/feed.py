@@ -0,0 +1,208 @@
+"""Входящие ленты подписчиков.
+
+Новый пост раскладывается (fan-out-on-write) по лентам подписчиков
+автора, поэтому страница /follow/ читает короткий индексированный
+диапазон FeedEntry вместо join всей таблицы постов с подписками.
+У популярных авторов (больше FEED_FANOUT_LIMIT подписчиков) пост
+в ленты не раскладывается, а подмешивается при чтении: их посты
+читаются диапазонами индекса (author, -pub_date, -id) и сливаются
+со страницей входящей ленты по ключу (pub_date, id). Когда автор
+перестает быть популярным, его последние посты раскладываются по
+лентам подписчиков, иначе они пропали бы из них.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .counters import author_stats
+from .models import AuthorStats, FeedEntry, Follow, Post, User
+from .utils import COUNT_POST_PAGE, CursorPaginator
+
+BATCH_SIZE: int = 1000
+
+
+def _followers_count(author_id):
+    return AuthorStats.objects.filter(user_id=author_id).values_list(
+        'followers_count', flat=True
+    ).first() or 0
+
+
+def is_popular(author):
+    """Больше ли у автора FEED_FANOUT_LIMIT подписчиков.
+
+    Число берется из AuthorStats. Строки нет — нет и подписчиков: ее
+    создает первая подписка на автора (posts.signals.follows_added).
+    """
+    author_id = getattr(author, 'pk', author)
+    return _followers_count(author_id) > settings.FEED_FANOUT_LIMIT
+
+
+def _entries(post, user_ids):
+    return [
+        FeedEntry(
+            user_id=user_id,
+            post_id=post.pk,
+            author_id=post.author_id,
+            pub_date=post.pub_date,
+        )
+        for user_id in user_ids
+    ]
+
+
+def fan_out(post):
+    """Раскладывает новый пост по лентам подписчиков автора."""
+    if is_popular(post.author_id):
+        return
+    follower_ids = Follow.objects.filter(
+        author_id=post.author_id
+    ).values_list('user_id', flat=True)
+    FeedEntry.objects.bulk_create(
+        _entries(post, follower_ids), batch_size=BATCH_SIZE
+    )
+
+
+def backfill(user, author):
+    """Добавляет в ленту подписчика последние посты автора."""
+    if is_popular(author):
+        return
+    posts = Post.objects.filter(author=author).only(
+        'pk', 'author_id', 'pub_date'
+    )[:settings.FEED_BACKFILL_LIMIT]
+    FeedEntry.objects.bulk_create(
+        [entry for post in posts for entry in _entries(post, [user.pk])],
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def unfollowed(author_id):
+    """Раскладывает посты автора, который после отписки перестал быть
+    популярным: пока он им был, его посты в ленты не писались.
+    """
+    if _followers_count(author_id) != settings.FEED_FANOUT_LIMIT:
+        return
+    follower_ids = list(Follow.objects.filter(
+        author_id=author_id
+    ).values_list('user_id', flat=True))
+    posts = Post.objects.filter(author_id=author_id).only(
+        'pk', 'author_id', 'pub_date'
+    )[:settings.FEED_BACKFILL_LIMIT]
+    FeedEntry.objects.bulk_create(
+        [entry for post in posts for entry in _entries(post, follower_ids)],
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def prune(user, author):
+    """Убирает из ленты подписчика посты автора, от которого он отписался."""
+    FeedEntry.objects.filter(user=user, author=author).delete()
+
+
+def popular_followed(user):
+    """id популярных авторов, на которых подписан user."""
+    return list(AuthorStats.objects.filter(
+        user__following__user=user,
+        followers_count__gt=settings.FEED_FANOUT_LIMIT,
+    ).values_list('user_id', flat=True))
+
+
+class FeedPaginator(CursorPaginator):
+    """Лента подписок user по курсору (pub_date, id поста).
+
+    Страница собирается одним запросом из коротких диапазонов индекса:
+    per_page + 1 записей входящей ленты по feed_user_pub_date_idx и
+    столько же постов каждого популярного автора по
+    post_author_pub_date_idx. Посты читаются по первичному ключу и
+    сливаются по (pub_date, id) — сортируются только строки диапазонов.
+    """
+
+    def __init__(self, user, per_page, with_text=True, **kwargs):
+        super().__init__(
+            Post.objects.for_feed(with_text=with_text), per_page, **kwargs
+        )
+        self.user = user
+        self.popular = popular_followed(user)
+
+    def _page(self, entries, posts, order, limit):
+        ranges = Q(pk__in=entries.order_by(
+            *(field.replace('pk', 'post_id') for field in order)
+        ).values('post_id')[:limit])
+        for author_id in self.popular:
+            ranges |= Q(pk__in=posts.filter(author_id=author_id).order_by(
+                *order
+            ).values('pk')[:limit])
+        return list(self.object_list.filter(ranges).order_by(*order)[:limit])
+
+    def _newer(self, pub_date, pk, limit):
+        entries = FeedEntry.objects.filter(
+            Q(pub_date__gt=pub_date) | Q(post_id__gt=pk),
+            user=self.user,
+            pub_date__gte=pub_date,
+        )
+        posts = Post.objects.filter(
+            Q(pub_date__gt=pub_date) | Q(pk__gt=pk),
+            pub_date__gte=pub_date,
+        )
+        return self._page(entries, posts, ('pub_date', 'pk'), limit)
+
+    def _older(self, key, limit):
+        entries = FeedEntry.objects.filter(user=self.user)
+        posts = Post.objects.all()
+        if key is not None:
+            pub_date, pk = key
+            entries = entries.filter(
+                Q(pub_date__lt=pub_date) | Q(post_id__lt=pk),
+                pub_date__lte=pub_date,
+            )
+            posts = posts.filter(
+                Q(pub_date__lt=pub_date) | Q(pk__lt=pk),
+                pub_date__lte=pub_date,
+            )
+        return self._page(entries, posts, ('-pub_date', '-pk'), limit)
+
+
+def feed_page(request, user, per_page=COUNT_POST_PAGE, with_text=True):
+    """Страница ленты подписок по ?after=/?before=.
+
+    Старые ссылки ?page=N ведут на первую страницу: номер страницы
+    потребовал бы OFFSET по слиянию всех диапазонов.
+    """
+    paginator = FeedPaginator(user, per_page, with_text=with_text)
+    return paginator.cursor_page(
+        after=request.GET.get('after'), before=request.GET.get('before')
+    )
+
+
+def rebuild():
+    """Пересобирает все входящие ленты из Follow и Post.
+
+    Возвращает число записанных записей ленты.
+    """
+    created = 0
+    with transaction.atomic():
+        FeedEntry.objects.all().delete()
+        follows = Follow.objects.order_by('author_id').values_list(
+            'author_id', 'user_id'
+        )
+        followers = {}
+        for author_id, user_id in follows.iterator():
+            followers.setdefault(author_id, []).append(user_id)
+        for author_id, user_ids in followers.items():
+            if len(user_ids) > settings.FEED_FANOUT_LIMIT:
+                # Лента читает популярность из AuthorStats.
+                author_stats(User(pk=author_id))
+                continue
+            posts = Post.objects.filter(author_id=author_id).only(
+                'pk', 'author_id', 'pub_date'
+            )[:settings.FEED_BACKFILL_LIMIT]
+            batch = []
+            for post in posts:
+                batch.extend(_entries(post, user_ids))
+                if len(batch) >= BATCH_SIZE:
+                    FeedEntry.objects.bulk_create(batch)
+                    created += len(batch)
+                    batch = []
+            FeedEntry.objects.bulk_create(batch)
+            created += len(batch)
+    return created
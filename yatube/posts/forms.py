@@ -1,5 +1,6 @@
 from django import forms
 
+from . import uploads
 from .models import Post, Comment
 
 
@@ -11,6 +12,16 @@ class PostForm(forms.ModelForm):
             'name': 'Текст поста',
         }
 
+    def clean_image(self):
+        # ImageField уже проверил заголовок файла, но пиксели еще не
+        # декодировались: ограничения проверяются до этого.
+        image = self.cleaned_data['image']
+        if not image or 'image' not in self.files:
+            return image
+        uploads.check_size(image)
+        uploads.check_dimensions(image)
+        return uploads.normalize(image)
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
@@ -0,0 +1,291 @@
+import asyncio
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import time
+from http import HTTPStatus
+from urllib.parse import unquote
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import (
+    ThreadedWSGIServer, WSGIRequestHandler,
+)
+from django.core.wsgi import get_wsgi_application
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+
+from posts.models import Follow, Group, Post, User
+from posts.utils import encode_cursor
+
+from .bench_views import HOST, SAMPLE_SIZE, git_commit, percentile
+
+SERVERS = ('wsgi', 'asgi')
+
+# Очередь на прием соединений у обоих серверов одинаковая, иначе при
+# сотнях одновременных подключений замер упрется в backlog.
+BACKLOG: int = 1024
+
+READY_TIMEOUT: int = 30
+
+
+class QuietWSGIServer(ThreadedWSGIServer):
+    request_queue_size = BACKLOG
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+async def serve_asgi(application, host, port):
+    """Простейший HTTP/1.1-сервер для ASGI: запрос на соединение.
+
+    Нужен только замеру, чтобы не тянуть uvicorn в зависимости;
+    в развертывании приложение запускается настоящим ASGI-сервером.
+    """
+    async def handle(reader, writer):
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            writer.close()
+            return
+        request_line, *lines = head.decode('latin-1').split('\r\n')
+        method, target, version = request_line.split(' ', 2)
+        headers = [
+            (name.strip().lower().encode('latin-1'),
+             value.strip().encode('latin-1'))
+            for name, value in (
+                line.split(':', 1) for line in lines if ':' in line
+            )
+        ]
+        length = int(dict(headers).get(b'content-length', b'0'))
+        body = await reader.readexactly(length) if length else b''
+        path, _, query = target.partition('?')
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': version.split('/', 1)[1],
+            'method': method,
+            'scheme': 'http',
+            'path': unquote(path),
+            'raw_path': path.encode('latin-1'),
+            'query_string': query.encode('latin-1'),
+            'root_path': '',
+            'headers': headers,
+            'server': (host, port),
+            'client': writer.get_extra_info('peername')[:2],
+        }
+        messages = [{'type': 'http.request', 'body': body}]
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                head = [f'HTTP/1.1 {status} {HTTPStatus(status).phrase}']
+                head.extend(
+                    f'{name.decode("latin-1")}: {value.decode("latin-1")}'
+                    for name, value in message['headers']
+                )
+                head.append('Connection: close')
+                writer.write(('\r\n'.join(head) + '\r\n\r\n').encode(
+                    'latin-1'
+                ))
+            else:
+                writer.write(message.get('body', b''))
+                await writer.drain()
+
+        try:
+            await application(scope, receive, send)
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port, backlog=BACKLOG)
+    async with server:
+        await server.serve_forever()
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает пропускную способность (запросов в секунду) страниц '
+        'лент под WSGI и ASGI при сотнях одновременных соединений'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=500)
+        parser.add_argument(
+            '--duration',
+            type=float,
+            default=10,
+            help='Секунд нагрузки на каждый сервер',
+        )
+        parser.add_argument(
+            '--servers', nargs='+', choices=SERVERS, default=list(SERVERS)
+        )
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Файл для JSON')
+        parser.add_argument(
+            '--serve',
+            choices=SERVERS,
+            help='Только запустить сервер (так замер запускает серверы)',
+        )
+
+    def handle(self, *args, **options):
+        if options['serve']:
+            return self._serve(options['serve'], options['port'])
+        random.seed(options['seed'])
+        paths, cookie = self._paths()
+        results = {}
+        for server in options['servers']:
+            process = self._start(server, options['port'])
+            try:
+                results[server] = asyncio.run(self._load(
+                    options['port'], paths, cookie,
+                    options['connections'], options['duration'],
+                ))
+            finally:
+                process.send_signal(signal.SIGINT)
+                process.wait(READY_TIMEOUT)
+        for server, result in results.items():
+            self.stderr.write(
+                f'{server:<5} {result["requests_per_second"]:>9.1f} '
+                f'запросов/с  p50 {result["p50_ms"]:.1f} мс  '
+                f'p99 {result["p99_ms"]:.1f} мс  '
+                f'ошибок {result["errors"]}',
+                style_func=str,
+            )
+        report = json.dumps({
+            'meta': {
+                'commit': git_commit(),
+                'connections': options['connections'],
+                'duration': options['duration'],
+                'asgi_threads': settings.ASGI_THREADS,
+                'db_pool_threads': settings.DB_POOL_THREADS,
+                'database': connections['default'].vendor,
+            },
+            'servers': results,
+        }, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(report + '\n')
+        else:
+            self.stdout.write(report)
+
+    def _serve(self, server, port):
+        if server == 'wsgi':
+            httpd = QuietWSGIServer(('127.0.0.1', port), QuietRequestHandler)
+            httpd.set_app(get_wsgi_application())
+            try:
+                httpd.serve_forever()
+            except KeyboardInterrupt:
+                httpd.server_close()
+            return
+        from yatube.asgi import application
+        try:
+            asyncio.run(serve_asgi(application, '127.0.0.1', port))
+        except KeyboardInterrupt:
+            pass
+
+    def _paths(self):
+        """Адреса лент и постов вперемешку и кука читателя ленты подписок."""
+        reader = User.objects.filter(
+            pk__in=Follow.objects.values('user_id')
+        ).first()
+        posts = list(Post.objects.order_by('-pub_date').only(
+            'pk', 'pub_date'
+        )[:SAMPLE_SIZE * 10])
+        if reader is None or not posts:
+            raise CommandError(
+                'Мало данных для замера; заполните базу командой '
+                'seed_benchmark'
+            )
+        groups = list(Group.objects.values_list('slug', flat=True)[
+            :SAMPLE_SIZE
+        ])
+        authors = list(User.objects.filter(posts__isnull=False).distinct(
+        ).values_list('username', flat=True)[:SAMPLE_SIZE])
+        paths = []
+        for post in random.sample(posts, min(len(posts), SAMPLE_SIZE)):
+            paths.append(
+                f'{reverse("posts:index")}?after={encode_cursor(post)}'
+            )
+            paths.append(reverse('posts:post_detail', args=[post.pk]))
+        paths.extend(
+            reverse('posts:group_list', args=[slug]) for slug in groups
+        )
+        paths.extend(
+            reverse('posts:profile', args=[username]) for username in authors
+        )
+        paths.append(reverse('posts:follow_index'))
+        client = Client()
+        client.force_login(reader)
+        cookie = f'{settings.SESSION_COOKIE_NAME}=' + client.cookies[
+            settings.SESSION_COOKIE_NAME
+        ].value
+        return paths, cookie
+
+    def _start(self, server, port):
+        process = subprocess.Popen([
+            sys.executable,
+            os.path.join(settings.BASE_DIR, 'manage.py'),
+            'bench_asgi', '--serve', server, '--port', str(port),
+        ])
+        deadline = time.monotonic() + READY_TIMEOUT
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', port), 1).close()
+                return process
+            except OSError:
+                time.sleep(0.1)
+        process.kill()
+        raise CommandError(f'Сервер {server} не запустился')
+
+    async def _load(self, port, paths, cookie, concurrency, duration):
+        latencies, errors = [], []
+        deadline = time.monotonic() + duration
+
+        async def fetch(path):
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            try:
+                writer.write((
+                    f'GET {path} HTTP/1.1\r\nHost: {HOST}\r\n'
+                    f'Cookie: {cookie}\r\nConnection: close\r\n\r\n'
+                ).encode())
+                response = await reader.read()
+            finally:
+                writer.close()
+            return int(response.split(b' ', 2)[1])
+
+        async def work():
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    ok = await fetch(random.choice(paths)) < 400
+                except (OSError, IndexError, ValueError):
+                    ok = False
+                latencies.append((time.perf_counter() - started) * 1000)
+                if not ok:
+                    errors.append(1)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(work() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        completed = len(latencies) - len(errors)
+        return {
+            'requests': len(latencies),
+            'errors': len(errors),
+            'seconds': round(elapsed, 3),
+            'requests_per_second': round(completed / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+        }
@@ -0,0 +1,147 @@
+import json
+import random
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.signals import request_finished, request_started
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+
+from core.db.pool import close_pools
+from posts.models import Post
+
+from .bench_views import git_commit, percentile
+
+# Настройки базы для каждого режима поверх DATABASES['default'].
+MODES = {
+    # Как было: Django по умолчанию, соединение на каждый запрос.
+    'django': {'CONN_MAX_AGE': 0, 'POOL': None, 'PRAGMAS': {}},
+    # Соединение на каждый запрос, но с PRAGMA.
+    'fresh': {'CONN_MAX_AGE': 0, 'POOL': None},
+    # Постоянное соединение у каждого потока.
+    'persistent': {'CONN_MAX_AGE': 600, 'POOL': None},
+    # Общий пул соединений.
+    'pooled': {'CONN_MAX_AGE': 600},
+}
+
+QUERIES_PER_REQUEST: int = 3
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет, сколько стоит подключение к базе в каждом запросе: '
+        'без переиспользования, с постоянными соединениями и с пулом'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=500,
+            help='Запросов на каждый поток',
+        )
+        parser.add_argument(
+            '--modes', nargs='+', choices=MODES, default=list(MODES)
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Файл для JSON')
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        post_ids = list(Post.objects.values_list('pk', flat=True)[:1000])
+        if not post_ids:
+            raise CommandError(
+                'В базе нет постов; заполните ее командой seed_benchmark'
+            )
+        settings_dict = connection.settings_dict
+        original = {name: settings_dict.get(name) for name in (
+            'CONN_MAX_AGE', 'POOL', 'PRAGMAS'
+        )}
+        connections.close_all()
+        results = {}
+        try:
+            for mode in options['modes']:
+                settings_dict.update(original)
+                settings_dict.update(MODES[mode])
+                results[mode] = self._measure(
+                    post_ids, options['threads'], options['requests']
+                )
+                close_pools()
+        finally:
+            settings_dict.update(original)
+        for mode, result in results.items():
+            self.stderr.write(
+                f'{mode:<11} подключение p50 {result["setup_p50_us"]:>7.1f} '
+                f'мкс  p99 {result["setup_p99_us"]:>7.1f} мкс  '
+                f'запрос p50 {result["request_p50_us"]:>7.1f} мкс  '
+                f'соединений открыто {result["connections_opened"]}',
+                style_func=str,
+            )
+        report = json.dumps({
+            'meta': {
+                'commit': git_commit(),
+                'threads': options['threads'],
+                'requests': options['requests'],
+                'queries_per_request': QUERIES_PER_REQUEST,
+                'database': connection.vendor,
+            },
+            'modes': results,
+        }, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(report + '\n')
+        else:
+            self.stdout.write(report)
+
+    def _measure(self, post_ids, threads, count):
+        setups, requests, opened = [], [], []
+        start = threading.Barrier(threads)
+
+        def created(sender, connection, **kwargs):
+            opened.append(1)
+
+        def work():
+            own_setups, own_requests = [], []
+            start.wait()
+            try:
+                for _ in range(count):
+                    started = time.perf_counter()
+                    request_started.send(sender=self.__class__)
+                    connection.ensure_connection()
+                    connected = time.perf_counter()
+                    for _ in range(QUERIES_PER_REQUEST):
+                        Post.objects.filter(
+                            pk=random.choice(post_ids)
+                        ).exists()
+                    request_finished.send(sender=self.__class__)
+                    finished = time.perf_counter()
+                    own_setups.append((connected - started) * 1e6)
+                    own_requests.append((finished - started) * 1e6)
+            finally:
+                setups.extend(own_setups)
+                requests.extend(own_requests)
+                connections.close_all()
+
+        connection_created.connect(created)
+        try:
+            workers = [threading.Thread(target=work) for _ in range(threads)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        finally:
+            connection_created.disconnect(created)
+        return {
+            'setup_p50_us': round(percentile(setups, 50), 1),
+            'setup_p99_us': round(percentile(setups, 99), 1),
+            'request_p50_us': round(percentile(requests, 50), 1),
+            'request_p99_us': round(percentile(requests, 99), 1),
+            # connection_created приходит и на соединение из пула,
+            # поэтому у пула физические подключения считает он сам.
+            'connections_opened': (
+                connection.pool.connects if connection.pooled
+                else len(opened)
+            ),
+        }
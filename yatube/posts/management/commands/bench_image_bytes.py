@@ -0,0 +1,88 @@
+from io import BytesIO
+
+from django.core.management.base import BaseCommand
+from PIL import Image, ImageOps
+
+from posts import thumbnails
+from posts.models import Post
+from posts.utils import COUNT_POST_PAGE
+
+# Так {% thumbnail post.image "960x339" crop="center" upscale=True %}
+# кодировал картинку sorl с настройками по умолчанию.
+SORL_OPTIONS = {'quality': 95, 'progressive': True}
+
+VIEWPORTS = (
+    ('телефон, 360px @2x', 720),
+    ('ноутбук, 1280px @1x', 960),
+)
+
+
+def sorl_bytes(image):
+    image = image.convert('RGB')
+    fitted = ImageOps.fit(image, thumbnails.CARD_SIZE, Image.LANCZOS)
+    buffer = BytesIO()
+    fitted.save(buffer, 'JPEG', **SORL_OPTIONS)
+    return len(buffer.getvalue())
+
+
+def chosen_bytes(encoded, needed_width):
+    """Размер версии, которую браузер выберет из <picture>.
+
+    Форматы в encoded идут в порядке предпочтения, поэтому лучший из
+    поддерживаемых — первый.
+    """
+    candidates = [item for item in encoded if item[0] == encoded[0][0]]
+    for mime, width, extension, data in candidates:
+        if width >= needed_width:
+            return len(data)
+    return len(candidates[-1][3])
+
+
+def synthetic_photo(seed):
+    noise = Image.effect_noise((1920, 1080), 24 + seed)
+    gradient = Image.linear_gradient('L').resize((1920, 1080))
+    return Image.merge('RGB', (gradient, noise, gradient.rotate(seed * 30)))
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает объем картинок первой страницы ленты до и после '
+        'адаптивных версий'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--synthetic',
+            action='store_true',
+            help='Взять сгенерированные фотографии вместо постов из базы',
+        )
+
+    def _images(self, synthetic):
+        if synthetic:
+            return [synthetic_photo(seed) for seed in range(COUNT_POST_PAGE)]
+        images = []
+        for post in Post.objects.exclude(image='')[:COUNT_POST_PAGE]:
+            with post.image.open('rb') as original:
+                image = Image.open(original)
+                image.load()
+                images.append(image)
+        return images
+
+    def handle(self, *args, **options):
+        images = self._images(options['synthetic'])
+        if not images:
+            self.stdout.write('Нет постов с картинками, см. --synthetic')
+            return
+        formats = ', '.join(fmt[1] for fmt in thumbnails.supported_formats())
+        self.stdout.write(
+            f'Картинок на странице: {len(images)}, форматы: {formats}'
+        )
+        before = sum(sorl_bytes(image) for image in images)
+        self.stdout.write(f'до (sorl 960x339 JPEG): {before} байт')
+        encoded = [thumbnails.encode(image) for image in images]
+        for label, needed_width in VIEWPORTS:
+            after = sum(chosen_bytes(item, needed_width) for item in encoded)
+            self.stdout.write(
+                f'после, {label}: {after} байт '
+                f'({after / before:.0%} от прежнего)'
+            )
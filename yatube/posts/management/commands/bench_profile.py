@@ -0,0 +1,135 @@
+import json
+import random
+import time
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from posts import counters
+from posts.models import AuthorStats, Post, User
+from posts.utils import encode_cursor
+
+from .bench_views import HOST, git_commit, summary
+from .seed_benchmark import explicit_dates, sentence
+
+MODES = ('sequential', 'parallel')
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет задержку страницы профиля автора с большим числом '
+        'постов (первая страница и страница глубоко в ленте)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=100_000)
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--warmup', type=int, default=10)
+        parser.add_argument(
+            '--modes', nargs='+', choices=MODES, default=list(MODES),
+            help='Запросы загрузчика профиля по очереди или одновременно',
+        )
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--prefix', default='bench')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Файл для JSON')
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        author = self._author(options)
+        reader, _ = User.objects.get_or_create(
+            username=f'{options["prefix"]}-profile-reader'
+        )
+        client = Client(HTTP_HOST=HOST)
+        client.force_login(reader)
+        cursors = [
+            encode_cursor(post)
+            for post in Post.objects.filter(author=author).only(
+                'pk', 'pub_date'
+            ).order_by('?')[:options['requests']]
+        ]
+        url = reverse('posts:profile', args=[author.username])
+        results = {}
+        for mode in options['modes']:
+            with override_settings(PARALLEL_QUERIES=mode == 'parallel'):
+                results[mode] = {
+                    'first_page': self._measure(
+                        client, url, lambda: {}, options
+                    ),
+                    'deep_page': self._measure(
+                        client, url,
+                        lambda: {'after': random.choice(cursors)},
+                        options,
+                    ),
+                }
+        for mode, pages in results.items():
+            for page, result in pages.items():
+                self.stderr.write(
+                    f'{mode:<10} {page:<10} p50 {result["p50_ms"]:.1f} мс  '
+                    f'p99 {result["p99_ms"]:.1f} мс  '
+                    f'SQL {result["queries_max"]}',
+                    style_func=str,
+                )
+        report = json.dumps({
+            'meta': {
+                'commit': git_commit(),
+                'posts': options['posts'],
+                'requests': options['requests'],
+                'database': connection.vendor,
+            },
+            'modes': results,
+        }, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(report + '\n')
+        else:
+            self.stdout.write(report)
+
+    def _author(self, options):
+        """Автор с options['posts'] постами; недостающие досоздаются."""
+        author, _ = User.objects.get_or_create(
+            username=f'{options["prefix"]}-prolific'
+        )
+        missing = options['posts'] - author.posts.count()
+        if missing <= 0:
+            return author
+        started = timezone.now()
+        with transaction.atomic(), explicit_dates(
+            Post._meta.get_field('pub_date')
+        ):
+            for offset in range(0, missing, options['batch_size']):
+                Post.objects.bulk_create([
+                    Post(
+                        author=author,
+                        text=sentence(5, 30),
+                        pub_date=started - timedelta(minutes=number),
+                    )
+                    for number in range(
+                        offset, min(offset + options['batch_size'], missing)
+                    )
+                ])
+            AuthorStats.objects.filter(user=author).delete()
+            counters.author_stats(author)
+        return author
+
+    def _measure(self, client, url, params, options):
+        for _ in range(options['warmup']):
+            client.get(url, params())
+        latencies, queries, errors = [], [], 0
+        for _ in range(options['requests']):
+            # Холодный кеш страниц: замеряется сама загрузка данных.
+            cache.clear()
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                response = client.get(url, params())
+                latencies.append((time.perf_counter() - started) * 1000)
+            queries.append(len(context.captured_queries))
+            if response.status_code >= 400:
+                errors += 1
+        return summary(latencies, queries, errors)
@@ -0,0 +1,78 @@
+import threading
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory
+
+from posts import views
+from posts.caching import POSTS, bump_generation, cache_feed
+
+PATH = '/'
+
+NAIVE_KEY = 'naive.{}'
+
+
+def naive_cache(view):
+    """Кеш без защиты: каждый промах рендерит страницу заново."""
+    def wrapper(request, *args, **kwargs):
+        key = NAIVE_KEY.format(request.get_full_path())
+        response = cache.get(key)
+        if response is None:
+            response = view(request, *args, **kwargs)
+            cache.set(key, response, None)
+        return response
+    return wrapper
+
+
+class Command(BaseCommand):
+    help = (
+        'Считает, сколько раз главная страница рендерится, когда ее кеш '
+        'истекает под одновременными запросами'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=32)
+        parser.add_argument('--rounds', type=int, default=5)
+
+    def handle(self, *args, **options):
+        raw_index = views.index.__wrapped__.__wrapped__
+        for name, decorate in (
+            ('naive', naive_cache),
+            ('single-flight', cache_feed(POSTS)),
+        ):
+            renders = []
+
+            def counted(request):
+                renders.append(1)
+                return raw_index(request)
+
+            view = decorate(counted)
+            for _ in range(options['rounds']):
+                cache.delete(NAIVE_KEY.format(PATH))
+                bump_generation(POSTS)
+                self._burst(view, options['threads'])
+            self.stdout.write(
+                f'{name}: {len(renders) / options["rounds"]:.1f} '
+                f'рендеров ленты на одно истечение кеша '
+                f'({options["threads"]} потоков)'
+            )
+
+    def _burst(self, view, threads):
+        barrier = threading.Barrier(threads)
+
+        def hit():
+            request = RequestFactory().get(PATH)
+            request.user = AnonymousUser()
+            barrier.wait()
+            try:
+                view(request)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=hit) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
@@ -0,0 +1,234 @@
+import json
+import math
+import random
+import subprocess
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from posts.models import Comment, Follow, Group, Post, User
+from posts.utils import encode_cursor
+
+VIEWS = (
+    'index',
+    'group_posts',
+    'profile',
+    'post_detail',
+    'follow_index',
+    'add_comment',
+)
+
+PERCENTILES = (50, 95, 99)
+
+# Сколько объектов каждого вида берется в выборку адресов.
+SAMPLE_SIZE: int = 200
+
+HOST = settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS else 'localhost'
+
+
+def percentile(values, rank):
+    """Процентиль по методу ближайшего ранга."""
+    ordered = sorted(values)
+    index = max(math.ceil(rank / 100 * len(ordered)) - 1, 0)
+    return ordered[index]
+
+
+def summary(latencies, queries, errors):
+    result = {
+        'requests': len(latencies),
+        'errors': errors,
+        'mean_ms': round(sum(latencies) / len(latencies), 3),
+        'max_ms': round(max(latencies), 3),
+        'queries_mean': round(sum(queries) / len(queries), 2),
+        'queries_max': max(queries),
+    }
+    for rank in PERCENTILES:
+        result[f'p{rank}_ms'] = round(percentile(latencies, rank), 3)
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, check=True, text=True,
+            cwd=settings.BASE_DIR,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет задержку (p50/p95/p99) и число SQL-запросов основных '
+        'страниц и пишет результат в JSON для сравнения между коммитами'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--warmup', type=int, default=20)
+        parser.add_argument(
+            '--views', nargs='+', choices=VIEWS, default=list(VIEWS)
+        )
+        parser.add_argument(
+            '--cold',
+            action='store_true',
+            help='Очищать кеш перед каждым запросом',
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--output', help='Файл для JSON; по умолчанию stdout'
+        )
+        parser.add_argument(
+            '--compare', help='JSON прошлого замера для сравнения'
+        )
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        self.cold = options['cold']
+        self.reader = self._reader()
+        if self.reader is None:
+            raise CommandError(
+                'В базе нет подписок; заполните ее командой seed_benchmark'
+            )
+        self.client = Client(HTTP_HOST=HOST)
+        self.client.force_login(self.reader)
+        samples = self._samples()
+        results = {}
+        for name in options['views']:
+            request = getattr(self, f'_{name}')
+            for _ in range(options['warmup']):
+                request(samples)
+            results[name] = self._measure(
+                request, samples, options['requests']
+            )
+        report = {'meta': self._meta(options), 'views': results}
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as file:
+                baseline = json.load(file)['views']
+        # Таблица для человека не мешает JSON в stdout.
+        self._print_table(
+            self.stdout if options['output'] else self.stderr,
+            results,
+            baseline,
+        )
+
+    def _reader(self):
+        """Пользователь с наибольшим числом подписок."""
+        row = Follow.objects.values('user_id').annotate(
+            total=Count('pk')
+        ).order_by('-total').first()
+        if row is None:
+            return None
+        return User.objects.get(pk=row['user_id'])
+
+    def _samples(self):
+        posts = list(Post.objects.order_by('-pub_date').only(
+            'pk', 'pub_date'
+        )[:SAMPLE_SIZE * 10])
+        return {
+            'posts': random.sample(posts, min(len(posts), SAMPLE_SIZE)),
+            'groups': list(Group.objects.annotate(
+                total=Count('posts')
+            ).order_by('-total').values_list('slug', flat=True)[
+                :SAMPLE_SIZE
+            ]),
+            'authors': list(User.objects.annotate(
+                total=Count('posts')
+            ).filter(total__gt=0).order_by('-total').values_list(
+                'username', flat=True
+            )[:SAMPLE_SIZE]),
+        }
+
+    def _measure(self, request, samples, count):
+        latencies, queries, errors = [], [], 0
+        for _ in range(count):
+            if self.cold:
+                cache.clear()
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                response = request(samples)
+                latencies.append((time.perf_counter() - started) * 1000)
+            queries.append(len(context.captured_queries))
+            if response.status_code >= 400:
+                errors += 1
+        return summary(latencies, queries, errors)
+
+    def _index(self, samples):
+        # Половина запросов — первая страница, половина — глубже по ленте.
+        if samples['posts'] and random.random() < 0.5:
+            cursor = encode_cursor(random.choice(samples['posts']))
+            return self.client.get(reverse('posts:index'), {'after': cursor})
+        return self.client.get(reverse('posts:index'))
+
+    def _group_posts(self, samples):
+        return self.client.get(reverse(
+            'posts:group_list', args=[random.choice(samples['groups'])]
+        ))
+
+    def _profile(self, samples):
+        return self.client.get(reverse(
+            'posts:profile', args=[random.choice(samples['authors'])]
+        ))
+
+    def _post_detail(self, samples):
+        return self.client.get(reverse(
+            'posts:post_detail', args=[random.choice(samples['posts']).pk]
+        ))
+
+    def _follow_index(self, samples):
+        return self.client.get(reverse('posts:follow_index'))
+
+    def _add_comment(self, samples):
+        return self.client.post(
+            reverse(
+                'posts:add_comment',
+                args=[random.choice(samples['posts']).pk],
+            ),
+            {'text': 'Комментарий из нагрузочного замера'},
+        )
+
+    def _meta(self, options):
+        return {
+            'commit': git_commit(),
+            'created': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'cache': settings.CACHES['shared']['BACKEND'],
+            'cold': self.cold,
+            'requests': options['requests'],
+            'rows': {
+                model.__name__: model.objects.count()
+                for model in (User, Group, Post, Comment, Follow)
+            },
+        }
+
+    def _print_table(self, out, results, baseline):
+        columns = ('p50_ms', 'p95_ms', 'p99_ms', 'queries_mean')
+        out.write(
+            f'{"view":<14}' + ''.join(f'{column:>22}' for column in columns),
+            style_func=str,
+        )
+        for name, result in results.items():
+            cells = []
+            for column in columns:
+                cell = f'{result[column]:.2f}'
+                old = (baseline or {}).get(name, {}).get(column)
+                if old:
+                    cell += f' ({(result[column] - old) / old:+.0%})'
+                cells.append(f'{cell:>22}')
+            out.write(f'{name:<14}' + ''.join(cells), style_func=str)
@@ -0,0 +1,164 @@
+import json
+import random
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connections
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from posts.models import Comment, Follow, Post, User
+
+from .bench_views import HOST, git_commit, percentile
+
+MODES = ('direct', 'batched')
+
+KINDS = ('comments', 'follows')
+
+MARKER = 'Комментарий из замера записи'
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет, сколько комментариев или подписок в секунду '
+        'принимает сайт при параллельных запросах, с прямой записью и '
+        'с пакетной (WRITE_BEHIND)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=50,
+            help='Запросов на каждый поток',
+        )
+        parser.add_argument('--kind', choices=KINDS, default='comments')
+        parser.add_argument(
+            '--modes', nargs='+', choices=MODES, default=list(MODES)
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--keep',
+            action='store_true',
+            help='Не удалять созданные замером комментарии и подписки',
+        )
+        parser.add_argument('--output', help='Файл для JSON')
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        users = list(User.objects.order_by('pk')[:options['threads'] * 2])
+        post_ids = list(Post.objects.order_by('-pub_date').values_list(
+            'pk', flat=True
+        )[:1000])
+        if len(users) < options['threads'] * 2 or not post_ids:
+            raise CommandError(
+                'Мало данных для замера; заполните базу командой '
+                'seed_benchmark'
+            )
+        writers = users[:options['threads']]
+        targets = {
+            'comments': post_ids,
+            'follows': [user.username for user in users[options['threads']:]],
+        }[options['kind']]
+        self.kept_follows = list(Follow.objects.filter(
+            user__in=writers
+        ).values_list('pk', flat=True))
+        results = {}
+        for mode in options['modes']:
+            with override_settings(WRITE_BEHIND=mode == 'batched'):
+                results[mode] = self._measure(
+                    writers, targets, options['kind'], options['requests']
+                )
+            if not options['keep']:
+                self._cleanup(options['kind'], writers)
+        for mode, result in results.items():
+            self.stderr.write(
+                f'{mode:<8} {result["writes_per_second"]:>10.1f} записей/с  '
+                f'p50 {result["p50_ms"]:.1f} мс  '
+                f'p99 {result["p99_ms"]:.1f} мс  '
+                f'ошибок {result["errors"]}',
+                style_func=str,
+            )
+        report = json.dumps({
+            'meta': {
+                'commit': git_commit(),
+                'kind': options['kind'],
+                'threads': options['threads'],
+                'requests': options['requests'],
+                'database': connections['default'].vendor,
+            },
+            'modes': results,
+        }, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(report + '\n')
+        else:
+            self.stdout.write(report)
+
+    def _measure(self, writers, targets, kind, count):
+        clients = []
+        for user in writers:
+            client = Client(HTTP_HOST=HOST)
+            client.force_login(user)
+            clients.append(client)
+        latencies, errors = [], []
+        start = threading.Barrier(len(clients) + 1)
+
+        def work(client, user):
+            own = []
+            try:
+                start.wait()
+                for _ in range(count):
+                    target = random.choice(targets)
+                    started = time.perf_counter()
+                    try:
+                        response = self._write(client, kind, target)
+                        ok = response.status_code == 302
+                    except Exception:
+                        ok = False
+                    own.append((time.perf_counter() - started) * 1000)
+                    if not ok:
+                        errors.append(1)
+            finally:
+                latencies.extend(own)
+                close_old_connections()
+
+        threads = [
+            threading.Thread(target=work, args=(client, user))
+            for client, user in zip(clients, writers)
+        ]
+        for thread in threads:
+            thread.start()
+        start.wait()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        accepted = len(latencies) - len(errors)
+        return {
+            'accepted': accepted,
+            'errors': len(errors),
+            'seconds': round(elapsed, 3),
+            'writes_per_second': round(accepted / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+        }
+
+    def _write(self, client, kind, target):
+        if kind == 'comments':
+            return client.post(
+                reverse('posts:add_comment', args=[target]),
+                {'text': MARKER},
+            )
+        return client.get(reverse('posts:profile_follow', args=[target]))
+
+    def _cleanup(self, kind, writers):
+        if kind == 'comments':
+            Comment.objects.filter(text=MARKER).delete()
+        else:
+            Follow.objects.filter(user__in=writers).exclude(
+                pk__in=self.kept_follows
+            ).delete()
@@ -0,0 +1,28 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from posts import thumbnails
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Строит недостающие версии картинок существующих постов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=settings.THUMBNAIL_WORKERS,
+            help='Сколько картинок обрабатывать параллельно',
+        )
+
+    def handle(self, *args, **options):
+        post_ids = Post.objects.exclude(image='').filter(
+            Q(thumbnail='') | Q(renditions='')
+        ).values_list('pk', flat=True)
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            built = sum(1 for _ in pool.map(thumbnails.build, post_ids))
+        self.stdout.write(self.style.SUCCESS(f'Обработано постов: {built}'))
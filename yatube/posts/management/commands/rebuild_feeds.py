@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from posts import feed
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает входящие ленты подписчиков из Follow и Post'
+
+    def handle(self, *args, **options):
+        created = feed.rebuild()
+        self.stdout.write(
+            self.style.SUCCESS(f'Записей в лентах: {created}')
+        )
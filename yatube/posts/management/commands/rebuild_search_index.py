@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from posts import search
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает полнотекстовый индекс постов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=search.BATCH_SIZE,
+            help='Сколько постов индексировать за один запрос',
+        )
+
+    def handle(self, *args, **options):
+        indexed = search.rebuild(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Проиндексировано постов: {indexed}'
+        ))
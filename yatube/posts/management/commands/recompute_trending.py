@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from posts import trending
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает с нуля рейтинги «В тренде» постов и групп'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=trending.BATCH_SIZE,
+            help='Сколько событий читать за один запрос',
+        )
+
+    def handle(self, *args, **options):
+        posts, groups = trending.recompute(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'В рейтинге постов: {posts}, групп: {groups}'
+        ))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from posts import counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает денормализованные счетчики постов и подписок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=counters.BATCH_SIZE,
+            help='Сколько строк сверять за один запрос',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        authors = counters.recount_authors(batch_size)
+        comments = counters.recount_comments(batch_size)
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено счетчиков авторов: {authors}, '
+            f'постов: {comments}'
+        ))
@@ -0,0 +1,208 @@
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from posts import counters, feed, search
+from posts.models import Comment, Follow, Group, Post, User
+
+WORDS = (
+    'кот', 'собака', 'солнце', 'город', 'река', 'лес', 'книга', 'музыка',
+    'дорога', 'утро', 'вечер', 'зима', 'лето', 'море', 'горы', 'друзья',
+    'работа', 'отпуск', 'фото', 'кофе', 'чай', 'дождь', 'снег', 'поезд',
+    'самолет', 'кино', 'театр', 'выставка', 'парк', 'велосипед', 'новый',
+    'старый', 'красивый', 'большой', 'маленький', 'сегодня', 'вчера',
+    'завтра', 'смотрим', 'читаем', 'гуляем', 'думаем', 'пишем', 'любим',
+)
+
+
+def skewed(size, exponent):
+    """Случайный индекс от 0 до size - 1 со степенным распределением.
+
+    Чем больше exponent, тем чаще выпадают первые индексы: так
+    распределены подписчики по авторам и комментарии по постам.
+    """
+    return min(int(size * random.random() ** exponent), size - 1)
+
+
+def sentence(min_words, max_words):
+    return ' '.join(random.choices(WORDS, k=random.randint(
+        min_words, max_words
+    ))).capitalize()
+
+
+@contextmanager
+def explicit_dates(*fields):
+    """Отключает auto_now_add, чтобы bulk_create сохранил заданные даты."""
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет базу данными для нагрузочных замеров: пользователи, '
+        'группы, посты, комментарии и подписки со степенным распределением'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10_000)
+        parser.add_argument('--groups', type=int, default=100)
+        parser.add_argument('--posts', type=int, default=200_000)
+        parser.add_argument('--comments', type=int, default=500_000)
+        parser.add_argument('--follows', type=int, default=300_000)
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=365,
+            help='За сколько дней разбросаны даты постов',
+        )
+        parser.add_argument(
+            '--skew',
+            type=float,
+            default=3.0,
+            help='Показатель степенного распределения авторов и постов',
+        )
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--prefix', default='bench')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--skip-derived',
+            action='store_true',
+            help='Не пересчитывать счетчики, ленты и поисковый индекс',
+        )
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        self.batch_size = options['batch_size']
+        self.skew = options['skew']
+        self.now = timezone.now()
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=f'{prefix}_').exists():
+            raise CommandError(
+                f'Данные с префиксом {prefix} уже есть, задайте --prefix'
+            )
+        user_ids = self._step('Пользователи', self._users, prefix, options)
+        group_ids = self._step('Группы', self._groups, prefix, options)
+        post_dates = self._step(
+            'Посты', self._posts, user_ids, group_ids, options
+        )
+        self._step(
+            'Комментарии', self._comments, user_ids, post_dates, options
+        )
+        self._step('Подписки', self._follows, user_ids, options)
+        if options['skip_derived']:
+            return
+        self._step('Счетчики авторов', counters.recount_authors)
+        self._step('Счетчики комментариев', counters.recount_comments)
+        self._step('Ленты подписок', feed.rebuild)
+        self._step('Поисковый индекс', search.rebuild)
+
+    def _step(self, title, function, *args):
+        started = time.perf_counter()
+        with transaction.atomic():
+            result = function(*args)
+        self.stdout.write(
+            f'{title}: {time.perf_counter() - started:.1f} с'
+        )
+        return result
+
+    def _bulk(self, model, objects, **kwargs):
+        batch = []
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) >= self.batch_size:
+                model.objects.bulk_create(batch, **kwargs)
+                batch = []
+        model.objects.bulk_create(batch, **kwargs)
+
+    def _users(self, prefix, options):
+        password = make_password(None)
+        self._bulk(User, (
+            User(username=f'{prefix}_{number:07d}', password=password)
+            for number in range(options['users'])
+        ))
+        return list(User.objects.filter(
+            username__startswith=f'{prefix}_'
+        ).order_by('pk').values_list('pk', flat=True))
+
+    def _groups(self, prefix, options):
+        self._bulk(Group, (
+            Group(
+                title=sentence(1, 3),
+                slug=f'{prefix}-{number:05d}',
+                description=sentence(5, 20),
+            )
+            for number in range(options['groups'])
+        ))
+        return list(Group.objects.filter(
+            slug__startswith=f'{prefix}-'
+        ).order_by('pk').values_list('pk', flat=True))
+
+    def _posts(self, user_ids, group_ids, options):
+        """Создает посты, возвращает {id поста: дата публикации}."""
+        last_pk = Post.objects.order_by('-pk').values_list(
+            'pk', flat=True
+        ).first() or 0
+        period = timedelta(days=options['days'])
+        dates = [
+            self.now - period * random.random()
+            for _ in range(options['posts'])
+        ]
+
+        def posts():
+            for pub_date in dates:
+                group_id = None
+                if group_ids and random.random() < 0.7:
+                    group_id = group_ids[skewed(len(group_ids), self.skew)]
+                yield Post(
+                    author_id=user_ids[skewed(len(user_ids), self.skew)],
+                    group_id=group_id,
+                    text=sentence(5, 60),
+                    pub_date=pub_date,
+                )
+
+        with explicit_dates(Post._meta.get_field('pub_date')):
+            self._bulk(Post, posts())
+        post_ids = Post.objects.filter(pk__gt=last_pk).order_by(
+            'pk'
+        ).values_list('pk', flat=True)
+        return dict(zip(post_ids, dates))
+
+    def _comments(self, user_ids, post_dates, options):
+        post_ids = list(post_dates)
+        if not post_ids:
+            return
+
+        def comments():
+            for _ in range(options['comments']):
+                post_id = post_ids[skewed(len(post_ids), self.skew)]
+                pub_date = post_dates[post_id]
+                yield Comment(
+                    post_id=post_id,
+                    author_id=random.choice(user_ids),
+                    text=sentence(2, 20),
+                    created=pub_date + (self.now - pub_date) * random.random(),
+                )
+
+        with explicit_dates(Comment._meta.get_field('created')):
+            self._bulk(Comment, comments())
+
+    def _follows(self, user_ids, options):
+        def follows():
+            for _ in range(options['follows']):
+                user_id = random.choice(user_ids)
+                author_id = user_ids[skewed(len(user_ids), self.skew)]
+                if user_id != author_id:
+                    yield Follow(user_id=user_id, author_id=author_id)
+
+        self._bulk(Follow, follows(), ignore_conflicts=True)
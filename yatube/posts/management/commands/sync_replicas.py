@@ -0,0 +1,40 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from core.db.replicas import copy_sqlite
+
+
+class Command(BaseCommand):
+    help = (
+        'Копирует основную базу SQLite в файлы реплик YATUBE_DB_REPLICAS '
+        '(локальная замена репликации)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--every',
+            type=float,
+            help='Повторять копирование каждые N секунд (отставание реплик)',
+        )
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError('Реплики не заданы: укажите YATUBE_DB_REPLICAS')
+        if connections[DEFAULT_DB_ALIAS].vendor != 'sqlite':
+            raise CommandError(
+                'Реплики PostgreSQL обновляет сам сервер (потоковая '
+                'репликация)'
+            )
+        source = connections[DEFAULT_DB_ALIAS].settings_dict['NAME']
+        while True:
+            for alias in settings.DATABASE_REPLICAS:
+                copy_sqlite(source, connections[alias].settings_dict['NAME'])
+            self.stdout.write(self.style.SUCCESS(
+                f'Реплик обновлено: {len(settings.DATABASE_REPLICAS)}'
+            ))
+            if not options['every']:
+                return
+            time.sleep(options['every'])
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.16 on 2026-10-17 05:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_post_thumbnail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='renditions',
+            field=models.TextField(blank=True, editable=False, verbose_name='Версии картинки'),
+        ),
+    ]
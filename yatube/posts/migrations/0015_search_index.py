@@ -0,0 +1,62 @@
+from django.db import migrations
+
+SQLITE_CREATE = (
+    "CREATE VIRTUAL TABLE posts_search USING fts5("
+    "text, grp, author, tokenize='unicode61 remove_diacritics 0')",
+    "CREATE VIRTUAL TABLE posts_search_comments USING fts5("
+    "post_id UNINDEXED, text, tokenize='unicode61 remove_diacritics 0')",
+)
+
+POSTGRESQL_CREATE = (
+    'CREATE TABLE posts_search ('
+    'post_id integer PRIMARY KEY REFERENCES posts_post (id) '
+    'ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+    'document tsvector NOT NULL)',
+    'CREATE INDEX posts_search_document_idx '
+    'ON posts_search USING GIN (document)',
+    'CREATE TABLE posts_search_comments ('
+    'comment_id integer PRIMARY KEY REFERENCES posts_comment (id) '
+    'ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+    'post_id integer NOT NULL REFERENCES posts_post (id) '
+    'ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+    'document tsvector NOT NULL)',
+    'CREATE INDEX posts_search_comments_document_idx '
+    'ON posts_search_comments USING GIN (document)',
+    'CREATE INDEX posts_search_comments_post_idx '
+    'ON posts_search_comments (post_id)',
+)
+
+CREATE = {
+    'sqlite': SQLITE_CREATE,
+    'postgresql': POSTGRESQL_CREATE,
+}
+
+
+def create_index(apps, schema_editor):
+    for statement in CREATE.get(schema_editor.connection.vendor, ()):
+        schema_editor.execute(statement)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor in CREATE:
+        schema_editor.execute('DROP TABLE posts_search_comments')
+        schema_editor.execute('DROP TABLE posts_search')
+
+
+def fill_index(apps, schema_editor):
+    # Документы собирает тот же код, что и rebuild_search_index.
+    from posts import search
+
+    search.rebuild()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0014_post_renditions'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+        migrations.RunPython(fill_index, migrations.RunPython.noop),
+    ]
@@ -1,38 +1,134 @@
-from django.db import models
+import json
+
 from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.db import models
+from django.utils.functional import cached_property
 
 User = get_user_model()
 
+FEED_FIELDS = (
+    'text',
+    'pub_date',
+    'updated',
+    'image',
+    'thumbnail',
+    'renditions',
+    'comments_count',
+    'author__username',
+    'author__first_name',
+    'author__last_name',
+    'group__title',
+    'group__slug',
+)
+
+
+class PostQuerySet(models.QuerySet):
+    def for_feed(self, with_text=True):
+        """Проекция для карточек ленты.
+
+        Автор и группа подтягиваются тем же запросом, из их таблиц
+        берутся только поля, которые выводят шаблоны. Если карточке
+        не нужен полный текст, его можно не читать: with_text=False.
+        """
+        fields = FEED_FIELDS if with_text else FEED_FIELDS[1:]
+        return self.select_related('author', 'group').only(*fields)
+
 
 class Post(models.Model):
     text = models.TextField()
     pub_date = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField('Изменен', auto_now=True)
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
-        related_name='posts'
+        related_name='posts',
+        db_index=False
     )
     group = models.ForeignKey(
         'Group',
         on_delete=models.SET_NULL,
         blank=True,
         null=True,
-        related_name='posts'
+        related_name='posts',
+        db_index=False
     )
     image = models.ImageField(
         'Картинка',
         upload_to='posts/',
         blank=True
     )
+    thumbnail = models.ImageField(
+        'Миниатюра',
+        blank=True,
+        editable=False
+    )
+    renditions = models.TextField(
+        'Версии картинки',
+        blank=True,
+        editable=False
+    )
+    comments_count = models.PositiveIntegerField(
+        'Комментариев',
+        default=0,
+        editable=False
+    )
+
+    objects = PostQuerySet.as_manager()
 
     class Meta:
         ordering = ("-pub_date",)
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
+        # Ленты листаются курсором по (pub_date, id), поэтому каждая
+        # лента читается диапазоном своего составного индекса.
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='post_pub_date_idx'
+            ),
+            models.Index(
+                fields=['group', '-pub_date', '-id'],
+                name='post_group_pub_date_idx'
+            ),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='post_author_pub_date_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.text
 
+    @cached_property
+    def _renditions(self):
+        try:
+            return json.loads(self.renditions or '{}')
+        except ValueError:
+            return {}
+
+    def _srcset(self, renditions):
+        return ', '.join(
+            f'{default_storage.url(name)} {width}w'
+            for width, name in renditions
+        )
+
+    @cached_property
+    def image_sources(self):
+        """Источники <picture>: [{'type': ..., 'srcset': ...}, ...].
+
+        JPEG в список не входит — это srcset самого <img>.
+        """
+        return [
+            {'type': mime, 'srcset': self._srcset(renditions)}
+            for mime, renditions in self._renditions.items()
+            if mime != 'image/jpeg'
+        ]
+
+    @cached_property
+    def image_srcset(self):
+        return self._srcset(self._renditions.get('image/jpeg', []))
+
 
 class Group(models.Model):
     title = models.CharField(max_length=200, verbose_name='Заголовок')
@@ -52,7 +148,8 @@ class Comment(models.Model):
         Post,
         on_delete=models.CASCADE,
         related_name='comments',
-        verbose_name='Пост'
+        verbose_name='Пост',
+        db_index=False
     )
     author = models.ForeignKey(
         User,
@@ -66,6 +163,14 @@ class Comment(models.Model):
     class Meta:
         verbose_name = 'Комментарий'
         verbose_name_plural = 'Комментарии'
+        # Комментарии поста листаются курсором по (created, id) в обе
+        # стороны, индекс заменяет и обычный индекс по post_id.
+        indexes = [
+            models.Index(
+                fields=['post', 'created', 'id'],
+                name='comment_post_created_idx'
+            ),
+        ]
 
 
 class Follow(models.Model):
@@ -81,6 +186,8 @@ class Follow(models.Model):
         related_name='following',
         verbose_name='Автор'
     )
+    # У подписок, созданных до появления поля, даты нет.
+    created = models.DateTimeField('Подписан', auto_now_add=True, null=True)
 
     class Meta:
         constraints = [
@@ -89,3 +196,108 @@ class Follow(models.Model):
                 name='unique_follow'
             )
         ]
+
+
+class AuthorStats(models.Model):
+    """Денормализованные счетчики пользователя.
+
+    Обновляются сигналами вместе с постами и подписками, поэтому
+    страницам не нужен COUNT(*) по Post и Follow.
+    """
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats',
+        verbose_name='Пользователь'
+    )
+    posts_count = models.PositiveIntegerField('Постов', default=0)
+    followers_count = models.PositiveIntegerField('Подписчиков', default=0)
+    following_count = models.PositiveIntegerField('Подписок', default=0)
+
+    class Meta:
+        verbose_name = 'Счетчики автора'
+        verbose_name_plural = 'Счетчики авторов'
+
+
+class FeedEntry(models.Model):
+    """Запись во входящей ленте подписчика (fan-out-on-write).
+
+    Дата публикации и автор продублированы из поста, чтобы лента
+    читалась и чистилась по индексу без join с таблицей постов.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed',
+        verbose_name='Подписчик'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Пост'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор'
+    )
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'],
+                name='unique_feed_entry'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-post'],
+                name='feed_user_pub_date_idx'
+            ),
+            models.Index(
+                fields=['user', 'author'],
+                name='feed_user_author_idx'
+            ),
+        ]
+
+
+class PostScore(models.Model):
+    """Рейтинг поста в ленте «В тренде» (см. posts/trending.py).
+
+    score — логарифм суммы весов комментариев и подписок с затуханием,
+    строки сравниваются между собой без пересчета во времени.
+    """
+    post = models.OneToOneField(
+        Post,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='trending_score',
+        verbose_name='Пост'
+    )
+    score = models.FloatField('Оценка', db_index=True)
+
+    class Meta:
+        verbose_name = 'Рейтинг поста'
+        verbose_name_plural = 'Рейтинги постов'
+
+
+class GroupScore(models.Model):
+    """Рейтинг группы по активности в ее постах (см. posts/trending.py)."""
+    group = models.OneToOneField(
+        Group,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='trending_score',
+        verbose_name='Группа'
+    )
+    score = models.FloatField('Оценка', db_index=True)
+
+    class Meta:
+        verbose_name = 'Рейтинг группы'
+        verbose_name_plural = 'Рейтинги групп'
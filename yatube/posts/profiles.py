@@ -0,0 +1,54 @@
+"""Данные страницы профиля за два запроса к базе.
+
+Автор, его счетчики (AuthorStats) и подписан ли на него читатель
+приходят одним запросом: stats через select_related, подписка —
+аннотацией Exists. Страница постов читается вторым запросом по
+индексу (author, pub_date, id) и от первого не зависит: пост
+фильтруется по имени автора, а не по его id. Поэтому при
+PARALLEL_QUERIES оба запроса идут одновременно (core.parallel.gather).
+"""
+from functools import partial
+
+from django.db.models import Exists, OuterRef
+from django.shortcuts import get_object_or_404
+
+from core import parallel
+
+from .counters import author_stats
+from .models import Follow, Post, User
+from .utils import paginator_page
+
+
+def author_query(username, reader):
+    """Автор со счетчиками и флагом is_followed для читателя reader."""
+    return User.objects.select_related('stats').annotate(
+        is_followed=Exists(Follow.objects.filter(
+            author=OuterRef('pk'), user=reader.id
+        ))
+    ).filter(username=username)
+
+
+def author_posts(username):
+    return Post.objects.for_feed().filter(author__username=username)
+
+
+def profile_context(author, posts, page_obj):
+    return {
+        'author': author,
+        'posts': posts,
+        'page_obj': page_obj,
+        # Прежнее имя автора в контексте.
+        'user_profile': author,
+        'following': author.is_followed,
+        'author_stats': author_stats(author),
+    }
+
+
+def load_profile(request, username):
+    """Контекст шаблона posts/profile.html."""
+    posts = author_posts(username)
+    author, page_obj = parallel.gather(
+        partial(get_object_or_404, author_query(username, request.user)),
+        partial(paginator_page, request, posts),
+    )
+    return profile_context(author, posts, page_obj)
@@ -0,0 +1,368 @@
+"""Полнотекстовый поиск по постам.
+
+Документ поста в индексе состоит из трех полей: текст поста, название
+и описание группы, имя автора. Каждый комментарий — отдельный документ
+с id своего поста, поэтому новый комментарий индексируется один, без
+повторного разбора остальных комментариев поста. Оценка поста — сумма
+оценки его документа и лучшего из подходящих комментариев; все слова
+запроса должны найтись в одном документе.
+
+На SQLite индекс — виртуальная таблица FTS5, в которую слова
+записываются уже приведенными к основам (posts.stemmer); результаты
+ранжируются по bm25. На PostgreSQL индекс — tsvector с GIN-индексом,
+основы выделяет словарь russian, ранжирование — ts_rank_cd. На
+остальных базах поиск деградирует до LIKE по тем же полям.
+
+Выдача постраничная по ключу (оценка, id): следующая страница
+продолжает выдачу с позиции курсора, без OFFSET. Индекс обновляется
+сигналами в той же транзакции, что и запись, а команда
+rebuild_search_index пересобирает его целиком.
+"""
+import re
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+
+from .counters import _batches
+from .models import Comment, Post
+from .stemmer import stem
+from .utils import COUNT_POST_PAGE, CURSOR_SEPARATOR
+
+BATCH_SIZE: int = 500
+
+# Из запроса берутся только первые слова: длинный запрос не сделает
+# поиск точнее, а выполняется дольше.
+MAX_QUERY_WORDS: int = 10
+
+# Веса полей документа в bm25: текст, группа, автор.
+SQLITE_WEIGHTS = (4.0, 2.0, 2.0)
+
+# Вес текста комментария в bm25.
+SQLITE_COMMENT_WEIGHT = 1.0
+
+WORD = re.compile(r'\w+')
+
+
+def words(text):
+    """Основы слов текста в нижнем регистре."""
+    return [stem(word) for word in WORD.findall(text.lower())]
+
+
+def _stems(text):
+    return ' '.join(words(text))
+
+
+def _comment_rows(comments):
+    return [
+        (comment.pk, comment.post_id, comment.text) for comment in comments
+    ]
+
+
+def _documents(post_ids):
+    """Поля документов индекса: (id, текст, группа, автор)."""
+    posts = Post.objects.filter(pk__in=post_ids).values_list(
+        'pk', 'text', 'group__title', 'group__description',
+        'author__username', 'author__first_name', 'author__last_name',
+    )
+    for pk, text, title, description, *names in posts:
+        yield (
+            pk,
+            text,
+            ' '.join(filter(None, (title, description))),
+            ' '.join(filter(None, names)),
+        )
+
+
+def _bm25(weights):
+    return f"bm25({', '.join(str(weight) for weight in weights)})"
+
+
+class SqliteIndex:
+    """FTS5: rowid строки posts_search — id поста, а строки
+    posts_search_comments — id комментария."""
+
+    def write(self, cursor, documents):
+        rows = [
+            (pk, *(_stems(field) for field in fields))
+            for pk, *fields in documents
+        ]
+        self.delete(cursor, [row[0] for row in rows])
+        cursor.executemany(
+            'INSERT INTO posts_search (rowid, text, grp, author) '
+            'VALUES (%s, %s, %s, %s)',
+            rows,
+        )
+
+    def write_comments(self, cursor, comments):
+        rows = [(pk, post_id, _stems(text)) for pk, post_id, text in comments]
+        self.delete_comments(cursor, [row[0] for row in rows])
+        cursor.executemany(
+            'INSERT INTO posts_search_comments (rowid, post_id, text) '
+            'VALUES (%s, %s, %s)',
+            rows,
+        )
+
+    def delete(self, cursor, post_ids):
+        cursor.executemany(
+            'DELETE FROM posts_search WHERE rowid = %s',
+            [(pk,) for pk in post_ids],
+        )
+
+    def delete_comments(self, cursor, comment_ids):
+        cursor.executemany(
+            'DELETE FROM posts_search_comments WHERE rowid = %s',
+            [(pk,) for pk in comment_ids],
+        )
+
+    def clear(self, cursor):
+        cursor.execute('DELETE FROM posts_search')
+        cursor.execute('DELETE FROM posts_search_comments')
+
+    def match(self, cursor, query, after, limit):
+        terms = words(query)[:MAX_QUERY_WORDS]
+        if not terms:
+            return []
+        # Оценку считает скрытый столбец rank: в отличие от вызова
+        # bm25(), его можно передать в агрегатную функцию.
+        sql = (
+            'SELECT id, score FROM ('
+            'SELECT id, SUM(score) AS score FROM ('
+            'SELECT rowid AS id, rank AS score FROM posts_search '
+            'WHERE posts_search MATCH %s AND rank MATCH %s '
+            'UNION ALL '
+            'SELECT post_id AS id, MIN(rank) AS score '
+            'FROM posts_search_comments '
+            'WHERE posts_search_comments MATCH %s AND rank MATCH %s '
+            'GROUP BY post_id) GROUP BY id)'
+        )
+        terms = ' '.join(f'"{term}"' for term in terms)
+        params = [
+            terms, _bm25(SQLITE_WEIGHTS),
+            terms, _bm25((0.0, SQLITE_COMMENT_WEIGHT)),
+        ]
+        return _keyset(cursor, sql, params, after, limit)
+
+
+class PostgresIndex:
+    """tsvector с весами полей и GIN-индексом."""
+
+    def write(self, cursor, documents):
+        cursor.executemany(
+            'INSERT INTO posts_search (post_id, document) VALUES (%s, '
+            "setweight(to_tsvector('russian', %s), 'A') || "
+            "setweight(to_tsvector('russian', %s), 'B') || "
+            "setweight(to_tsvector('russian', %s), 'B')) "
+            'ON CONFLICT (post_id) DO UPDATE SET document = EXCLUDED.document',
+            list(documents),
+        )
+
+    def write_comments(self, cursor, comments):
+        cursor.executemany(
+            'INSERT INTO posts_search_comments '
+            '(comment_id, post_id, document) VALUES (%s, %s, '
+            "setweight(to_tsvector('russian', %s), 'D')) "
+            'ON CONFLICT (comment_id) DO UPDATE '
+            'SET document = EXCLUDED.document',
+            list(comments),
+        )
+
+    def delete(self, cursor, post_ids):
+        cursor.execute(
+            'DELETE FROM posts_search WHERE post_id = ANY(%s)',
+            [list(post_ids)],
+        )
+
+    def delete_comments(self, cursor, comment_ids):
+        cursor.execute(
+            'DELETE FROM posts_search_comments WHERE comment_id = ANY(%s)',
+            [list(comment_ids)],
+        )
+
+    def clear(self, cursor):
+        cursor.execute('TRUNCATE posts_search, posts_search_comments')
+
+    def match(self, cursor, query, after, limit):
+        query = ' '.join(WORD.findall(query)[:MAX_QUERY_WORDS])
+        if not query:
+            return []
+        sql = (
+            'SELECT id, score FROM ('
+            'SELECT id, SUM(score) AS score FROM ('
+            'SELECT post_id AS id, '
+            '-ts_rank_cd(document, query)::float8 AS score '
+            "FROM posts_search, plainto_tsquery('russian', %s) query "
+            'WHERE document @@ query '
+            'UNION ALL '
+            'SELECT post_id AS id, '
+            'MIN(-ts_rank_cd(document, query)::float8) AS score '
+            'FROM posts_search_comments, '
+            "plainto_tsquery('russian', %s) query "
+            'WHERE document @@ query GROUP BY post_id'
+            ') matches GROUP BY id) ranked'
+        )
+        return _keyset(cursor, sql, [query, query], after, limit)
+
+
+class LikeIndex:
+    """Запасной вариант без индекса: LIKE, новые посты первыми."""
+
+    def write(self, cursor, documents):
+        pass
+
+    def write_comments(self, cursor, comments):
+        pass
+
+    def delete(self, cursor, post_ids):
+        pass
+
+    def delete_comments(self, cursor, comment_ids):
+        pass
+
+    def clear(self, cursor):
+        pass
+
+    def match(self, cursor, query, after, limit):
+        terms = WORD.findall(query)[:MAX_QUERY_WORDS]
+        if not terms:
+            return []
+        condition = Q()
+        for term in terms:
+            condition &= (
+                Q(text__icontains=term)
+                | Q(comments__text__icontains=term)
+                | Q(group__title__icontains=term)
+                | Q(group__description__icontains=term)
+                | Q(author__username__icontains=term)
+            )
+        posts = Post.objects.filter(condition)
+        if after is not None:
+            posts = posts.filter(pk__lt=after[1])
+        ids = posts.order_by('-pk').values_list('pk', flat=True).distinct()
+        if limit is not None:
+            ids = ids[:limit]
+        return [(pk, -pk) for pk in ids]
+
+
+def _keyset(cursor, sql, params, after, limit):
+    """Дописывает к выдаче условие курсора, порядок и LIMIT."""
+    if after is not None:
+        score, pk = after
+        sql += ' WHERE score > %s OR (score = %s AND id > %s)'
+        params += [score, score, pk]
+    sql += ' ORDER BY score, id'
+    if limit is not None:
+        sql += ' LIMIT %s'
+        params.append(limit)
+    cursor.execute(sql, params)
+    return cursor.fetchall()
+
+
+BACKENDS = {
+    'sqlite': SqliteIndex,
+    'postgresql': PostgresIndex,
+}
+
+
+def backend():
+    return BACKENDS.get(connection.vendor, LikeIndex)()
+
+
+def index_posts(post_ids):
+    """Записывает в индекс актуальные документы постов."""
+    post_ids = list(post_ids)
+    index = backend()
+    with connection.cursor() as cursor:
+        for start in range(0, len(post_ids), BATCH_SIZE):
+            index.write(
+                cursor, _documents(post_ids[start:start + BATCH_SIZE])
+            )
+
+
+def unindex_posts(post_ids):
+    with connection.cursor() as cursor:
+        backend().delete(cursor, list(post_ids))
+
+
+def index_comments(comments):
+    """Записывает в индекс документы комментариев (Comment с pk)."""
+    with connection.cursor() as cursor:
+        backend().write_comments(cursor, _comment_rows(comments))
+
+
+def unindex_comments(comment_ids):
+    with connection.cursor() as cursor:
+        backend().delete_comments(cursor, list(comment_ids))
+
+
+def reindex_group(group_id):
+    index_posts(Post.objects.filter(
+        group_id=group_id
+    ).values_list('pk', flat=True))
+
+
+def reindex_author(user_id):
+    index_posts(Post.objects.filter(
+        author_id=user_id
+    ).values_list('pk', flat=True))
+
+
+def rebuild(batch_size=BATCH_SIZE):
+    """Пересобирает индекс целиком, возвращает число постов в нем."""
+    index = backend()
+    indexed = 0
+    last_pk = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        index.clear(cursor)
+        while True:
+            post_ids = list(Post.objects.filter(
+                pk__gt=last_pk
+            ).order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not post_ids:
+                break
+            index.write(cursor, _documents(post_ids))
+            indexed += len(post_ids)
+            last_pk = post_ids[-1]
+        comments = Comment.objects.only('post', 'text')
+        for batch in _batches(comments, batch_size):
+            index.write_comments(cursor, _comment_rows(batch))
+    return indexed
+
+
+def encode_cursor(score, pk):
+    return urlsafe_base64_encode(
+        force_bytes(f'{score!r}{CURSOR_SEPARATOR}{pk}')
+    )
+
+
+def decode_cursor(token):
+    """Возвращает (оценка, id) из токена или None, если токен битый."""
+    try:
+        raw = urlsafe_base64_decode(token).decode()
+        score, pk = raw.rsplit(CURSOR_SEPARATOR, 1)
+        return float(score), int(pk)
+    except (TypeError, ValueError, UnicodeDecodeError):
+        return None
+
+
+def matching_ids(query, limit=None):
+    """id постов, подходящих под запрос, от лучших к худшим (не больше
+    limit, если он задан)."""
+    with connection.cursor() as cursor:
+        rows = backend().match(cursor, query, None, limit)
+    return [pk for pk, _ in rows]
+
+
+def find_posts(query, after=None, limit=COUNT_POST_PAGE):
+    """Страница выдачи: (посты, курсор следующей страницы или None)."""
+    after = decode_cursor(after) if after else None
+    with connection.cursor() as cursor:
+        rows = backend().match(cursor, query, after, limit + 1)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        pk, score = rows[-1]
+        next_cursor = encode_cursor(score, pk)
+    posts = Post.objects.for_feed().in_bulk([pk for pk, _ in rows])
+    return [posts[pk] for pk, _ in rows if pk in posts], next_cursor
@@ -0,0 +1,165 @@
+import threading
+from collections import Counter
+
+from django.db.models.signals import (
+    post_delete, post_save, pre_delete, pre_save,
+)
+from django.dispatch import receiver
+
+from . import caching, counters, feed, search, trending
+from .models import Comment, Follow, Group, Post, User
+
+# Поля пользователя, которые попадают в поисковый индекс и в карточки
+# его постов.
+USER_NAME_FIELDS = ('username', 'first_name', 'last_name')
+
+# id постов, которые этот поток сейчас удаляет вместе с комментариями.
+_deleting = threading.local()
+
+
+def _deleting_posts():
+    if not hasattr(_deleting, 'posts'):
+        _deleting.posts = set()
+    return _deleting.posts
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, **kwargs):
+    caching.bump_generation(caching.POSTS)
+    search.index_posts([instance.pk])
+    if created:
+        counters.change_author(instance.author_id, 'posts_count', 1)
+        feed.fan_out(instance)
+
+
+@receiver(pre_delete, sender=Post)
+def post_deleting(sender, instance, **kwargs):
+    # Комментарии удаляются каскадом раньше поста. Их сигналы ничего не
+    # делают: счетчик уходит вместе с постом, а индекс и рейтинг группы
+    # обновляются здесь, одним разом на пост.
+    _deleting_posts().add(instance.pk)
+    search.unindex_comments(
+        instance.comments.values_list('pk', flat=True)
+    )
+    trending.post_removed(instance)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    _deleting_posts().discard(instance.pk)
+    counters.change_author(instance.author_id, 'posts_count', -1)
+    search.unindex_posts([instance.pk])
+    caching.invalidate_card(instance)
+    caching.bump_generation(caching.POSTS)
+
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, created, **kwargs):
+    caching.bump_generation(caching.POSTS)
+    if not created:
+        caching.touch_group_posts(instance)
+        search.reindex_group(instance.pk)
+
+
+@receiver(pre_delete, sender=Group)
+def group_deleting(sender, instance, **kwargs):
+    caching.touch_group_posts(instance)
+    caching.bump_generation(caching.POSTS)
+    # После удаления у постов уже не будет group_id, по которому их
+    # можно найти для переиндексации.
+    instance._post_ids = list(instance.posts.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    search.index_posts(instance._post_ids)
+
+
+def comments_added(comments, groups):
+    """Последствия новых комментариев: и одного из сигнала, и пачки
+    из bulk_create (posts.writebehind).
+
+    groups — id группы для каждого id поста комментариев.
+    """
+    per_post = Counter(comment.post_id for comment in comments)
+    for post_id, count in per_post.items():
+        counters.change_comments(post_id, count)
+    caching.bump_generation(caching.POSTS)
+    search.index_comments(comments)
+    trending.record_comments(comments, groups)
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, **kwargs):
+    if not created:
+        search.index_comments([instance])
+        return
+    comments_added([instance], {instance.post_id: instance.post.group_id})
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    if instance.post_id in _deleting_posts():
+        return
+    counters.change_comments(instance.post_id, -1)
+    caching.bump_generation(caching.POSTS)
+    search.unindex_comments([instance.pk])
+    trending.comment_activity(instance, remove=True)
+
+
+@receiver(pre_save, sender=User)
+def user_saving(sender, instance, update_fields, **kwargs):
+    # Индекс и карточки обновляются, только если имя действительно
+    # изменилось: вход на сайт, смена пароля и правка профиля их не
+    # трогают.
+    instance._name_changed = False
+    if instance.pk is None or (
+        update_fields is not None
+        and not set(USER_NAME_FIELDS) & set(update_fields)
+    ):
+        return
+    stored = User.objects.filter(
+        pk=instance.pk
+    ).values_list(*USER_NAME_FIELDS).first()
+    instance._name_changed = stored != tuple(
+        getattr(instance, field) for field in USER_NAME_FIELDS
+    )
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    if created or not instance._name_changed:
+        return
+    caching.touch_author_posts(instance)
+    caching.bump_generation(caching.POSTS)
+    search.reindex_author(instance.pk)
+
+
+def follows_added(follows):
+    """Последствия новых подписок: из сигнала и из posts.writebehind."""
+    # По строке автора лента решает, раскладывать ли его посты.
+    counted = counters.ensure_stats(follow.author_id for follow in follows)
+    for follow in follows:
+        if follow.author_id not in counted:
+            counters.change_author(follow.author_id, 'followers_count', 1)
+        counters.change_author(follow.user_id, 'following_count', 1)
+        feed.backfill(User(pk=follow.user_id), follow.author_id)
+        trending.follow_activity(follow)
+    if follows:
+        caching.bump_generation(caching.FOLLOWS)
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, **kwargs):
+    if created:
+        follows_added([instance])
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    caching.bump_generation(caching.FOLLOWS)
+    counters.change_author(instance.author_id, 'followers_count', -1)
+    counters.change_author(instance.user_id, 'following_count', -1)
+    feed.prune(instance.user_id, instance.author_id)
+    feed.unfollowed(instance.author_id)
+    trending.follow_activity(instance, remove=True)
@@ -0,0 +1,124 @@
+"""Стеммер русского языка по алгоритму Snowball (Портер).
+
+Отрезает окончания и суффиксы, чтобы «котики», «котиков» и «котик»
+давали одну основу. Слова без кириллицы возвращаются как есть.
+"""
+import re
+
+VOWELS = 'аеиоуыэюя'
+
+CYRILLIC = re.compile('[а-я]')
+
+PERFECTIVE_GERUND = (
+    ('в', 'вши', 'вшись'),
+    ('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись'),
+)
+
+ADJECTIVE = (
+    (),
+    (
+        'ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой',
+        'ем', 'им', 'ым', 'ом', 'его', 'ого', 'ему', 'ому', 'их', 'ых',
+        'ую', 'юю', 'ая', 'яя', 'ою', 'ею',
+    ),
+)
+
+PARTICIPLE = (
+    ('ем', 'нн', 'вш', 'ющ', 'щ'),
+    ('ивш', 'ывш', 'ующ'),
+)
+
+REFLEXIVE = ((), ('ся', 'сь'))
+
+VERB = (
+    (
+        'ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но',
+        'ет', 'ют', 'ны', 'ть', 'ешь', 'нно',
+    ),
+    (
+        'ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей',
+        'уй', 'ил', 'ыл', 'им', 'ым', 'ен', 'ило', 'ыло', 'ено', 'ят',
+        'ует', 'уют', 'ит', 'ыт', 'ены', 'ить', 'ыть', 'ишь', 'ую', 'ю',
+    ),
+)
+
+NOUN = (
+    (),
+    (
+        'а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи',
+        'ии', 'и', 'ией', 'ей', 'ой', 'ий', 'й', 'иям', 'ям', 'ием', 'ем',
+        'ам', 'ом', 'о', 'у', 'ах', 'иях', 'ях', 'ы', 'ь', 'ию', 'ью', 'ю',
+        'ия', 'ья', 'я',
+    ),
+)
+
+DERIVATIONAL = ((), ('ост', 'ость'))
+
+SUPERLATIVE = ('ейше', 'ейш')
+
+
+def _region(word, start):
+    """Начало области после первой согласной, следующей за гласной."""
+    for i in range(start + 1, len(word)):
+        if word[i] not in VOWELS and word[i - 1] in VOWELS:
+            return i + 1
+    return len(word)
+
+
+def _regions(word):
+    """Начала областей RV и R2 по правилам Snowball."""
+    rv = next(
+        (i + 1 for i, char in enumerate(word) if char in VOWELS), len(word)
+    )
+    return rv, _region(word, _region(word, 0))
+
+
+def _strip(word, limit, groups):
+    """Отрезает самое длинное окончание из groups, лежащее после limit.
+
+    Окончания первой группы отрезаются, только если перед ними стоит
+    «а» или «я». Возвращает новое слово или None.
+    """
+    best = None
+    for number, endings in enumerate(groups):
+        for ending in endings:
+            if (
+                word.endswith(ending)
+                and len(word) - len(ending) >= limit
+                and (best is None or len(ending) > len(best[1]))
+            ):
+                best = (number, ending)
+    if best is None:
+        return None
+    number, ending = best
+    stem = word[:-len(ending)]
+    if number == 0 and not (len(stem) > limit and stem[-1] in 'ая'):
+        return None
+    return stem
+
+
+def stem(word):
+    word = word.lower().replace('ё', 'е')
+    if not CYRILLIC.search(word):
+        return word
+    rv, r2 = _regions(word)
+    stripped = _strip(word, rv, PERFECTIVE_GERUND)
+    if stripped is None:
+        word = _strip(word, rv, REFLEXIVE) or word
+        adjective = _strip(word, rv, ADJECTIVE)
+        if adjective is not None:
+            stripped = _strip(adjective, rv, PARTICIPLE) or adjective
+        else:
+            stripped = _strip(word, rv, VERB) or _strip(word, rv, NOUN)
+    word = stripped if stripped is not None else word
+    if word.endswith('и') and len(word) - 1 >= rv:
+        word = word[:-1]
+    word = _strip(word, r2, DERIVATIONAL) or word
+    superlative = _strip(word, rv, ((), SUPERLATIVE))
+    if superlative is not None or word.endswith('нн'):
+        word = superlative or word
+        if word.endswith('нн') and len(word) - 2 >= rv:
+            word = word[:-1]
+    elif word.endswith('ь') and len(word) - 1 >= rv:
+        word = word[:-1]
+    return word
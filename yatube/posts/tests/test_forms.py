@@ -1,18 +1,89 @@
+import os
 import shutil
+import struct
+import subprocess
+import sys
 import tempfile
+import threading
+import zlib
 from http import HTTPStatus
+from io import BytesIO
+from unittest import mock, skipUnless
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from PIL import Image
+from posts import thumbnails
 from posts.models import Group, Post
 
 User = get_user_model()
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+# Градиентный JPEG 8000x5000: декодированный целиком, он занял бы
+# в памяти 160 МБ (Pillow хранит RGB по 4 байта на пиксель), а с
+# поворотом и уменьшением без draft пик доходит до 300 МБ.
+LARGE_JPEG_SCRIPT = """
+import sys
+from PIL import Image, ImageOps
+gradient = Image.linear_gradient('L').resize((8000, 5000))
+image = Image.merge('RGB', (gradient, ImageOps.invert(gradient), gradient))
+image.save(sys.argv[1], quality=85)
+"""
+
+
+def png_header(width, height):
+    """Заголовок PNG заданного размера без данных картинки."""
+    def chunk(kind, data):
+        return (
+            struct.pack('>I', len(data)) + kind + data
+            + struct.pack('>I', zlib.crc32(kind + data))
+        )
+    return b'\x89PNG\r\n\x1a\n' + chunk(
+        b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    ) + chunk(b'IDAT', b'') + chunk(b'IEND', b'')
+
+
+class RssSampler(threading.Thread):
+    """Замеряет пиковый RSS процесса, пока работает блок with."""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.stopped = threading.Event()
+        self.peak = 0
+
+    @staticmethod
+    def rss():
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.peak = max(self.peak, self.rss())
+            self.stopped.wait(0.002)
+
+    def __enter__(self):
+        self.baseline = self.rss()
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.join()
+
 
 @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
 class PostFormsTest(TestCase):
@@ -42,17 +113,9 @@ class PostFormsTest(TestCase):
     def test_create_posts(self):
         """Валидная форма создает новый пост."""
         posts_count = Post.objects.count()
-        small_gif = (
-            b'\x47\x49\x46\x38\x39\x61\x02\x00'
-            b'\x01\x00\x80\x00\x00\x00\x00\x00'
-            b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
-            b'\x00\x00\x00\x2C\x00\x00\x00\x00'
-            b'\x02\x00\x01\x00\x00\x02\x02\x0C'
-            b'\x0A\x00\x3B'
-        )
         uploaded = SimpleUploadedFile(
             name='small.gif',
-            content=small_gif,
+            content=SMALL_GIF,
             content_type='image/gif'
         )
         form_data = {
@@ -76,3 +139,152 @@ class PostFormsTest(TestCase):
                 image='posts/small.gif'
             ).exists()
         )
+
+    @override_settings(THUMBNAIL_ASYNC=False)
+    def test_thumbnail_is_built_on_save_and_used_by_feeds(self):
+        """Версии картинки строятся при сохранении и выводятся в ленте."""
+        uploaded = SimpleUploadedFile(
+            name='thumb.gif',
+            content=SMALL_GIF,
+            content_type='image/gif'
+        )
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Пост с картинкой', 'image': uploaded},
+        )
+        post = Post.objects.get(text='Пост с картинкой')
+        self.assertTrue(post.thumbnail.name)
+        self.assertNotEqual(post.thumbnail.name, post.image.name)
+        content = self.authorized_client.get(
+            reverse('posts:index')
+        ).content.decode()
+        self.assertIn(post.thumbnail.url, content)
+        self.assertIn(f'srcset="{post.image_srcset}"', content)
+        self.assertNotIn(post.image.url, content)
+        self.assertRegex(
+            post.thumbnail.name, r'^posts/renditions/[0-9a-f]{20}\.jpg$'
+        )
+
+    @override_settings(THUMBNAIL_ASYNC=False)
+    def test_failed_thumbnail_shows_placeholder_and_retries(self):
+        """Без версий лента выводит заглушку, а нарезка повторяется."""
+        uploaded = SimpleUploadedFile(
+            name='broken.gif',
+            content=SMALL_GIF,
+            content_type='image/gif'
+        )
+        failing = mock.patch(
+            'posts.thumbnails.render', side_effect=OSError('нет места')
+        )
+        with failing, mock.patch('posts.thumbnails._retry_later') as retry:
+            self.authorized_client.post(
+                reverse('posts:post_create'),
+                data={'text': 'Пост без версий', 'image': uploaded},
+            )
+        post = Post.objects.get(text='Пост без версий')
+        retry.assert_called_once_with(post.pk, 2)
+        content = self.authorized_client.get(
+            reverse('posts:index')
+        ).content.decode()
+        self.assertIn('Картинка обрабатывается', content)
+        self.assertNotIn(post.image.url, content)
+        self.assertTrue(thumbnails.build(post.pk))
+        post.refresh_from_db()
+        self.assertTrue(post.thumbnail.name)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ImageUploadLimitsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='uploader')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def create_post(self, uploaded):
+        return self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Пост с картинкой', 'image': uploaded},
+        )
+
+    @override_settings(IMAGE_UPLOAD_MAX_BYTES=100)
+    def test_file_over_byte_limit_is_rejected(self):
+        """Файл больше IMAGE_UPLOAD_MAX_BYTES отклоняется."""
+        response = self.create_post(SimpleUploadedFile(
+            'big.gif', SMALL_GIF + b'\0' * 200, content_type='image/gif'
+        ))
+        self.assertFormError(
+            response, 'form', 'image', 'Файл больше 0 МБ.'
+        )
+        self.assertFalse(Post.objects.exists())
+
+    def test_huge_dimensions_are_rejected_by_header(self):
+        """Картинка на 50 Мпикс отклоняется по одному заголовку."""
+        response = self.create_post(SimpleUploadedFile(
+            'huge.png', png_header(10_000, 5_000),
+            content_type='image/png',
+        ))
+        self.assertFormError(
+            response, 'form', 'image',
+            'Слишком большая картинка: не больше 40 Мпикс.'
+        )
+        self.assertFalse(Post.objects.exists())
+
+    @override_settings(IMAGE_MAX_SIDE=100)
+    def test_large_original_is_downsampled_without_exif(self):
+        """Большой оригинал уменьшается, EXIF не сохраняется."""
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x010F] = 'Camera'
+        content = BytesIO()
+        Image.new('RGB', (400, 200), 'red').save(
+            content, 'JPEG', exif=exif.tobytes()
+        )
+        self.create_post(SimpleUploadedFile(
+            'photo.jpeg', content.getvalue(), content_type='image/jpeg'
+        ))
+        post = Post.objects.get()
+        self.assertEqual(post.image.name, 'posts/photo.jpg')
+        with Image.open(post.image.path) as stored:
+            # Ориентация из EXIF применена к пикселям.
+            self.assertEqual(stored.size, (50, 100))
+            self.assertNotIn('exif', stored.info)
+
+    @override_settings(IMAGE_MAX_SIDE=100)
+    def test_png_is_saved_without_exif(self):
+        """EXIF не сохраняется и в PNG."""
+        exif = Image.Exif()
+        exif[0x010F] = 'Camera'
+        content = BytesIO()
+        Image.new('RGB', (400, 200), 'red').save(
+            content, 'PNG', exif=exif.tobytes()
+        )
+        self.create_post(SimpleUploadedFile(
+            'photo.png', content.getvalue(), content_type='image/png'
+        ))
+        with Image.open(Post.objects.get().image.path) as stored:
+            self.assertEqual(stored.size, (100, 50))
+            self.assertNotIn('exif', stored.info)
+            self.assertFalse(stored.getexif())
+
+    @skipUnless(os.path.exists('/proc/self/statm'), 'нужен procfs')
+    def test_large_upload_keeps_memory_bounded(self):
+        """Загрузка картинки 8000x5000 не декодирует ее целиком."""
+        path = os.path.join(TEMP_MEDIA_ROOT, 'large.jpg')
+        subprocess.run(
+            [sys.executable, '-c', LARGE_JPEG_SCRIPT, path], check=True
+        )
+        with open(path, 'rb') as large, RssSampler() as sampler:
+            self.create_post(large)
+        post = Post.objects.get()
+        with Image.open(post.image.path) as stored:
+            self.assertEqual(stored.size, (2560, 1600))
+        self.assertLess(sampler.peak - sampler.baseline, 128 * 1024 * 1024)
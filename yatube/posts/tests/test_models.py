@@ -1,7 +1,16 @@
+from io import StringIO
+from unittest import skipUnless
+
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Q
 from django.test import TestCase
+from django.utils import timezone
 
-from posts.models import Group, Post
+from posts.counters import author_stats
+from posts.models import AuthorStats, Comment, Follow, Group, Post
+from posts.writebehind import CommentWrite, FollowWrite, write_batch
 
 User = get_user_model()
 
@@ -34,3 +43,128 @@ class PostModelTest(TestCase):
         post = PostModelTest.post
         text_test = post.text[:POSTS_QUANTITY]
         self.assertEqual(text_test, str(post))
+
+
+class CountersTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.post = Post.objects.create(author=cls.author, text='Пост')
+
+    def test_counters_follow_writes_and_deletes(self):
+        """Счетчики меняются вместе с постами, комментариями, подписками."""
+        stats = author_stats(self.author)
+        self.assertEqual(stats.posts_count, 1)
+        Post.objects.create(author=self.author, text='Второй пост')
+        comment = Comment.objects.create(
+            post=self.post, author=self.reader, text='Комментарий'
+        )
+        Follow.objects.create(user=self.reader, author=self.author)
+        stats.refresh_from_db()
+        self.post.refresh_from_db()
+        self.assertEqual(stats.posts_count, 2)
+        self.assertEqual(stats.followers_count, 1)
+        self.assertEqual(author_stats(self.reader).following_count, 1)
+        self.assertEqual(self.post.comments_count, 1)
+        comment.delete()
+        Follow.objects.all().delete()
+        Post.objects.exclude(pk=self.post.pk).delete()
+        stats.refresh_from_db()
+        self.post.refresh_from_db()
+        self.assertEqual(stats.posts_count, 1)
+        self.assertEqual(stats.followers_count, 0)
+        self.assertEqual(self.post.comments_count, 0)
+
+    def test_recount_repairs_drift(self):
+        """Команда recount чинит разошедшиеся счетчики."""
+        author_stats(self.author)
+        AuthorStats.objects.update(posts_count=42)
+        Post.objects.update(comments_count=7)
+        call_command('recount', batch_size=1, stdout=StringIO())
+        self.assertEqual(
+            AuthorStats.objects.get(user=self.author).posts_count, 1
+        )
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 0)
+        self.assertEqual(
+            AuthorStats.objects.count(), User.objects.count()
+        )
+
+
+class WriteBatchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='batch-author')
+        cls.reader = User.objects.create_user(username='batch-reader')
+        cls.post = Post.objects.create(author=cls.author, text='Пост')
+
+    def test_batch_applies_side_effects_once(self):
+        """Пачка пишет записи и обновляет счетчики без сигналов."""
+        author_stats(self.author)
+        missing_post = self.post.pk + 100
+        results = write_batch([
+            CommentWrite(self.post.pk, self.reader.pk, 'Первый'),
+            FollowWrite(self.reader.pk, 'batch-author'),
+            CommentWrite(missing_post, self.reader.pk, 'В пустоту'),
+            CommentWrite(self.post.pk, self.author.pk, 'Второй'),
+            FollowWrite(self.reader.pk, 'batch-author'),
+            FollowWrite(self.reader.pk, 'nobody'),
+            FollowWrite(self.author.pk, 'batch-author'),
+        ])
+        self.assertEqual(results[0].text, 'Первый')
+        self.assertIsNone(results[2])
+        self.assertEqual(results[1], self.author.pk)
+        self.assertIsNone(results[5])
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 2)
+        self.assertEqual(
+            list(Follow.objects.values_list('user', 'author')),
+            [(self.reader.pk, self.author.pk)],
+        )
+        self.assertEqual(
+            AuthorStats.objects.get(user=self.author).followers_count, 1
+        )
+        self.assertEqual(
+            author_stats(User.objects.get(pk=self.reader.pk)).following_count,
+            1,
+        )
+
+
+@skipUnless(connection.vendor == 'sqlite', 'План запроса в формате SQLite')
+class FeedIndexTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author')
+        cls.group = Group.objects.create(
+            title='Группа', slug='group', description='Описание'
+        )
+
+    def assert_uses_index(self, posts, index_name):
+        plan = posts.order_by('-pub_date', '-pk')[:11].explain()
+        self.assertIn(index_name, plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_feeds_read_their_composite_index(self):
+        """Ленты читаются диапазоном индекса без сортировки."""
+        self.assert_uses_index(
+            Post.objects.filter(group=self.group), 'post_group_pub_date_idx'
+        )
+        self.assert_uses_index(
+            Post.objects.filter(author=self.author),
+            'post_author_pub_date_idx'
+        )
+        self.assert_uses_index(Post.objects.all(), 'post_pub_date_idx')
+
+    def test_cursor_condition_bounds_index_range(self):
+        """Условие курсора становится границей поиска по индексу."""
+        now = timezone.now()
+        posts = Post.objects.filter(
+            Q(pub_date__lt=now) | Q(pk__lt=100),
+            group=self.group,
+            pub_date__lte=now,
+        )
+        plan = posts.order_by('-pub_date', '-pk')[:11].explain()
+        self.assertIn(
+            'post_group_pub_date_idx (group_id=? AND pub_date<?)', plan
+        )
@@ -32,6 +32,7 @@ class PostURLTests(TestCase):
             f'/posts/{cls.post.id}/': 'posts/post_detail.html',
             f'/posts/{cls.post.id}/edit/': 'posts/create_post.html',
             '/create/': 'posts/create_post.html',
+            '/search/?q=пост': 'posts/search.html',
         }
 
     def setUp(self):
@@ -54,6 +55,7 @@ class PostURLTests(TestCase):
             '/group/test-slug/',
             '/profile/auth/',
             '/posts/1/',
+            '/search/',
         )
         for address in url_names:
             with self.subTest(address=address):
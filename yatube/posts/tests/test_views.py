@@ -1,12 +1,39 @@
+import json
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from datetime import timedelta
 from http import HTTPStatus
+from io import StringIO
+from unittest import mock
 
 from django import forms
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
-from django.test import Client, TestCase
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse, HttpResponseNotFound
+from django.test import (
+    Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from posts.models import Comment, Follow, Group, Post
+from django.utils import timezone
+from posts import search, trending, views, writebehind
+from posts.caching import (
+    LOCK_TIMEOUT, POSTS, bump_generation, cache_feed, card_key, lock_key,
+    page_key,
+)
+from posts.comments import COMMENTS_PAGE
+from posts.feed import is_popular
+from posts.models import (
+    AuthorStats, Comment, FeedEntry, Follow, Group, GroupScore, Post,
+    PostScore,
+)
+from posts.utils import COUNT_POST_PAGE, paginator_page
 
 User = get_user_model()
 
@@ -178,7 +205,7 @@ class PostViewsTest(TestCase):
         response = self.authorized_client.get(
             reverse('posts:group_list', kwargs={'slug': self.group.slug})
         )
-        self.assertIn(new_post, response.context['page_obj'])
+        self.assertNotIn(new_post, response.context['page_obj'])
 
     def test_adding_comments_is_accessible_only_for_authorized_users(self):
         """Комментировать посты могут только авторизованные пользователи."""
@@ -203,7 +230,7 @@ class PostViewsTest(TestCase):
         self.assertIn(comment, response.context['comment'])
 
     def test_index_cache(self):
-        """Шаблон страницы index хранит записи в кеше."""
+        """Шаблон страницы index хранит записи в кеше до их изменения."""
         post_cache = Post.objects.create(
             author=self.user,
             text='Тестовый пост для проверки кеша',
@@ -211,14 +238,36 @@ class PostViewsTest(TestCase):
         response = self.authorized_client.get(
             reverse('posts:index')
         )
+        with self.assertNumQueries(0):
+            cached_response = self.authorized_client.get(
+                reverse('posts:index')
+            )
+        self.assertEqual(response.content, cached_response.content)
         post_cache.delete()
         new_response = self.authorized_client.get(
             reverse('posts:index')
         )
-        self.assertEqual(response.content, new_response.content)
-        cache.clear()
-        response_cleared = self.authorized_client.get(reverse('posts:index'))
-        self.assertNotEqual(new_response.content, response_cleared.content)
+        self.assertNotEqual(response.content, new_response.content)
+        self.assertNotIn(post_cache, new_response.context['page_obj'])
+
+    def test_new_post_shows_up_in_cached_feeds_at_once(self):
+        """Новый пост сразу появляется на закешированных лентах."""
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.user}),
+        ]
+        for url in urls:
+            self.authorized_client.get(url)
+        new_post = Post.objects.create(
+            author=self.user,
+            group=self.group,
+            text='Свежий пост',
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.authorized_client.get(url)
+                self.assertIn(new_post, response.context['page_obj'])
 
     def test_follow_and_unfollow(self):
         """Авторизованный пользователь может
@@ -306,6 +355,9 @@ class PaginatorViewsTest(TestCase):
                 group=cls.group) for i in range(TEST_POST_COUNT))
         Post.objects.bulk_create(posts)
 
+    def setUp(self):
+        cache.clear()
+
     def test_pages_with_pagination_contain_ten_and_three_records(self):
         """Шаблоны страниц index, group_list, profile сформированы
         с правильным количеством записей."""
@@ -325,3 +377,870 @@ class PaginatorViewsTest(TestCase):
                     len(response.context['page_obj']),
                     Post.objects.count() - settings.POSTS_NUMBER
                 )
+
+    def test_cursor_pages_walk_forward_and_back(self):
+        """Курсорные ссылки ведут на следующую и обратно
+        на предыдущую страницу без пропусков и повторов."""
+        pages_names = [
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.user.username}),
+        ]
+        for reverse_name in pages_names:
+            with self.subTest(reverse_name=reverse_name):
+                cache.clear()
+                first_page = self.authorized_client.get(
+                    reverse_name
+                ).context['page_obj']
+                self.assertFalse(first_page.has_previous())
+                self.assertTrue(first_page.has_next())
+                second_page = self.authorized_client.get(
+                    reverse_name + first_page.paginator.next_page_url
+                ).context['page_obj']
+                self.assertEqual(
+                    len(second_page),
+                    Post.objects.count() - settings.POSTS_NUMBER
+                )
+                self.assertFalse(second_page.has_next())
+                self.assertTrue(second_page.has_previous())
+                shown = {post.pk for post in first_page}
+                shown |= {post.pk for post in second_page}
+                self.assertEqual(len(shown), Post.objects.count())
+                back_page = self.authorized_client.get(
+                    reverse_name + second_page.paginator.previous_page_url
+                ).context['page_obj']
+                self.assertEqual(
+                    [post.pk for post in back_page],
+                    [post.pk for post in first_page],
+                )
+                self.assertFalse(back_page.has_previous())
+
+    def test_broken_cursor_falls_back_to_first_page(self):
+        """Битый курсор отдает первую страницу."""
+        response = self.authorized_client.get(
+            reverse('posts:index') + '?after=not-a-cursor'
+        )
+        self.assertEqual(
+            len(response.context['page_obj']), settings.POSTS_NUMBER
+        )
+        self.assertFalse(response.context['page_obj'].has_previous())
+
+
+class FollowFeedTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='reader')
+        cls.author = User.objects.create_user(username='feed-author')
+        cls.old_post = Post.objects.create(
+            author=cls.author,
+            text='Пост до подписки',
+        )
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def feed(self):
+        response = self.client.get(reverse('posts:follow_index'))
+        return list(response.context['page_obj'])
+
+    def test_follow_backfills_and_unfollow_prunes_inbox(self):
+        """Подписка переносит посты автора в ленту, отписка убирает."""
+        self.client.get(reverse(
+            'posts:profile_follow', kwargs={'username': self.author}
+        ))
+        self.assertTrue(FeedEntry.objects.filter(
+            user=self.reader, post=self.old_post
+        ).exists())
+        new_post = Post.objects.create(author=self.author, text='Новый')
+        self.assertEqual(self.feed(), [new_post, self.old_post])
+        self.client.get(reverse(
+            'posts:profile_unfollow', kwargs={'username': self.author}
+        ))
+        self.assertFalse(FeedEntry.objects.filter(user=self.reader).exists())
+        self.assertEqual(self.feed(), [])
+
+    @override_settings(FEED_FANOUT_LIMIT=0)
+    def test_popular_author_is_merged_on_read(self):
+        """Посты популярного автора не пишутся в ленты, но видны в них."""
+        Follow.objects.create(user=self.reader, author=self.author)
+        new_post = Post.objects.create(author=self.author, text='Новый')
+        self.assertFalse(FeedEntry.objects.exists())
+        self.assertEqual(self.feed(), [new_post, self.old_post])
+
+    @override_settings(FEED_FANOUT_LIMIT=1)
+    def test_author_below_limit_gets_posts_fanned_out(self):
+        """Автор, переставший быть популярным, раскладывается по лентам."""
+        fan = User.objects.create_user(username='feed-fan')
+        AuthorStats.objects.filter(user=self.author).delete()
+        with self.assertNumQueries(1):
+            self.assertFalse(is_popular(self.author))
+        self.assertFalse(AuthorStats.objects.filter(user=self.author).exists())
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(self.author.stats.followers_count, 1)
+        Follow.objects.create(user=fan, author=self.author)
+        self.assertTrue(is_popular(self.author))
+        new_post = Post.objects.create(author=self.author, text='Новый')
+        self.assertFalse(FeedEntry.objects.filter(post=new_post).exists())
+        Follow.objects.filter(user=fan).delete()
+        self.assertFalse(is_popular(self.author))
+        self.assertEqual(self.feed(), [new_post, self.old_post])
+
+    @override_settings(FEED_FANOUT_LIMIT=1)
+    def test_inbox_and_popular_author_are_paged_together(self):
+        """Курсор листает входящую ленту и популярного автора вместе."""
+        star = User.objects.create_user(username='feed-star')
+        fan = User.objects.create_user(username='feed-fan')
+        Follow.objects.create(user=self.reader, author=self.author)
+        Follow.objects.create(user=self.reader, author=star)
+        Follow.objects.create(user=fan, author=star)
+        posts = [
+            Post.objects.create(author=author, text=f'Пост {i}')
+            for i in range(COUNT_POST_PAGE)
+            for author in (self.author, star)
+        ]
+        self.assertFalse(FeedEntry.objects.filter(author=star).exists())
+        expected = sorted(
+            posts + [self.old_post],
+            key=lambda post: (post.pub_date, post.pk),
+            reverse=True,
+        )
+        first = self.client.get(reverse('posts:follow_index'))
+        paginator = first.context['page_obj'].paginator
+        second = self.client.get(
+            reverse('posts:follow_index') + paginator.next_page_url
+        )
+        self.assertEqual(
+            list(first.context['page_obj'])
+            + list(second.context['page_obj']),
+            expected[:2 * COUNT_POST_PAGE],
+        )
+
+    def test_rebuild_feeds_command_restores_inboxes(self):
+        """Команда rebuild_feeds собирает ленты заново."""
+        Follow.objects.create(user=self.reader, author=self.author)
+        FeedEntry.objects.all().delete()
+        call_command('rebuild_feeds', stdout=StringIO())
+        self.assertEqual(self.feed(), [self.old_post])
+
+
+class SearchViewTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(
+            username='writer', first_name='Лев', last_name='Толстой'
+        )
+        cls.group = Group.objects.create(
+            title='Кошки',
+            slug='cats',
+            description='Все о домашних кошках',
+        )
+        cls.text_post = Post.objects.create(
+            author=cls.author,
+            text='Наши котики любят спать на солнце',
+        )
+        cls.comment_post = Post.objects.create(
+            author=cls.author,
+            text='Фото дня',
+        )
+        Comment.objects.create(
+            post=cls.comment_post,
+            author=cls.author,
+            text='Какой пушистый котик!',
+        )
+
+    def found(self, query, **params):
+        response = self.client.get(
+            reverse('posts:search'), {'q': query, **params}
+        )
+        return response, list(response.context['posts'])
+
+    def test_search_uses_stems_and_ranks_post_text_first(self):
+        """Словоформы находят друг друга, совпадение в тексте выше."""
+        _, posts = self.found('котиков')
+        self.assertEqual(posts, [self.text_post, self.comment_post])
+
+    def test_search_covers_group_and_author(self):
+        """Поиск идет по группе и по имени автора."""
+        post = Post.objects.create(
+            author=self.author, text='Без слов', group=self.group
+        )
+        self.assertEqual(self.found('домашние кошки')[1], [post])
+        self.assertEqual(len(self.found('Толстого')[1]), 3)
+
+    def test_index_follows_edits_and_deletes(self):
+        """Сигналы обновляют индекс при правке и удалении."""
+        post = Post.objects.get(pk=self.text_post.pk)
+        post.text = 'Собаки тоже любят солнце'
+        post.save()
+        self.assertEqual(self.found('собака')[1], [post])
+        self.assertEqual(self.found('котики')[1], [self.comment_post])
+        Post.objects.filter(pk=self.comment_post.pk).delete()
+        self.assertEqual(self.found('котики')[1], [])
+        author = User.objects.get(pk=self.author.pk)
+        author.first_name = 'Алексей'
+        author.save()
+        self.assertEqual(self.found('Алексей')[1], [post])
+
+    def test_author_is_reindexed_only_when_name_changes(self):
+        """Сохранение автора без смены имени не трогает индекс."""
+        author = User.objects.get(pk=self.author.pk)
+        with mock.patch('posts.search.reindex_author') as reindex:
+            author.email = 'writer@example.com'
+            author.save()
+            reindex.assert_not_called()
+            author.last_name = 'Тургенев'
+            author.save()
+        reindex.assert_called_once_with(author.pk)
+
+    def test_comment_is_indexed_alone(self):
+        """Новый комментарий индексируется без остальных комментариев."""
+        with mock.patch('posts.search._stems', wraps=search._stems) as stems:
+            comment = Comment.objects.create(
+                post=self.comment_post, author=self.author, text='Рыжий хвост'
+            )
+        stems.assert_called_once_with('Рыжий хвост')
+        self.assertEqual(self.found('хвост')[1], [self.comment_post])
+        self.assertEqual(self.found('пушистый')[1], [self.comment_post])
+        comment.delete()
+        self.assertEqual(self.found('хвост')[1], [])
+
+    def test_results_are_paged_by_cursor(self):
+        """Выдача листается курсором без повторов и пропусков."""
+        Post.objects.bulk_create(
+            Post(author=self.author, text=f'Котик номер {number}')
+            for number in range(settings.POSTS_NUMBER + 3)
+        )
+        call_command('rebuild_search_index', stdout=StringIO())
+        response, first = self.found('котик')
+        self.assertEqual(len(first), settings.POSTS_NUMBER)
+        _, second = self.found(
+            'котик', after=response.context['next_cursor']
+        )
+        self.assertEqual(len(second), 5)
+        self.assertFalse(set(first) & set(second))
+
+
+class BenchmarkCommandsTest(TestCase):
+    def test_seed_and_bench_write_comparable_report(self):
+        """seed_benchmark заполняет базу, bench_views пишет JSON-отчет."""
+        call_command(
+            'seed_benchmark', users=30, groups=3, posts=80, comments=120,
+            follows=60, stdout=StringIO(),
+        )
+        self.assertEqual(Post.objects.count(), 80)
+        self.assertEqual(Comment.objects.count(), 120)
+        self.assertEqual(
+            sum(Post.objects.values_list('comments_count', flat=True)), 120
+        )
+        with tempfile.NamedTemporaryFile('r', suffix='.json') as report:
+            call_command(
+                'bench_views', requests=3, warmup=0, output=report.name,
+                stdout=StringIO(),
+            )
+            views = json.load(report)['views']
+        self.assertEqual(set(views), {
+            'index', 'group_posts', 'profile', 'post_detail',
+            'follow_index', 'add_comment',
+        })
+        for name, result in views.items():
+            with self.subTest(view=name):
+                self.assertEqual(result['errors'], 0)
+                self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+
+
+class FeedQueryBudgetTest(TestCase):
+    """Число запросов страниц ленты не зависит от числа постов на ней."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.authors = [
+            User.objects.create_user(
+                username=f'budget-author-{i}',
+                first_name='Имя',
+                last_name=f'Фамилия {i}',
+            )
+            for i in range(TEST_POST_COUNT + 2)
+        ]
+        cls.reader = cls.authors[0]
+        for i, author in enumerate(cls.authors):
+            group = Group.objects.create(
+                title=f'Группа {i}',
+                slug=f'budget-group-{i}',
+                description='Описание',
+            )
+            post = Post.objects.create(
+                author=author, group=group, text=f'Пост {i}'
+            )
+            Comment.objects.create(post=post, author=author, text='Ок')
+            if author != cls.reader:
+                Follow.objects.create(user=cls.reader, author=author)
+        cls.post = post
+        # В бюджет лент входит запрос валидаторов условного GET.
+        cls.budgets = {
+            reverse('posts:index'): 4,
+            reverse(
+                'posts:group_list', kwargs={'slug': 'budget-group-1'}
+            ): 5,
+            reverse(
+                'posts:profile', kwargs={'username': cls.authors[1]}
+            ): 5,
+            reverse(
+                'posts:post_detail', kwargs={'post_id': cls.post.pk}
+            ): 5,
+            reverse('posts:follow_index'): 4,
+        }
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def test_feed_pages_stay_within_query_budget(self):
+        """Страницы лент укладываются в бюджет запросов."""
+        for url, budget in self.budgets.items():
+            with self.subTest(url=url):
+                self.client.get(url)
+                cache.clear()
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+                self.assertLessEqual(
+                    len(queries), budget,
+                    '\n'.join(query['sql'] for query in queries)
+                )
+
+
+class PostCardCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='card-author')
+        cls.group = Group.objects.create(
+            title='Группа карточек',
+            slug='cards',
+            description='Описание',
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.post = Post.objects.create(
+            author=self.author, group=self.group, text='Исходный текст'
+        )
+        self.client = Client()
+
+    def group_page(self):
+        return self.client.get(
+            reverse('posts:group_list', kwargs={'slug': self.group.slug})
+        ).content.decode()
+
+    def test_card_is_reused_between_feeds(self):
+        """Отрендеренная карточка берется из кеша на другой ленте."""
+        self.group_page()
+        self.assertIsNotNone(cache.get(card_key(self.post)))
+        Post.objects.filter(pk=self.post.pk).update(text='Тихая правка')
+        content = self.client.get(reverse(
+            'posts:profile', kwargs={'username': self.author}
+        )).content.decode()
+        self.assertIn('Исходный текст', content)
+
+    def test_card_follows_post_group_and_comment_changes(self):
+        """Правка поста, группы или комментарии обновляют карточку."""
+        self.group_page()
+        self.post.text = 'Новый текст'
+        self.post.save()
+        self.assertIn('Новый текст', self.group_page())
+        self.group.title = 'Переименованная группа'
+        self.group.save()
+        self.post.refresh_from_db()
+        self.assertIsNone(cache.get(card_key(self.post)))
+        Comment.objects.create(
+            post=self.post, author=self.author, text='Комментарий'
+        )
+        self.assertIn('Комментариев: 1', self.group_page())
+
+    def test_card_follows_author_rename(self):
+        """Смена имени автора обновляет карточки его постов."""
+        self.group_page()
+        author = User.objects.get(pk=self.author.pk)
+        author.first_name = 'Анна'
+        author.last_name = 'Ахматова'
+        author.save()
+        self.assertIn('Автор: Анна Ахматова', self.group_page())
+
+
+class ConditionalGetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='etag-author')
+        cls.reader = User.objects.create_user(username='etag-reader')
+
+    def setUp(self):
+        cache.clear()
+        self.post = Post.objects.create(author=self.author, text='Пост')
+        self.client = Client()
+
+    def revalidate(self, url, etag):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        return response, len(queries)
+
+    def test_unchanged_feed_is_not_modified(self):
+        """Неизменившаяся лента отдает 304 после одного запроса к базе."""
+        url = reverse('posts:index')
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('W/"'))
+        self.assertTrue(response.has_header('Last-Modified'))
+        response, queries = self.revalidate(url, etag)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        self.assertEqual(queries, 0)
+        cache.clear()
+        response, queries = self.revalidate(url, etag)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        self.assertEqual(queries, 1)
+        self.post.text = 'Правка'
+        self.post.save()
+        response, _ = self.revalidate(url, etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_profile_validator_follows_subscription(self):
+        """ETag профиля меняется вместе с подпиской на автора."""
+        self.client.force_login(self.reader)
+        url = reverse('posts:profile', kwargs={'username': self.author})
+        etag = self.client.get(url)['ETag']
+        Follow.objects.create(user=self.reader, author=self.author)
+        response, _ = self.revalidate(url, etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_post_detail_validator_follows_comments(self):
+        """ETag страницы поста меняется с новым комментарием."""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        # Первый показ создает счетчики автора, они входят в ETag.
+        self.client.get(url)
+        etag = self.client.get(url)['ETag']
+        response, _ = self.revalidate(url, etag)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        Comment.objects.create(
+            post=self.post, author=self.reader, text='Комментарий'
+        )
+        response, _ = self.revalidate(url, etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+
+class ProfileLoaderTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='loaded-author')
+        cls.reader = User.objects.create_user(username='loaded-reader')
+        for i in range(3):
+            Post.objects.create(author=cls.author, text=f'Пост {i}')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        cls.url = reverse('posts:profile', kwargs={'username': cls.author})
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.reader)
+        # Первый показ создает счетчики автора.
+        self.client.get(self.url)
+        cache.clear()
+
+    def test_author_counters_and_follow_come_in_one_query(self):
+        """Автор, счетчики и подписка читаются одним запросом."""
+        # Сессия, пользователь, ETag, автор и страница постов.
+        with self.assertNumQueries(5):
+            response = self.client.get(self.url)
+        context = response.context
+        self.assertEqual(context['author'], self.author)
+        self.assertEqual(context['user_profile'], self.author)
+        self.assertTrue(context['following'])
+        self.assertEqual(context['author_stats'].posts_count, 3)
+        self.assertEqual(context['author_stats'].followers_count, 1)
+        self.assertEqual(len(context['page_obj']), 3)
+
+    def test_anonymous_reader_does_not_follow(self):
+        self.client.logout()
+        response = self.client.get(self.url)
+        self.assertFalse(response.context['following'])
+        response = self.client.get(
+            reverse('posts:profile', kwargs={'username': 'nobody'})
+        )
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+
+class ParallelProfileTest(TransactionTestCase):
+    # Страница постов читается в потоке пула со своим соединением:
+    # данные теста должны быть закоммичены.
+
+    @override_settings(PARALLEL_QUERIES=True)
+    def test_profile_loads_page_concurrently(self):
+        """При PARALLEL_QUERIES профиль собирается из двух потоков."""
+        cache.clear()
+        author = User.objects.create_user(username='parallel-author')
+        Post.objects.create(author=author, text='Пост из пула')
+        url = reverse('posts:profile', kwargs={'username': author})
+        threads = []
+
+        def paged(request, posts):
+            threads.append(threading.current_thread().name)
+            return paginator_page(request, posts)
+
+        with mock.patch('posts.profiles.paginator_page', paged):
+            response = self.client.get(url)
+        self.assertContains(response, 'Пост из пула')
+        self.assertFalse(response.context['following'])
+        self.assertEqual(len(threads), 1)
+        self.assertTrue(threads[0].startswith('db-pool'))
+
+
+class CommentPagingTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='comment-author')
+        cls.post = Post.objects.create(author=cls.author, text='Вирусный')
+        Comment.objects.bulk_create(
+            Comment(post=cls.post, author=cls.author, text=f'Комментарий {i}')
+            for i in range(COMMENTS_PAGE + 5)
+        )
+        cls.texts = list(Comment.objects.order_by('pk').values_list(
+            'text', flat=True
+        ))
+
+    def test_post_detail_shows_first_page(self):
+        """Страница поста выводит одну страницу комментариев."""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        # Первый показ создает счетчики автора.
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(len(queries), 3)
+        comments = response.context['comments']
+        self.assertEqual(
+            [comment.text for comment in comments],
+            self.texts[::-1][:COMMENTS_PAGE],
+        )
+        self.assertContains(response, 'Показать еще')
+        response = self.client.get(url, {'order': 'oldest'})
+        self.assertEqual(
+            response.context['comments'][0].text, self.texts[0]
+        )
+
+    def test_load_more_returns_fragment_and_json(self):
+        """Кнопка «Показать еще» получает остаток фрагментом или JSON."""
+        cursor = self.client.get(reverse(
+            'posts:post_detail', kwargs={'post_id': self.post.pk}
+        )).context['next_cursor']
+        url = reverse('posts:post_comments', kwargs={'post_id': self.post.pk})
+        response = self.client.get(url, {'after': cursor})
+        self.assertTemplateUsed(response, 'posts/includes/comment_list.html')
+        self.assertEqual(
+            [comment.text for comment in response.context['comments']],
+            self.texts[::-1][COMMENTS_PAGE:],
+        )
+        self.assertNotContains(response, 'Показать еще')
+        data = self.client.get(
+            url, {'order': 'oldest', 'format': 'json'}
+        ).json()
+        self.assertEqual(len(data['results']), COMMENTS_PAGE)
+        self.assertEqual(data['results'][0]['author'], 'comment-author')
+        data = self.client.get(url, {
+            'order': 'oldest', 'format': 'json', 'after': data['next'],
+        }).json()
+        self.assertEqual(
+            [comment['text'] for comment in data['results']],
+            self.texts[COMMENTS_PAGE:],
+        )
+        self.assertIsNone(data['next'])
+
+
+class WriteBehindViewsTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='burst-author')
+        self.post = Post.objects.create(author=self.author, text='Трансляция')
+        self.readers = [
+            User.objects.create_user(username=f'burst-reader-{i}')
+            for i in range(4)
+        ]
+
+    @override_settings(WRITE_BEHIND=True)
+    def test_concurrent_writes_are_batched_and_visible(self):
+        """Пакетные комментарии и подписки сразу видны их автору."""
+        # Общая in-memory база тестов блокирует таблицы без ожидания,
+        # поэтому параллельно в нее пишет только очередь.
+        def write(reader):
+            for i in range(5):
+                writebehind.add_comment(
+                    self.post.pk, reader.pk, f'Комментарий {i}'
+                )
+            results.append(writebehind.follow(reader.pk, 'burst-author'))
+
+        results = []
+        threads = [
+            threading.Thread(target=write, args=(reader,))
+            for reader in self.readers[1:]
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [self.author.pk] * len(threads))
+        client = Client()
+        client.force_login(self.readers[0])
+        client.post(
+            reverse('posts:add_comment', args=[self.post.pk]),
+            {'text': 'Комментарий через вьюху'},
+        )
+        client.get(reverse('posts:profile_follow', args=['burst-author']))
+        response = client.get(
+            reverse('posts:post_detail', args=[self.post.pk])
+        )
+        self.assertContains(response, 'Комментарий через вьюху')
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 16)
+        # Комментарии из bulk_create попали в индекс под своими id.
+        comments = Comment.objects.filter(post=self.post).order_by('pk')
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT rowid, text FROM posts_search_comments '
+                'WHERE post_id = %s ORDER BY rowid',
+                [self.post.pk],
+            )
+            indexed = cursor.fetchall()
+        self.assertEqual(indexed, [
+            (comment.pk, search._stems(comment.text)) for comment in comments
+        ])
+        self.assertEqual(
+            Follow.objects.filter(author=self.author).count(),
+            len(self.readers),
+        )
+        response = client.post(
+            reverse('posts:add_comment', args=[self.post.pk + 1]),
+            {'text': 'К удаленному посту'},
+        )
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    @override_settings(WRITE_BEHIND=True, WRITE_BEHIND_TIMEOUT=0.01)
+    def test_slow_batch_redirects_with_message(self):
+        """Незаписанная вовремя пачка — редирект с сообщением, не 500."""
+        client = Client()
+        client.force_login(self.readers[0])
+        pending = mock.patch.object(
+            writebehind.WriteBehindQueue, 'submit',
+            return_value=Future(),
+        )
+        with pending:
+            response = client.post(
+                reverse('posts:add_comment', args=[self.post.pk]),
+                {'text': 'Медленный комментарий'},
+                follow=True,
+            )
+            self.assertRedirects(
+                response, reverse('posts:post_detail', args=[self.post.pk])
+            )
+            self.assertContains(response, views.WRITE_PENDING)
+            response = client.get(
+                reverse('posts:profile_follow', args=['burst-author'])
+            )
+        self.assertRedirects(
+            response, reverse('posts:profile', args=['burst-author'])
+        )
+
+
+class SingleFlightCacheTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = []
+        self.request = RequestFactory().get('/single-flight/')
+
+        @cache_feed(POSTS)
+        def slow_view(request):
+            self.calls.append(1)
+            time.sleep(0.05)
+            return HttpResponse(f'render {len(self.calls)}')
+
+        self.view = slow_view
+
+    def test_concurrent_misses_render_once(self):
+        """Одновременные промахи рендерят страницу один раз."""
+        responses = []
+        threads = [
+            threading.Thread(
+                target=lambda: responses.append(self.view(self.request))
+            )
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(
+            {response.content for response in responses}, {b'render 1'}
+        )
+
+    def test_stale_page_is_served_while_another_request_renders(self):
+        """Пока страницу пересчитывают, отдается прошлая версия."""
+        self.view(self.request)
+        bump_generation(POSTS)
+        cache.add(lock_key(page_key(self.request)), 1)
+        self.assertEqual(self.view(self.request).content, b'render 1')
+        cache.delete(lock_key(page_key(self.request)))
+        self.assertEqual(self.view(self.request).content, b'render 2')
+
+    def test_uncached_response_releases_waiters(self):
+        """Ответ, не попавший в кеш, не держит ожидающих до LOCK_TIMEOUT."""
+        @cache_feed(POSTS)
+        def missing(request):
+            self.calls.append(1)
+            time.sleep(0.05)
+            return HttpResponseNotFound()
+
+        responses = []
+        threads = [
+            threading.Thread(
+                target=lambda: responses.append(missing(self.request))
+            )
+            for _ in range(4)
+        ]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertLess(time.monotonic() - started, LOCK_TIMEOUT / 2)
+        self.assertEqual(
+            [response.status_code for response in responses],
+            [HTTPStatus.NOT_FOUND] * 4,
+        )
+
+
+class FeedCacheTtlTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='ttl-author')
+        Post.objects.create(author=cls.author, text='Первый пост')
+
+    def setUp(self):
+        cache.clear()
+
+    def get_index(self, now=None, chance=0.5):
+        with mock.patch('posts.caching.random.random', return_value=chance):
+            if now is None:
+                return self.client.get(reverse('posts:index'))
+            with mock.patch('posts.caching.time.time', return_value=now):
+                return self.client.get(reverse('posts:index'))
+
+    @override_settings(CACHE_TTL=120)
+    def test_index_page_expires_and_is_refreshed_early(self):
+        """Страница ленты живет CACHE_TTL и пересчитывается до срока."""
+        started = time.time()
+        response = self.get_index()
+        entry = cache.get(page_key(response.wsgi_request))
+        self.assertAlmostEqual(entry['expires'], started + 120, delta=5)
+        # Пост без сигналов не сдвигает поколение: виден только после
+        # пересчета страницы.
+        Post.objects.bulk_create([Post(author=self.author, text='Тихий')])
+        self.assertNotContains(self.get_index(chance=0.0), 'Тихий')
+        almost = entry['expires'] - entry['delta'] * 0.1
+        self.assertNotContains(self.get_index(almost, chance=0.0), 'Тихий')
+        self.assertContains(self.get_index(almost), 'Тихий')
+
+
+class TrendingTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='trending-author')
+        cls.reader = User.objects.create_user(username='trending-reader')
+        cls.groups = [
+            Group.objects.create(
+                title=f'Группа {i}', slug=f'trending-{i}', description='-'
+            )
+            for i in range(2)
+        ]
+        cls.quiet, cls.busy, cls.followed = [
+            Post.objects.create(
+                author=cls.author, group=group, text=f'Пост {i}'
+            )
+            for i, group in enumerate([None, *cls.groups])
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.reader)
+
+    def comment(self, post):
+        return Comment.objects.create(
+            post=post, author=self.reader, text='Комментарий'
+        )
+
+    def scores(self, model):
+        return dict(model.objects.values_list('pk', 'score'))
+
+    def test_comments_and_follows_rank_posts_and_groups(self):
+        """Подписка засчитывается последнему посту автора."""
+        self.comment(self.busy)
+        self.comment(self.busy)
+        self.comment(self.quiet)
+        Follow.objects.create(user=self.reader, author=self.author)
+        url = reverse('posts:trending')
+        with self.assertNumQueries(5):
+            response = self.client.get(url)
+        self.assertEqual(
+            list(response.context['page_obj']),
+            [self.followed, self.busy, self.quiet],
+        )
+        self.assertEqual(response.context['groups'], self.groups[::-1])
+        # Рейтинги уже в кеше: читаются только посты страницы.
+        with self.assertNumQueries(3):
+            self.client.get(url)
+
+    def test_old_activity_decays(self):
+        now = timezone.now()
+        half_life = timedelta(seconds=settings.TRENDING_HALF_LIFE)
+        trending.add_activity(self.busy.pk, None, 3, now - 2 * half_life)
+        trending.add_activity(self.quiet.pk, None, 1, now)
+        self.assertEqual(
+            trending._ranked_post_ids(), [self.quiet.pk, self.busy.pk]
+        )
+        trending.add_activity(
+            self.followed.pk, None, 1, now - 11 * half_life
+        )
+        self.assertNotIn(self.followed.pk, trending._ranked_post_ids())
+
+    def test_post_delete_skips_per_comment_work(self):
+        """Удаление поста не тратит запросы на каждый его комментарий."""
+        def delete_post(comments):
+            post = Post.objects.create(
+                author=self.author, group=self.groups[0], text='Временный'
+            )
+            for _ in range(comments):
+                self.comment(post)
+            with CaptureQueriesContext(connection) as queries:
+                post.delete()
+            return len(queries)
+
+        self.comment(self.busy)
+        group_score = self.scores(GroupScore)[self.groups[0].pk]
+        self.assertEqual(delete_post(1), delete_post(6))
+        self.assertAlmostEqual(
+            self.scores(GroupScore)[self.groups[0].pk], group_score, places=6
+        )
+        self.assertFalse(Comment.objects.filter(post__text='Временный'))
+
+    def test_recompute_matches_incremental_scores(self):
+        comments = [self.comment(self.busy) for _ in range(3)]
+        self.comment(self.followed)
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        comments[0].delete()
+        follow.delete()
+        Follow.objects.create(user=self.reader, author=self.author)
+        incremental = self.scores(PostScore), self.scores(GroupScore)
+        call_command('recompute_trending', stdout=StringIO())
+        for scores, expected in zip(
+            (self.scores(PostScore), self.scores(GroupScore)), incremental
+        ):
+            self.assertEqual(scores.keys(), expected.keys())
+            for pk, score in scores.items():
+                self.assertAlmostEqual(score, expected[pk], places=6)
@@ -0,0 +1,179 @@
+"""Фоновая подготовка адаптивных версий картинок постов.
+
+Раньше {% thumbnail %} в шаблонах лент декодировал и уменьшал
+оригинал прямо во время запроса. Теперь после коммита поста пул
+потоков нарезает картинку под карточку (960x339, кадрирование по
+центру) в нескольких ширинах и форматах: AVIF и WebP, если их
+поддерживает сборка Pillow, и JPEG всегда. Шаблоны выводят готовый
+<picture> со srcset, браузер сам выбирает размер и формат.
+
+Пока версий нет (нарезка в очереди или не удалась), шаблоны выводят
+заглушку размера карточки, а не оригинал. Неудачная нарезка
+повторяется до THUMBNAIL_ATTEMPTS раз с растущей паузой; что не
+удалось и тогда, достраивает команда build_thumbnails.
+
+Имена файлов — хеш содержимого, поэтому их можно отдавать с
+бессрочным Cache-Control: immutable.
+"""
+import hashlib
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from core.db import replicas
+
+from . import caching
+from .models import Post
+
+CARD_SIZE = (960, 339)
+
+WIDTHS = (480, 720, 960)
+
+RENDITIONS_DIR = 'posts/renditions'
+
+# (MIME-тип, формат Pillow, расширение, параметры сохранения)
+# в порядке предпочтения браузером.
+FORMATS = (
+    ('image/avif', 'AVIF', 'avif', {'quality': 50}),
+    ('image/webp', 'WEBP', 'webp', {'quality': 75, 'method': 4}),
+    ('image/jpeg', 'JPEG', 'jpg', {
+        'quality': 80, 'optimize': True, 'progressive': True,
+    }),
+)
+
+FALLBACK_TYPE = 'image/jpeg'
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def _pool():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.THUMBNAIL_WORKERS,
+            thread_name_prefix='thumbnails',
+        )
+    return _executor
+
+
+def supported_formats():
+    """Форматы из FORMATS, которые умеет сохранять установленный Pillow."""
+    Image.init()
+    return [fmt for fmt in FORMATS if fmt[1] in Image.SAVE]
+
+
+def card_widths(original_width):
+    """Ширины версий без увеличения картинки сверх оригинала."""
+    widths = [width for width in WIDTHS if width <= original_width]
+    return widths or [original_width]
+
+
+def _save(data, extension):
+    digest = hashlib.sha1(data).hexdigest()[:20]
+    name = f'{RENDITIONS_DIR}/{digest}.{extension}'
+    if not default_storage.exists(name):
+        name = default_storage.save(name, ContentFile(data))
+    return name
+
+
+def encode(image):
+    """Кодирует версии открытой картинки под карточку.
+
+    Возвращает список (MIME-тип, ширина, расширение, байты) по
+    возрастанию ширины.
+    """
+    image = ImageOps.exif_transpose(image).convert('RGB')
+    encoded = []
+    for width in card_widths(image.width):
+        height = max(round(width * CARD_SIZE[1] / CARD_SIZE[0]), 1)
+        resized = ImageOps.fit(image, (width, height), Image.LANCZOS)
+        for mime, pillow_format, extension, options in supported_formats():
+            buffer = BytesIO()
+            resized.save(buffer, pillow_format, **options)
+            encoded.append((mime, width, extension, buffer.getvalue()))
+    return encoded
+
+
+def render(image):
+    """Сохраняет версии картинки, возвращает их манифест.
+
+    Манифест: {MIME-тип: [[ширина, имя файла], ...]} по возрастанию
+    ширины.
+    """
+    manifest = {}
+    for mime, width, extension, data in encode(image):
+        manifest.setdefault(mime, []).append([width, _save(data, extension)])
+    return manifest
+
+
+def build(post_id):
+    """Строит версии картинки поста и сохраняет их в Post.
+
+    Возвращает False, если построить не удалось.
+    """
+    close_old_connections()
+    try:
+        with replicas.primary():
+            post = Post.objects.only('image').get(pk=post_id)
+        if not post.image:
+            return True
+        with post.image.open('rb') as original:
+            manifest = render(Image.open(original))
+        # Картинку могли заменить, пока строились версии.
+        updated = Post.objects.filter(
+            pk=post_id, image=post.image.name
+        ).update(
+            thumbnail=manifest[FALLBACK_TYPE][-1][1],
+            renditions=json.dumps(manifest),
+            updated=timezone.now(),
+        )
+        if updated:
+            caching.bump_generation(caching.POSTS)
+    except Exception:
+        logger.exception('Не удалось построить версии картинки %s', post_id)
+        return False
+    finally:
+        close_old_connections()
+    return True
+
+
+def _retry_later(post_id, attempt):
+    timer = threading.Timer(
+        settings.THUMBNAIL_RETRY_DELAY * (attempt - 1),
+        lambda: _pool().submit(_build_with_retries, post_id, attempt),
+    )
+    timer.daemon = True
+    timer.start()
+
+
+def _build_with_retries(post_id, attempt=1):
+    if build(post_id):
+        return
+    if attempt < settings.THUMBNAIL_ATTEMPTS:
+        _retry_later(post_id, attempt + 1)
+    else:
+        logger.error(
+            'Версии картинки %s не построены за %s попыток',
+            post_id, attempt,
+        )
+
+
+def schedule(post):
+    """Ставит нарезку картинки в очередь после коммита поста."""
+    if not settings.THUMBNAIL_ASYNC:
+        _build_with_retries(post.pk)
+        return
+    transaction.on_commit(
+        lambda: _pool().submit(_build_with_retries, post.pk)
+    )
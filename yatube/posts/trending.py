@@ -0,0 +1,278 @@
+"""Лента «В тренде» и популярные группы.
+
+Рейтинг — активность с затуханием: комментарий к посту и подписка на
+автора прибавляют посту вес, который вдвое уменьшается каждые
+TRENDING_HALF_LIFE секунд. Подписка засчитывается последнему посту
+автора на момент подписки: скорее всего, подписчик пришел с него.
+Группа получает вес всех событий своих постов.
+
+Оценки лежат в PostScore и GroupScore и обновляются сигналами в той же
+транзакции, что и запись. Затухание хранится «вперед» (forward decay):
+событие в момент t весит 2 ** (t / TRENDING_HALF_LIFE) от общей точки
+отсчета EPOCH. Все оценки в каждый момент затухают одинаково, поэтому
+порядок сумм совпадает с порядком затухших оценок, и пересчитывать
+строки со временем не нужно. В базе хранится log2 суммы: он растет
+линейно и не переполняется. Вес прибавляется одним INSERT ... ON
+CONFLICT DO UPDATE (SQLite 3.24+, PostgreSQL).
+
+Страница /trending/ берет из кеша id лучших TRENDING_LIMIT постов и
+группы, пересчитанные не раньше чем через TRENDING_CACHE_SECONDS, и
+читает из базы только посты своей страницы. Команда recompute_trending
+пересчитывает оценки с нуля.
+"""
+import math
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connection, transaction
+from django.db.models import F, OuterRef, Subquery, Value
+from django.db.models.functions import Greatest, Ln, Power
+from django.utils import timezone
+
+from .counters import _batches
+from .models import Comment, Follow, GroupScore, Post, PostScore
+from .utils import COUNT_POST_PAGE
+
+EPOCH = datetime(2022, 1, 1, tzinfo=timezone.utc)
+
+COMMENT_WEIGHT: float = 1.0
+
+FOLLOW_WEIGHT: float = 3.0
+
+# События старше HORIZON периодов полураспада весят меньше 1/1000,
+# посты и группы только с такими событиями в рейтинг не попадают.
+HORIZON: int = 10
+
+# Во сколько раз (log2) уменьшается оценка, от которой вычли весь вес.
+REMOVED: int = 64
+
+BATCH_SIZE: int = 500
+
+POSTS_KEY = 'trending.posts'
+
+GROUPS_KEY = 'trending.groups'
+
+
+def position(when):
+    """log2 веса события в момент when относительно EPOCH."""
+    return (when - EPOCH).total_seconds() / settings.TRENDING_HALF_LIFE
+
+
+def _plus(a, b):
+    """log2(2 ** a + 2 ** b)."""
+    return max(a, b) + math.log2(1 + 2 ** -abs(a - b))
+
+
+def _upsert_sql(model):
+    """INSERT строки или прибавление веса к ней, одним запросом.
+
+    Тот же log2(2 ** a + 2 ** b), что и _plus, но в SQL: строку не
+    нужно читать и блокировать, конкурентные записи не теряются.
+    """
+    table = connection.ops.quote_name(model._meta.db_table)
+    key = connection.ops.quote_name(model._meta.pk.column)
+    greatest = 'MAX' if connection.vendor == 'sqlite' else 'GREATEST'
+    return (
+        f'INSERT INTO {table} ({key}, score) VALUES (%s, %s) '
+        f'ON CONFLICT ({key}) DO UPDATE SET score = '
+        f'{greatest}({table}.score, excluded.score) + LN(1 + POWER(2, '
+        f'-ABS({table}.score - excluded.score))) / LN(2)'
+    )
+
+
+def _change(model, key, value, remove=False):
+    if not remove:
+        with connection.cursor() as cursor:
+            cursor.execute(_upsert_sql(model), [key, value])
+        return
+    # log2(2 ** score - 2 ** value). Если вычитается почти все, от
+    # оценки остается 2 ** -REMOVED доля: строка уходит за горизонт
+    # рейтинга, а логарифм не упирается в минус бесконечность.
+    model.objects.filter(pk=key).update(
+        score=F('score') + Ln(Greatest(
+            Value(1.0) - Power(Value(2.0), Value(value) - F('score')),
+            Value(2.0 ** -REMOVED),
+        )) / Value(math.log(2))
+    )
+
+
+def _weight(weight, when):
+    return position(when) + math.log2(weight)
+
+
+def _apply(post_id, group_id, value, remove=False):
+    _change(PostScore, post_id, value, remove)
+    if group_id is not None:
+        _change(GroupScore, group_id, value, remove)
+
+
+def add_activity(post_id, group_id, weight, when, remove=False):
+    """Прибавляет посту и его группе вес weight события в момент when.
+
+    При remove=True вес ранее учтенного события вычитается.
+    """
+    _apply(post_id, group_id, _weight(weight, when), remove)
+
+
+def comment_activity(comment, remove=False):
+    add_activity(
+        comment.post_id, comment.post.group_id, COMMENT_WEIGHT,
+        comment.created, remove,
+    )
+
+
+def post_removed(post):
+    """Вычитает из группы весь вес удаляемого поста.
+
+    В оценке поста уже сложены все его события (комментарии и
+    подписки), поэтому их не нужно вычитать по одному.
+    """
+    if post.group_id is None:
+        return
+    score = PostScore.objects.filter(post_id=post.pk).values_list(
+        'score', flat=True
+    ).first()
+    if score is not None:
+        _change(GroupScore, post.group_id, score, remove=True)
+
+
+def _credited_post(author_id, when):
+    """(id, id группы) последнего поста автора к моменту when."""
+    return Post.objects.filter(
+        author_id=author_id, pub_date__lte=when
+    ).order_by('-pub_date', '-pk').values_list('pk', 'group_id').first()
+
+
+def follow_activity(follow, remove=False):
+    if follow.created is None:
+        return
+    credited = _credited_post(follow.author_id, follow.created)
+    if credited is not None:
+        add_activity(*credited, FOLLOW_WEIGHT, follow.created, remove)
+
+
+def _cutoff():
+    return position(timezone.now()) - HORIZON
+
+
+def _ranked_post_ids():
+    return list(PostScore.objects.filter(
+        score__gte=_cutoff()
+    ).order_by('-score').values_list('post_id', flat=True)[
+        :settings.TRENDING_LIMIT
+    ])
+
+
+def _ranked_groups():
+    return [
+        score.group for score in GroupScore.objects.filter(
+            score__gte=_cutoff()
+        ).select_related('group').order_by('-score')[
+            :settings.TRENDING_GROUPS
+        ]
+    ]
+
+
+def trending_post_ids():
+    return cache.get_or_set(
+        POSTS_KEY, _ranked_post_ids, settings.TRENDING_CACHE_SECONDS
+    )
+
+
+def top_groups():
+    return cache.get_or_set(
+        GROUPS_KEY, _ranked_groups, settings.TRENDING_CACHE_SECONDS
+    )
+
+
+def trending_page(request):
+    """Страница ленты «В тренде» по ?page=N.
+
+    Номер страницы режет закешированный список id, поэтому из базы
+    читаются только посты самой страницы.
+    """
+    page_obj = Paginator(trending_post_ids(), COUNT_POST_PAGE).get_page(
+        request.GET.get('page')
+    )
+    posts = Post.objects.for_feed().in_bulk(page_obj.object_list)
+    page_obj.object_list = [
+        posts[pk] for pk in page_obj.object_list if pk in posts
+    ]
+    return page_obj
+
+
+def _sum(scores, key, score):
+    scores[key] = score if key not in scores else _plus(scores[key], score)
+
+
+def recompute(batch_size=BATCH_SIZE):
+    """Пересчитывает оценки с нуля, возвращает (постов, групп) в рейтинге.
+
+    Учитываются только события не старше HORIZON периодов полураспада.
+    """
+    since = timezone.now() - timedelta(
+        seconds=settings.TRENDING_HALF_LIFE * HORIZON
+    )
+    post_scores, group_scores = {}, {}
+
+    def add(post_id, group_id, weight, when):
+        score = _weight(weight, when)
+        _sum(post_scores, post_id, score)
+        if group_id is not None:
+            _sum(group_scores, group_id, score)
+
+    comments = Comment.objects.filter(created__gte=since).values_list(
+        'pk', 'post_id', 'post__group_id', 'created', named=True
+    )
+    for batch in _batches(comments, batch_size):
+        for comment in batch:
+            add(
+                comment.post_id, comment.post__group_id, COMMENT_WEIGHT,
+                comment.created,
+            )
+    latest = Post.objects.filter(
+        author_id=OuterRef('author_id'), pub_date__lte=OuterRef('created')
+    ).order_by('-pub_date', '-pk')
+    follows = Follow.objects.filter(created__gte=since).annotate(
+        post_id=Subquery(latest.values('pk')[:1]),
+        group_id=Subquery(latest.values('group_id')[:1]),
+    ).values_list('pk', 'post_id', 'group_id', 'created', named=True)
+    for batch in _batches(follows, batch_size):
+        for follow in batch:
+            if follow.post_id is not None:
+                add(
+                    follow.post_id, follow.group_id, FOLLOW_WEIGHT,
+                    follow.created,
+                )
+    with transaction.atomic():
+        PostScore.objects.all().delete()
+        GroupScore.objects.all().delete()
+        PostScore.objects.bulk_create(
+            [PostScore(post_id=pk, score=score)
+             for pk, score in post_scores.items()],
+            batch_size=batch_size,
+        )
+        GroupScore.objects.bulk_create(
+            [GroupScore(group_id=pk, score=score)
+             for pk, score in group_scores.items()],
+            batch_size=batch_size,
+        )
+    cache.delete_many([POSTS_KEY, GROUPS_KEY])
+    return len(post_scores), len(group_scores)
+
+
+def record_comments(comments, groups):
+    """Учитывает комментарии, созданные bulk_create (без сигналов).
+
+    groups — id группы для каждого id поста. Веса комментариев одного
+    поста складываются заранее, и его строка обновляется один раз.
+    """
+    per_post = {}
+    for comment in comments:
+        _sum(per_post, comment.post_id, _weight(
+            COMMENT_WEIGHT, comment.created
+        ))
+    for post_id, score in per_post.items():
+        _apply(post_id, groups.get(post_id), score)
@@ -0,0 +1,138 @@
+"""Прием загружаемых картинок с ограниченным расходом памяти.
+
+Файл целиком в память не попадает: CappedUploadHandler пишет его на
+диск кусками и перестает писать, как только файл превысил
+IMAGE_UPLOAD_MAX_BYTES. Размеры картинки проверяются по заголовку,
+до декодирования пикселей. Слишком большие оригиналы уменьшаются до
+IMAGE_MAX_SIDE (JPEG декодируется сразу в уменьшенном масштабе),
+EXIF при перекодировании не сохраняется.
+"""
+import os
+import warnings
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from PIL import Image, ImageOps
+
+# Параметры сохранения при перекодировании, по формату Pillow.
+SAVE_OPTIONS = {
+    'JPEG': {'quality': 90, 'optimize': True},
+    'PNG': {'optimize': True},
+    'WEBP': {'quality': 90},
+}
+
+CONTENT_TYPES = {
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png',
+    'GIF': 'image/gif',
+    'WEBP': 'image/webp',
+}
+
+
+class CappedUploadHandler(TemporaryFileUploadHandler):
+    """Пишет файл на диск, но не больше IMAGE_UPLOAD_MAX_BYTES.
+
+    Хвост слишком большого файла отбрасывается, а в size остается его
+    настоящий размер, чтобы форма отклонила файл с понятной ошибкой.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.IMAGE_UPLOAD_MAX_BYTES:
+            return None
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded = super().file_complete(file_size)
+        uploaded.size = self.received
+        return uploaded
+
+
+def _megabytes(size):
+    return f'{size / 1024 / 1024:.0f} МБ'
+
+
+def check_size(uploaded):
+    if uploaded.size > settings.IMAGE_UPLOAD_MAX_BYTES:
+        raise ValidationError(
+            'Файл больше %(limit)s.',
+            code='file_too_large',
+            params={'limit': _megabytes(settings.IMAGE_UPLOAD_MAX_BYTES)},
+        )
+
+
+def check_dimensions(uploaded):
+    """Проверяет размеры картинки по заголовку, не декодируя пиксели."""
+    uploaded.seek(0)
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+            width, height = Image.open(uploaded).size
+    except Image.DecompressionBombError:
+        width = height = None
+    except Exception:
+        # Битый файл отклонит стандартная проверка ImageField.
+        return
+    finally:
+        uploaded.seek(0)
+    if width is None or width * height > settings.IMAGE_UPLOAD_MAX_PIXELS:
+        raise ValidationError(
+            'Слишком большая картинка: не больше %(limit)s Мпикс.',
+            code='image_too_large',
+            params={'limit': settings.IMAGE_UPLOAD_MAX_PIXELS // 10 ** 6},
+        )
+
+
+def _fit(size, max_side):
+    scale = min(max_side / max(size), 1)
+    return (max(round(size[0] * scale), 1), max(round(size[1] * scale), 1))
+
+
+def normalize(uploaded):
+    """Уменьшает огромный оригинал и убирает EXIF.
+
+    Возвращает исходный файл, если перекодировать нечего, иначе новый
+    файл в памяти: после уменьшения он занимает единицы мегабайт.
+    """
+    uploaded.seek(0)
+    image = Image.open(uploaded)
+    image_format = image.format
+    max_side = settings.IMAGE_MAX_SIDE
+    oversized = max(image.size) > max_side
+    if (
+        image_format not in SAVE_OPTIONS
+        or getattr(image, 'n_frames', 1) > 1
+        or not (oversized or 'exif' in image.info)
+    ):
+        uploaded.seek(0)
+        return uploaded
+    target = _fit(image.size, max_side)
+    if image_format == 'JPEG':
+        image.draft('RGB', target)
+    # Поворот по EXIF — уже после уменьшения: квадратной рамке
+    # thumbnail ориентация не важна, а копия получается маленькой.
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+    image = ImageOps.exif_transpose(image)
+    # Кодировщик PNG сам дописывает EXIF из image.info.
+    image.info.pop('exif', None)
+    icc_profile = image.info.get('icc_profile')
+    name = os.path.splitext(uploaded.name)[0] + {
+        'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp',
+    }[image_format]
+    options = dict(SAVE_OPTIONS[image_format])
+    if icc_profile:
+        options['icc_profile'] = icc_profile
+    content = BytesIO()
+    image.save(content, image_format, **options)
+    image.close()
+    return InMemoryUploadedFile(
+        content, uploaded.field_name, name, CONTENT_TYPES[image_format],
+        content.tell(), None,
+    )
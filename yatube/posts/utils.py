@@ -1,9 +1,127 @@
-from django.core.paginator import Paginator
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
 
 COUNT_POST_PAGE: int = 10
 
+CURSOR_SEPARATOR = '|'
+
+
+def encode_cursor(obj, field='pub_date'):
+    """Упаковывает ключ (дата, id) объекта в непрозрачный токен.
+
+    Для постов дата — pub_date, для комментариев — created.
+    """
+    raw = f'{getattr(obj, field).isoformat()}{CURSOR_SEPARATOR}{obj.pk}'
+    return urlsafe_base64_encode(force_bytes(raw))
+
+
+def decode_cursor(token):
+    """Возвращает (pub_date, id) из токена или None, если токен битый."""
+    try:
+        raw = urlsafe_base64_decode(token).decode()
+        pub_date, pk = raw.rsplit(CURSOR_SEPARATOR, 1)
+        pub_date = parse_datetime(pub_date)
+        pk = int(pk)
+    except (TypeError, ValueError, UnicodeDecodeError):
+        return None
+    if pub_date is None:
+        return None
+    return pub_date, pk
+
+
+class CursorPaginator(Paginator):
+    """Пагинатор по ключу (pub_date, id) без COUNT(*) и OFFSET.
+
+    Стоимость любой страницы одинакова: это range scan по индексу
+    от позиции курсора на per_page + 1 строк. Условие по курсору
+    записано как pub_date <= x AND (pub_date < x OR id < y), чтобы
+    граница по pub_date попадала в поиск по индексу. Общее число страниц
+    неизвестно, поэтому пагинатор описывает только окно вокруг
+    текущей страницы: есть ли страницы до и после нее.
+    """
+
+    is_cursor = True
+
+    def __init__(self, object_list, per_page, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.cursor = ''
+        self.has_next = False
+        self.has_previous = False
+        self.next_cursor = None
+        self.previous_cursor = None
+
+    @property
+    def num_pages(self):
+        return int(self.has_previous) + 1 + int(self.has_next)
+
+    @property
+    def page_range(self):
+        return range(1, self.num_pages + 1)
+
+    @property
+    def next_page_url(self):
+        return f'?after={self.next_cursor}'
+
+    @property
+    def previous_page_url(self):
+        return f'?before={self.previous_cursor}'
+
+    def _newer(self, pub_date, pk, limit):
+        """До limit строк новее ключа, от старых к новым."""
+        return list(self.object_list.filter(
+            Q(pub_date__gt=pub_date) | Q(pk__gt=pk),
+            pub_date__gte=pub_date,
+        ).order_by('pub_date', 'pk')[:limit])
+
+    def _older(self, key, limit):
+        """До limit строк старее ключа (или с начала), новые первыми."""
+        posts = self.object_list
+        if key is not None:
+            pub_date, pk = key
+            posts = posts.filter(
+                Q(pub_date__lt=pub_date) | Q(pk__lt=pk),
+                pub_date__lte=pub_date,
+            )
+        return list(posts.order_by('-pub_date', '-pk')[:limit])
+
+    def cursor_page(self, after=None, before=None):
+        """Возвращает страницу после курсора after или перед before.
+
+        Без курсора (или с битым курсором) отдается первая страница.
+        """
+        before_key = decode_cursor(before) if before else None
+        after_key = decode_cursor(after) if after else None
+        if before_key is not None:
+            rows = self._newer(*before_key, self.per_page + 1)
+            self.has_previous = len(rows) > self.per_page
+            self.has_next = True
+            rows = rows[:self.per_page][::-1]
+            self.cursor = f'before:{before}'
+        else:
+            if after_key is not None:
+                self.has_previous = True
+                self.cursor = f'after:{after}'
+            rows = self._older(after_key, self.per_page + 1)
+            self.has_next = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+        if rows:
+            self.next_cursor = encode_cursor(rows[-1])
+            self.previous_cursor = encode_cursor(rows[0])
+        else:
+            self.has_next = False
+        return Page(rows, int(self.has_previous) + 1, self)
+
 
 def paginator_page(request, posts):
-    paginator = Paginator(posts, COUNT_POST_PAGE)
+    """Страница ленты: курсорная, а по старым ссылкам ?page=N — OFFSET."""
+    after = request.GET.get('after')
+    before = request.GET.get('before')
     page_number = request.GET.get('page')
-    return paginator.get_page(page_number)
+    if page_number and not (after or before):
+        paginator = Paginator(posts, COUNT_POST_PAGE)
+        return paginator.get_page(page_number)
+    paginator = CursorPaginator(posts, COUNT_POST_PAGE)
+    return paginator.cursor_page(after=after, before=before)
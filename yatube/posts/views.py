@@ -1,19 +1,39 @@
+from django.conf import settings
+from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.db import transaction
+from django.http import Http404, JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
-from django.views.decorators.cache import cache_page
 from django.views.decorators.vary import vary_on_cookie
 
+from core.queryguard import query_budget
+
+from . import thumbnails, writebehind
+from .caching import FOLLOWS, POSTS, cache_feed
+from .comments import comments_page, requested_order
+from .conditional import (
+    conditional_page, group_validators, index_validators, post_validators,
+    profile_validators,
+)
+from .counters import author_stats
+from .feed import feed_page
 from .forms import CommentForm, PostForm
 from .models import Follow, Group, Post, User
+from .profiles import load_profile
+from .search import find_posts
+from .trending import top_groups, trending_page
 from .utils import paginator_page
 
-CACHE_TIME = 20
+# Пачка write-behind не записалась вовремя, но запись осталась в очереди.
+WRITE_PENDING = 'Готово: изменения появятся через несколько секунд.'
 
 
-@cache_page(CACHE_TIME, key_prefix='index_page')
+@query_budget(6)
 @vary_on_cookie
+@cache_feed(POSTS)
+@conditional_page(index_validators)
 def index(request):
-    posts = Post.objects.all()
+    posts = Post.objects.for_feed()
     template = 'posts/index.html'
     page_obj = paginator_page(request, posts)
     context = {
@@ -23,9 +43,13 @@ def index(request):
     return render(request, template, context)
 
 
+@query_budget(7)
+@vary_on_cookie
+@cache_feed(POSTS)
+@conditional_page(group_validators)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    posts = Post.objects.all()
+    posts = Post.objects.for_feed().filter(group=group)
     page_obj = paginator_page(request, posts)
     context = {
         'group': group,
@@ -36,41 +60,97 @@ def group_posts(request, slug):
     return render(request, template, context)
 
 
+@query_budget(10)
+@vary_on_cookie
+@cache_feed(POSTS, FOLLOWS)
+@conditional_page(profile_validators)
 def profile(request, username):
-    template = 'posts/profile.html'
-    user_author = get_object_or_404(User, username=username)
-    posts = Post.objects.filter(author=user_author)
-    user_profile = User.objects.get(username=username)
-    page_obj = paginator_page(request, posts)
-    following = Follow.objects.filter(
-        author=user_author.id,
-        user=request.user.id
-    ).exists()
+    context = load_profile(request, username)
+    return render(request, 'posts/profile.html', context)
+
+
+@query_budget(4)
+def search(request):
+    query = request.GET.get('q', '').strip()
+    posts, next_cursor = find_posts(query, after=request.GET.get('after'))
     context = {
-        'author': user_author,
+        'query': query,
         'posts': posts,
-        'page_obj': page_obj,
-        'user_profile': user_profile,
-        'following': following,
+        'next_cursor': next_cursor,
+        'is_continued': bool(request.GET.get('after')),
     }
-    return render(request, template, context)
+    return render(request, 'posts/search.html', context)
 
 
+@query_budget(5)
+def trending(request):
+    context = {
+        'page_obj': trending_page(request),
+        'groups': top_groups(),
+    }
+    return render(request, 'posts/trending.html', context)
+
+
+@query_budget(10)
+@conditional_page(post_validators)
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
+    post = get_object_or_404(
+        Post.objects.select_related('author__stats', 'group'),
+        pk=post_id
+    )
     author = post.author
     template = 'posts/post_detail.html'
     form = CommentForm(request.POST or None)
-    comment = post.comments.all()
+    order = requested_order(request)
+    comments, next_cursor = comments_page(
+        post.pk, after=request.GET.get('after'), order=order
+    )
     context = {
         'post': post,
         'author': author,
+        'author_stats': author_stats(author),
         'form': form,
-        'comment': comment,
+        'comments': comments,
+        # Прежнее имя списка комментариев в контексте.
+        'comment': comments,
+        'next_cursor': next_cursor,
+        'order': order,
     }
     return render(request, template, context)
 
 
+@query_budget(3)
+def post_comments(request, post_id):
+    """Следующая страница комментариев: фрагмент HTML или JSON."""
+    get_object_or_404(Post.objects.only('pk'), pk=post_id)
+    order = requested_order(request)
+    comments, next_cursor = comments_page(
+        post_id, after=request.GET.get('after'), order=order
+    )
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'results': [
+                {
+                    'id': comment.pk,
+                    'author': comment.author.username,
+                    'text': comment.text,
+                    'created': comment.created,
+                }
+                for comment in comments
+            ],
+            'next': next_cursor,
+        })
+    context = {
+        'post_id': post_id,
+        'comments': comments,
+        'next_cursor': next_cursor,
+        'order': order,
+    }
+    return render(request, 'posts/includes/comment_list.html', context)
+
+
+@query_budget(14)
+@transaction.atomic
 def post_create(request):
     template = 'posts/create_post.html'
     form = PostForm(
@@ -81,6 +161,8 @@ def post_create(request):
         post = form.save(commit=False)
         post.author = request.user
         post.save()
+        if post.image:
+            thumbnails.schedule(post)
         return redirect('posts:profile', username=post.author)
     context = {
         'form': form
@@ -88,6 +170,7 @@ def post_create(request):
     return render(request, template, context)
 
 
+@query_budget(8)
 def post_edit(request, post_id):
     template = 'posts/create_post.html'
     post = get_object_or_404(Post, pk=post_id)
@@ -98,8 +181,13 @@ def post_edit(request, post_id):
             instance=post,
         )
         if form.is_valid():
-            post = form.save()
-            post.author = request.user
+            post = form.save(commit=False)
+            if 'image' in form.changed_data:
+                post.thumbnail = ''
+                post.renditions = ''
+            post.save()
+            if post.image and not post.thumbnail:
+                thumbnails.schedule(post)
             return redirect('posts:post_detail', post_id)
     else:
         form = PostForm(instance=post)
@@ -112,8 +200,36 @@ def post_edit(request, post_id):
     return render(request, template, context)
 
 
+@query_budget(13)
 @login_required
 def add_comment(request, post_id):
+    if not settings.WRITE_BEHIND:
+        return _add_comment(request, post_id)
+    # Пачку пишет другой поток: ждать ее внутри своей транзакции нельзя.
+    form = CommentForm(request.POST or None)
+    if form.is_valid() and not _write_behind(
+        request, writebehind.add_comment,
+        post_id, request.user.pk, form.cleaned_data['text'],
+    ):
+        raise Http404
+    return redirect('posts:post_detail', post_id=post_id)
+
+
+def _write_behind(request, write, *args):
+    """Запись через очередь; False, если ее цели (поста, автора) нет.
+
+    Ответ очереди, не пришедший за WRITE_BEHIND_TIMEOUT, — не ошибка:
+    запись допишет поток-писатель, а пользователь увидит сообщение.
+    """
+    try:
+        return write(*args) is not None
+    except writebehind.WriteTimeout:
+        messages.info(request, WRITE_PENDING)
+        return True
+
+
+@transaction.atomic
+def _add_comment(request, post_id):
     post = get_object_or_404(Post, pk=post_id)
     form = CommentForm(request.POST or None)
     if form.is_valid():
@@ -124,19 +240,33 @@ def add_comment(request, post_id):
     return redirect('posts:post_detail', post_id=post_id)
 
 
+@query_budget(4)
+@vary_on_cookie
+@cache_feed(POSTS, FOLLOWS)
 def follow_index(request):
     if not request.user.is_authenticated:
         return redirect('/auth/login', request.user.username)
-    post_list = Post.objects.filter(author__following__user=request.user)
-    page_obj = paginator_page(request, post_list)
+    page_obj = feed_page(request, request.user)
     template = 'posts/index.html'
     context = {'page_obj': page_obj}
     return render(request, template, context)
 
 
+@query_budget(18)
 def profile_follow(request, username):
     if not request.user.is_authenticated:
         return redirect('/auth/login', request.user.username)
+    if not settings.WRITE_BEHIND:
+        return _profile_follow(request, username)
+    if not _write_behind(
+        request, writebehind.follow, request.user.pk, username
+    ):
+        raise Http404
+    return redirect('posts:profile', username)
+
+
+@transaction.atomic
+def _profile_follow(request, username):
     user = request.user
     author = get_object_or_404(User, username=username)
     if request.user != author:
@@ -147,6 +277,8 @@ def profile_follow(request, username):
     return redirect('posts:profile', username)
 
 
+@query_budget(13)
+@transaction.atomic
 def profile_unfollow(request, username):
     if not request.user.is_authenticated:
         return redirect('/auth/login', request.user.username)
@@ -0,0 +1,242 @@
+"""Пакетная запись комментариев и подписок при всплесках нагрузки.
+
+При WRITE_BEHIND вьюхи не пишут в базу сами, а кладут запись в
+очередь. Поток-писатель забирает все, что накопилось за
+WRITE_BEHIND_INTERVAL секунд (не больше WRITE_BEHIND_BATCH записей), и
+пишет одной транзакцией через bulk_create. Вместо сотни коротких
+транзакций, каждая из которых ждет блокировку записи SQLite, база
+получает одну.
+
+Запрос ждет коммита своей пачки и только потом отвечает редиректом
+(group commit): автор сразу видит свой комментарий или подписку.
+
+bulk_create не посылает сигналов, поэтому счетчики, поколения кеша,
+поисковый индекс, ленты подписок и рейтинги «В тренде» обновляют те же
+функции, что вызывают сигналы (comments_added, follows_added), один раз
+на пачку.
+
+Если пачка не записана за WRITE_BEHIND_TIMEOUT секунд, запрос
+получает WriteTimeout, а запись остается в очереди.
+"""
+import logging
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent import futures
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+from core.db import replicas
+
+from .models import Comment, Follow, Post, User
+from .signals import comments_added, follows_added
+
+logger = logging.getLogger(__name__)
+
+CommentWrite = namedtuple('CommentWrite', 'post_id author_id text')
+
+FollowWrite = namedtuple('FollowWrite', 'user_id username')
+
+
+class WriteTimeout(Exception):
+    """Пачка не записана за WRITE_BEHIND_TIMEOUT секунд."""
+
+
+def _inserted(queryset, objects, fields):
+    """Проставляет id объектам, которые вставил bulk_create.
+
+    SQLite не возвращает id из bulk_create, а с ignore_conflicts в ответе
+    есть и пропущенные дубликаты. Поэтому строки выбираются заново и
+    сопоставляются с объектами по естественному ключу fields; время
+    создания в нем отличает наши строки от чужих. Возвращает объекты,
+    которые нашлись в базе.
+    """
+    waiting = {}
+    for obj in objects:
+        key = tuple(getattr(obj, field) for field in fields)
+        waiting.setdefault(key, []).append(obj)
+    created = [obj.created for obj in objects]
+    rows = queryset.filter(
+        created__range=(min(created), max(created))
+    ).order_by('pk').values_list('pk', *fields)
+    inserted = []
+    for pk, *key in rows:
+        same = waiting.get(tuple(key))
+        if same:
+            obj = same.pop(0)
+            obj.pk = pk
+            inserted.append(obj)
+    return inserted
+
+
+def _write_comments(writes):
+    """Создает комментарии к существующим постам.
+
+    Возвращает для каждой записи Comment или None, если поста нет.
+    """
+    groups = dict(Post.objects.filter(
+        pk__in={write.post_id for write in writes}
+    ).values_list('pk', 'group_id'))
+    comments = [
+        Comment(post_id=write.post_id, author_id=write.author_id,
+                text=write.text)
+        if write.post_id in groups else None
+        for write in writes
+    ]
+    created = [comment for comment in comments if comment is not None]
+    if not created:
+        return comments
+    Comment.objects.bulk_create(created)
+    comments_added(_inserted(
+        Comment.objects.filter(post_id__in=groups), created,
+        ('post_id', 'author_id', 'created', 'text'),
+    ), groups)
+    return comments
+
+
+def _write_follows(writes):
+    """Создает подписки, которых еще нет.
+
+    Возвращает для каждой записи id автора или None, если такого
+    пользователя нет. Подписка на себя ничего не создает.
+    """
+    author_ids = dict(User.objects.filter(
+        username__in={write.username for write in writes}
+    ).values_list('username', 'pk'))
+    wanted = {
+        (write.user_id, author_ids[write.username])
+        for write in writes
+        if author_ids.get(write.username) not in (None, write.user_id)
+    }
+    if wanted:
+        existing = set(Follow.objects.filter(
+            user_id__in={user_id for user_id, _ in wanted},
+            author_id__in={author_id for _, author_id in wanted},
+        ).values_list('user_id', 'author_id'))
+        follows = [
+            Follow(user_id=user_id, author_id=author_id)
+            for user_id, author_id in sorted(wanted - existing)
+        ]
+        if follows:
+            Follow.objects.bulk_create(follows, ignore_conflicts=True)
+            follows_added(_inserted(
+                Follow.objects.filter(
+                    user_id__in={follow.user_id for follow in follows}
+                ),
+                follows,
+                ('user_id', 'author_id', 'created'),
+            ))
+    return [author_ids.get(write.username) for write in writes]
+
+
+def write_batch(writes):
+    """Пишет пачку записей одной транзакцией, результаты — по порядку."""
+    results = [None] * len(writes)
+    with transaction.atomic():
+        for kind, write_kind in (
+            (CommentWrite, _write_comments),
+            (FollowWrite, _write_follows),
+        ):
+            indexes = [
+                index for index, write in enumerate(writes)
+                if isinstance(write, kind)
+            ]
+            if not indexes:
+                continue
+            written = write_kind([writes[index] for index in indexes])
+            for index, result in zip(indexes, written):
+                results[index] = result
+    return results
+
+
+class WriteBehindQueue:
+    """Очередь записей с потоком-писателем, который пишет пачками."""
+
+    def __init__(self, interval, batch_size):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pending = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def submit(self, write):
+        """Ставит запись в очередь, результат придет в Future."""
+        future = futures.Future()
+        self.pending.put((write, future))
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self._run, name='write-behind', daemon=True
+                )
+                self.thread.start()
+        return future
+
+    def _collect(self):
+        batch = [self.pending.get()]
+        deadline = time.monotonic() + self.interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.pending.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            self.write(self._collect())
+
+    def write(self, batch):
+        close_old_connections()
+        try:
+            results = write_batch([write for write, _ in batch])
+        except Exception as error:
+            logger.exception('Не удалось записать пачку из %s', len(batch))
+            for _, future in batch:
+                future.set_exception(error)
+        else:
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+        finally:
+            close_old_connections()
+
+
+_queue = None
+
+_queue_lock = threading.Lock()
+
+
+def _submit(write):
+    global _queue
+    if connection.in_atomic_block:
+        # Открытая транзакция запроса держит блокировку SQLite, и
+        # поток-писатель не сможет закоммитить пачку, которую мы ждем.
+        raise RuntimeError('Запись через очередь внутри транзакции')
+    # Пишет другой поток, а читать свою запись должен этот запрос.
+    replicas.pin()
+    with _queue_lock:
+        if _queue is None:
+            _queue = WriteBehindQueue(
+                settings.WRITE_BEHIND_INTERVAL, settings.WRITE_BEHIND_BATCH
+            )
+    future = _queue.submit(write)
+    try:
+        return future.result(settings.WRITE_BEHIND_TIMEOUT)
+    except futures.TimeoutError as error:
+        raise WriteTimeout(
+            f'Пачка не записана за {settings.WRITE_BEHIND_TIMEOUT} с'
+        ) from error
+
+
+def add_comment(post_id, author_id, text):
+    """Комментарий через очередь; None, если поста нет."""
+    return _submit(CommentWrite(post_id, author_id, text))
+
+
+def follow(user_id, username):
+    """Подписка через очередь; id автора или None, если его нет."""
+    return _submit(FollowWrite(user_id, username))
@@ -0,0 +1,22 @@
+"""ASGI-вход: uvicorn yatube.asgi:application (или любой ASGI 3-сервер).
+
+Django 2.2 не умеет ASGI, поэтому WSGI-приложение проекта обслуживает
+адаптер a2wsgi: каждый запрос целиком выполняется в пуле из
+ASGI_THREADS потоков.
+"""
+import os
+
+from a2wsgi import WSGIMiddleware
+from django.conf import settings
+from django.core.wsgi import get_wsgi_application
+
+from core.db.pool import check_capacity
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
+
+wsgi_application = get_wsgi_application()
+
+# Соединение с базой держат потоки запросов и потоки пула core.parallel.
+check_capacity(settings.ASGI_THREADS + settings.DB_POOL_THREADS)
+
+application = WSGIMiddleware(wsgi_application, workers=settings.ASGI_THREADS)
@@ -24,11 +24,16 @@ INSTALLED_APPS = [
     'users.apps.UsersConfig',
     'core.apps.CoreConfig',
     'about.apps.AboutConfig',
+    'api.apps.ApiConfig',
     'sorl.thumbnail',
 ]
 
 MIDDLEWARE = [
+    'core.instrumentation.InstrumentationMiddleware',
+    'core.queryguard.QueryGuardMiddleware',
+    'core.db.replicas.ReplicaPinMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'django.middleware.http.ConditionalGetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -39,11 +44,36 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'yatube.urls'
 
+# Доля запросов, для которых InstrumentationMiddleware подробно
+# замеряет SQL, шаблоны и кеш и отдает заголовок Server-Timing.
+INSTRUMENTATION_SAMPLE_RATE: float = 0.05
+
+# Сторож SQL (core.queryguard) проверяет бюджеты запросов вьюх, ищет
+# N+1 и медленные запросы. В строгом режиме нарушения бюджета и N+1
+# роняют запрос исключением; его включает тестовый раннер.
+QUERY_GUARD = DEBUG
+
+QUERY_GUARD_STRICT = False
+
+# Сколько раз одна форма SQL может выполниться за запрос до метки N+1.
+QUERY_GUARD_REPEAT_LIMIT: int = 3
+
+QUERY_GUARD_SLOW_MS: int = 100
+
+TEST_RUNNER = 'core.testrunner.GuardedTestRunner'
+
+# Адреса, с которых доступна страница метрик /metrics/.
+INTERNAL_IPS = [
+    '127.0.0.1',
+    '::1',
+]
+
 TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'core.instrumentation.InstrumentedTemplates',
+        'NAME': 'django',
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -64,13 +94,106 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 
 WSGI_APPLICATION = 'yatube.wsgi.application'
 
+# Под ASGI (yatube/asgi.py) запросы выполняются в пуле из ASGI_THREADS
+# потоков адаптера a2wsgi.
+ASGI_THREADS: int = 32
+
+# При PARALLEL_QUERIES независимые запросы страницы (профиль) идут
+# одновременно в пуле из DB_POOL_THREADS потоков (core.parallel): это
+# выгодно для удаленной базы, а для SQLite в том же процессе переход
+# между потоками дороже самого запроса.
+PARALLEL_QUERIES = False
+
+DB_POOL_THREADS: int = 16
+
+# База выбирается переменной окружения YATUBE_DB:
+#   sqlite     — файл YATUBE_DB_NAME (по умолчанию db.sqlite3 рядом с
+#                manage.py), по умолчанию;
+#   postgresql — база YATUBE_DB_NAME на YATUBE_DB_HOST:YATUBE_DB_PORT,
+#                пользователь YATUBE_DB_USER с паролем YATUBE_DB_PASSWORD
+#                (нужен пакет psycopg2).
+# Бэкенды core.db держат не больше YATUBE_DB_POOL_SIZE соединений в
+# пуле (0 — без пула), физическое соединение живет
+# YATUBE_DB_CONN_MAX_AGE секунд (см. core/db/pool.py). Под ASGI пул не
+# меньше ASGI_THREADS + DB_POOL_THREADS, иначе приложение не запустится.
+DATABASE_BACKEND = os.getenv('YATUBE_DB', 'sqlite')
+
+DATABASE_NAME = os.getenv('YATUBE_DB_NAME')
+
+DATABASE_BACKENDS = {
+    'sqlite': {
+        'ENGINE': 'core.db.sqlite3',
+        'NAME': DATABASE_NAME or os.path.join(BASE_DIR, 'db.sqlite3'),
+        'PRAGMAS': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'mmap_size': 256 * 1024 * 1024,
+            'busy_timeout': 5000,
+        },
+        'TRANSACTION_MODE': 'IMMEDIATE',
+    },
+    'postgresql': {
+        'ENGINE': 'core.db.postgresql',
+        'NAME': DATABASE_NAME or 'yatube',
+        'HOST': os.getenv('YATUBE_DB_HOST', '127.0.0.1'),
+        'PORT': os.getenv('YATUBE_DB_PORT', '5432'),
+        'USER': os.getenv('YATUBE_DB_USER', 'yatube'),
+        'PASSWORD': os.getenv('YATUBE_DB_PASSWORD', ''),
+    },
+}
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        **DATABASE_BACKENDS[DATABASE_BACKEND],
+        'CONN_MAX_AGE': int(os.getenv('YATUBE_DB_CONN_MAX_AGE', 600)),
+        'POOL': {
+            'MAX_SIZE': int(os.getenv(
+                'YATUBE_DB_POOL_SIZE', ASGI_THREADS + DB_POOL_THREADS
+            )),
+            # Сколько секунд запрос ждет свободное соединение.
+            'TIMEOUT': 10,
+            # Простоявшее дольше соединение проверяется перед выдачей.
+            'CHECK_INTERVAL': 30,
+        },
     }
 }
 
+# Реплики только для чтения — YATUBE_DB_REPLICAS через запятую: файлы
+# SQLite (их обновляет manage.py sync_replicas) или хосты PostgreSQL с
+# потоковой репликацией. Чтения идут на реплики replica1, replica2...,
+# запись — в default (core.db.replicas). После записи чтения
+# пользователя REPLICA_PIN_SECONDS секунд идут в основную базу, поэтому
+# реплики не должны отставать дольше.
+DATABASE_REPLICA_LOCATIONS = [
+    location.strip()
+    for location in os.getenv('YATUBE_DB_REPLICAS', '').split(',')
+    if location.strip()
+]
+
+DATABASE_REPLICAS = [
+    f'replica{number}'
+    for number in range(1, len(DATABASE_REPLICA_LOCATIONS) + 1)
+]
+
+DATABASES.update({
+    alias: {
+        **DATABASES['default'],
+        'NAME' if DATABASE_BACKEND == 'sqlite' else 'HOST': location,
+        # Запись в реплику SQLite по ошибке роутера — ошибка, а не
+        # расхождение с основной базой.
+        'PRAGMAS': {
+            **DATABASES['default'].get('PRAGMAS', {}),
+            'query_only': 1,
+        },
+        'TEST': {'MIRROR': 'default'},
+    }
+    for alias, location in zip(DATABASE_REPLICAS, DATABASE_REPLICA_LOCATIONS)
+})
+
+DATABASE_ROUTERS = ['core.db.replicas.ReplicaRouter']
+
+REPLICA_PIN_SECONDS: int = 5
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -106,13 +229,121 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
 POSTS_NUMBER: int = 10
 
+# Авторы с большим числом подписчиков не раскладывают посты по лентам,
+# их посты подмешиваются в ленту подписок при чтении.
+FEED_FANOUT_LIMIT: int = 1000
+
+# Сколько последних постов автора попадает в ленту при подписке.
+FEED_BACKFILL_LIMIT: int = 500
+
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Миниатюры картинок строятся в фоновом пуле потоков после коммита.
+# При THUMBNAIL_ASYNC = False они строятся сразу, в том же запросе.
+THUMBNAIL_ASYNC = True
+
+THUMBNAIL_WORKERS: int = 2
+
+# Неудачная нарезка повторяется до THUMBNAIL_ATTEMPTS раз; перед
+# попыткой N пауза (N - 1) * THUMBNAIL_RETRY_DELAY секунд.
+THUMBNAIL_ATTEMPTS: int = 3
+
+THUMBNAIL_RETRY_DELAY: float = 30
+
+# Комментарии и подписки пишутся пачками из фонового потока
+# (posts.writebehind): запрос ждет коммита своей пачки. Включается при
+# всплесках нагрузки, когда запись упирается в блокировки SQLite.
+WRITE_BEHIND = False
+
+# Сколько секунд поток-писатель собирает пачку.
+WRITE_BEHIND_INTERVAL: float = 0.005
+
+WRITE_BEHIND_BATCH: int = 500
+
+# Сколько секунд запрос ждет коммита своей пачки.
+WRITE_BEHIND_TIMEOUT: float = 10
+
+# Рейтинги «В тренде» (posts.trending): вес комментария или подписки
+# вдвое уменьшается каждые TRENDING_HALF_LIFE секунд. Страница берет
+# из кеша TRENDING_LIMIT лучших постов и TRENDING_GROUPS групп,
+# список пересчитывается раз в TRENDING_CACHE_SECONDS секунд.
+TRENDING_HALF_LIFE: int = 12 * 60 * 60
+
+TRENDING_LIMIT: int = 100
+
+TRENDING_GROUPS: int = 10
+
+TRENDING_CACHE_SECONDS: int = 60
+
+# Загрузки больше FILE_UPLOAD_MAX_MEMORY_SIZE пишутся во временный файл
+# кусками; CappedUploadHandler перестает писать после
+# IMAGE_UPLOAD_MAX_BYTES, и форма отклоняет такой файл.
+FILE_UPLOAD_HANDLERS = [
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'posts.uploads.CappedUploadHandler',
+]
+
+IMAGE_UPLOAD_MAX_BYTES: int = 20 * 1024 * 1024
+
+# Картинки больше этого числа пикселей отклоняются по заголовку файла.
+IMAGE_UPLOAD_MAX_PIXELS: int = 40_000_000
+
+# Оригиналы с большей стороной длиннее IMAGE_MAX_SIDE уменьшаются.
+IMAGE_MAX_SIDE: int = 2560
+
+# Общий кеш (L2) выбирается переменной окружения YATUBE_CACHE:
+#   locmem    — память процесса, для разработки и тестов (по умолчанию);
+#   memcached — memcached по адресу YATUBE_CACHE_LOCATION
+#               (нужен пакет python-memcached);
+#   redis     — Redis по адресу YATUBE_CACHE_LOCATION
+#               (нужен пакет django-redis);
+#   file      — файловый кеш в каталоге YATUBE_CACHE_LOCATION,
+#               для развертывания на одном сервере.
+# Поверх него кеш default держит L1 в памяти процесса.
+CACHE_BACKEND = os.getenv('YATUBE_CACHE', 'locmem')
+
+CACHE_LOCATION = os.getenv('YATUBE_CACHE_LOCATION')
+
+CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'shared',
+    },
+    'memcached': {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': CACHE_LOCATION or '127.0.0.1:11211',
+    },
+    'redis': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': CACHE_LOCATION or 'redis://127.0.0.1:6379/1',
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': CACHE_LOCATION or os.path.join(BASE_DIR, 'django_cache'),
+    },
+}
+
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+        'BACKEND': 'core.cache.TwoTierCache',
+        'LOCATION': 'shared',
+        'OPTIONS': {
+            'L1_TIMEOUT': 2,
+            'L1_MAX_ENTRIES': 1000,
+            'LOCK_TIMEOUT': 10,
+            # Поколения лент и блокировки их пересчета читаются из общего
+            # кеша: после записи другие воркеры сразу перестают отдавать
+            # старые страницы и ждать отпущенную блокировку.
+            'L1_EXEMPT': ('generation.', 'lock.'),
+        },
+    },
+    'shared': CACHE_BACKENDS[CACHE_BACKEND],
 }
+
+# Срок страницы лент в кеше (posts.caching.cache_feed), если вьюха не
+# задала свой. Запись сбрасывает страницы раньше, сменой поколения; за
+# срок же страница, которая долго считается, пересчитывается заранее.
+CACHE_TTL: int = 300